@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Text extraction benchmark
+
+Measures pages per second of extract_text_from_pdf on the bundled pdf/
+samples, comparing the previous concatenation-based extractor with the
+single-pass generator extractor and its process-pool mode.
+
+Usage:
+    python -m benchmarks.bench_extract [--repeat 20] [--processes 4] [pdf_dir]
+"""
+
+import argparse
+import os
+import time
+
+import fitz  # PyMuPDF
+
+from src.pdf_to_json import extract_text_from_pdf
+
+
+def legacy_extract_text_from_pdf(pdf_path):
+    """The extractor as it was before the single-pass rewrite, kept for comparison."""
+    with fitz.open(pdf_path) as doc:
+        full_text = ""
+        metadata = doc.metadata
+        if metadata.get("subject"):
+            full_text += f"Subject: {metadata.get('subject')}\n\n"
+        if metadata.get("title"):
+            full_text += f"Title: {metadata.get('title')}\n\n"
+
+        for page_num, page in enumerate(doc, start=1):
+            full_text += f"=== Page {page_num} ===\n"
+            blocks = page.get_text("dict")["blocks"]
+            for block in blocks:
+                if block["type"] == 0:
+                    for line in block["lines"]:
+                        line_text = " ".join(span["text"] for span in line["spans"])
+                        if line_text.strip():
+                            full_text += line_text + "\n"
+                    full_text += "\n"
+
+            tables = []
+            for block in blocks:
+                if block["type"] == 0 and "lines" in block:
+                    lines = [" ".join(span["text"] for span in line["spans"]) for line in block["lines"]]
+                    if len(lines) >= 2:
+                        potential_table = True
+                        for line in lines:
+                            if len(line) < 5:
+                                continue
+                            if '  ' not in line and '\t' not in line and '|' not in line:
+                                potential_table = False
+                                break
+                        if potential_table:
+                            tables.append("\n".join(lines))
+            if tables:
+                full_text += "\n=== Tables on Page " + str(page_num) + " ===\n"
+                for i, table in enumerate(tables, 1):
+                    full_text += f"Table {i}:\n{table}\n\n"
+            full_text += "\n"
+        return full_text.strip()
+
+
+def time_extractor(extractor, pdf_paths, repeat):
+    """Run an extractor over all PDFs ``repeat`` times and return (seconds, outputs)."""
+    outputs = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in pdf_paths:
+            outputs[path] = extractor(path)
+    return time.perf_counter() - start, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF text extraction.")
+    parser.add_argument("pdf_dir", nargs="?", default="pdf", help="Folder containing sample PDFs")
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the sample set")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2,
+                        help="Worker processes for the process-pool mode")
+    args = parser.parse_args()
+
+    pdf_paths = sorted(
+        os.path.join(args.pdf_dir, name) for name in os.listdir(args.pdf_dir) if name.lower().endswith(".pdf")
+    )
+    if not pdf_paths:
+        print(f"❌ No PDF files found in '{args.pdf_dir}'.")
+        return
+
+    pages = 0
+    for path in pdf_paths:
+        with fitz.open(path) as doc:
+            pages += doc.page_count
+    total_pages = pages * args.repeat
+    print(f"🔍 {len(pdf_paths)} PDFs, {pages} pages, {args.repeat} passes")
+
+    # Merge every sample into one long document so the process pool has work to split
+    merged_path = os.path.join(args.pdf_dir, ".bench_merged.pdf")
+    with fitz.open() as merged:
+        while merged.page_count < 64:
+            for path in pdf_paths:
+                with fitz.open(path) as doc:
+                    merged.insert_pdf(doc)
+        merged.save(merged_path)
+        merged_pages = merged.page_count
+
+    try:
+        before, legacy_outputs = time_extractor(legacy_extract_text_from_pdf, pdf_paths, args.repeat)
+        after, new_outputs = time_extractor(extract_text_from_pdf, pdf_paths, args.repeat)
+        mismatched = [path for path in pdf_paths if legacy_outputs[path] != new_outputs[path]]
+
+        print(f"{'extractor':<28}{'seconds':>10}{'pages/s':>12}")
+        print(f"{'before (concatenation)':<28}{before:>10.3f}{total_pages / before:>12.1f}")
+        print(f"{'after (single pass)':<28}{after:>10.3f}{total_pages / after:>12.1f}")
+
+        serial, _ = time_extractor(extract_text_from_pdf, [merged_path], 1)
+        pooled, _ = time_extractor(
+            lambda path: extract_text_from_pdf(path, processes=args.processes), [merged_path], 1
+        )
+        print(f"\n📚 Merged document: {merged_pages} pages")
+        print(f"{'single process':<28}{serial:>10.3f}{merged_pages / serial:>12.1f}")
+        print(f"{f'{args.processes} processes':<28}{pooled:>10.3f}{merged_pages / pooled:>12.1f}")
+
+        if mismatched:
+            print(f"⚠️ Output differs from the legacy extractor for: {', '.join(mismatched)}")
+        else:
+            print("✅ Output identical to the legacy extractor")
+    finally:
+        os.remove(merged_path)
+
+
+if __name__ == "__main__":
+    main()
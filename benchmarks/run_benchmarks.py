@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline benchmark
+
+Runs every pipeline stage against the bundled pdf/ samples plus synthetic
+papers, with Gemini replaced by the deterministic local stand-in in
+src/fake_llm.py. Reports wall time, throughput and peak Python memory per
+stage, saves the results to benchmarks/results/ and compares them with the
+previous run so regressions stand out.
+
+Usage:
+    python -m benchmarks.run_benchmarks [--papers 200] [--latency 0.5] [--workers 8]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import fitz  # PyMuPDF
+
+from src import metrics
+from src.fake_llm import fake_llm
+from src.pdf_to_json import extract_text_from_pdf, refine_extracted_text, convert_pdfs_concurrently
+from src.json_to_markdown import collect_all_questions, ask_gemini_to_format, format_questions_locally, save_markdown
+from src.most_likely_questions import generate_most_likely_questions
+from src.markdown_to_pdf import markdown_to_pdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# A stage slower than the previous run by more than this fraction is flagged
+REGRESSION_THRESHOLD = 0.20
+
+SUBJECTS = ["Data Mining", "Operating Systems", "Computer Networks", "Compiler Design"]
+VERBS = ["Explain", "Describe", "Compare", "Illustrate", "Discuss", "Define", "Derive", "Outline"]
+TOPICS = [
+    "process scheduling", "page replacement", "deadlock avoidance", "the CRISP-DM model", "data cleaning",
+    "association rules", "decision tree induction", "TCP congestion control", "routing algorithms",
+    "lexical analysis", "LR parsing", "code optimization", "virtual memory", "k-means clustering",
+    "the OSI reference model", "semaphores", "syntax directed translation", "error detection codes",
+]
+DETAILS = ["with an example", "with a neat diagram", "in detail", "briefly", "with suitable examples", ""]
+
+
+def make_synthetic_papers(folder, count, seed=42):
+    """Write ``count`` deterministic exam-paper PDFs into ``folder``."""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for number in range(count):
+        subject = SUBJECTS[number % len(SUBJECTS)]
+        year = 2015 + number % 10
+        lines = [f"Subject: {subject}", f"Semester End Examination {year}", "Answer ALL questions", ""]
+        question_number = 1
+        for unit in ["I", "II", "III", "IV", "V"]:
+            lines.append(f"UNIT - {unit}")
+            for _ in range(rng.randint(2, 4)):
+                question = f"{rng.choice(VERBS)} {rng.choice(TOPICS)} {rng.choice(DETAILS)}".strip()
+                lines.append(f"{question_number}. {question}. ({rng.choice([4, 5, 6, 8, 10])} marks)")
+                question_number += 1
+        with fitz.open() as doc:
+            for start in range(0, len(lines), 40):
+                page = doc.new_page()
+                y = 60
+                for line in lines[start:start + 40]:
+                    page.insert_text((50, y), line, fontsize=10)
+                    y += 18
+            doc.save(os.path.join(folder, f"synthetic_{number:04d}.pdf"))
+
+
+class StageTimer:
+    """Collects wall time, item counts and peak traced memory per stage."""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, items, func, *args, **kwargs):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        self.results[name] = {
+            "seconds": round(seconds, 6),
+            "items": items,
+            "items_per_second": round(items / seconds, 3) if seconds else None,
+            "peak_memory_mb": round(peak / (1024 * 1024), 3),
+        }
+        print(f"{name:<34}{seconds:>10.3f}s{items:>8} items{peak / (1024 * 1024):>10.1f} MB")
+        return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results():
+    """Return the most recent stored result, if any."""
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    files = sorted(name for name in os.listdir(RESULTS_DIR) if name.endswith(".json"))
+    if not files:
+        return None
+    with open(os.path.join(RESULTS_DIR, files[-1]), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(current, previous):
+    """Print per-stage changes against the previous run and flag regressions."""
+    print(f"\n📈 Compared with {previous['revision']} ({previous['timestamp']}):")
+    regressions = 0
+    for stage, result in current["stages"].items():
+        before = previous["stages"].get(stage)
+        if not before or not before["seconds"]:
+            continue
+        change = (result["seconds"] - before["seconds"]) / before["seconds"]
+        flag = ""
+        if change > REGRESSION_THRESHOLD:
+            flag = "  ⚠️ regression"
+            regressions += 1
+        print(f"{stage:<34}{before['seconds']:>10.3f}s -> {result['seconds']:>8.3f}s ({change:+.0%}){flag}")
+    if not regressions:
+        print("✅ No stage regressed")
+
+
+def run(papers, latency, workers, pdf_dir):
+    timer = StageTimer()
+    workdir = tempfile.mkdtemp(prefix="qpat-bench-")
+    previous_cwd = os.getcwd()
+    tracemalloc.start()
+    try:
+        # The pipeline uses paths relative to the working directory (pdf/, json_data/, md/, cache/)
+        os.chdir(workdir)
+        for folder in ["pdf", "json_data", "md", "output"]:
+            os.makedirs(folder)
+        for name in os.listdir(pdf_dir):
+            if name.lower().endswith(".pdf"):
+                shutil.copy(os.path.join(pdf_dir, name), "pdf")
+        make_synthetic_papers("pdf", papers)
+        pdf_paths = sorted(os.path.join("pdf", name) for name in os.listdir("pdf"))
+        pages = 0
+        for path in pdf_paths:
+            with fitz.open(path) as doc:
+                pages += doc.page_count
+        print(f"🔍 {len(pdf_paths)} papers ({pages} pages), fake LLM latency {latency}s, {workers} workers\n")
+
+        texts = timer.run("extract_text_from_pdf (pages)", pages,
+                          lambda: [extract_text_from_pdf(path) for path in pdf_paths])
+        timer.run("refine_extracted_text (papers)", len(texts),
+                  lambda: [refine_extracted_text(text) for text in texts])
+
+        with fake_llm(latency) as fake:
+            results = timer.run("convert_pdf_to_json (papers)", len(pdf_paths),
+                                convert_pdfs_concurrently, pdf_paths, max_workers=workers)
+            bank = timer.run("collect_all_questions (papers)", len(pdf_paths),
+                             collect_all_questions, "json_data")
+            questions = bank.to_dicts()
+            timer.run("format_questions_locally (questions)", len(questions),
+                      format_questions_locally, questions)
+            markdown = timer.run("ask_gemini_to_format (questions)", len(questions),
+                                 ask_gemini_to_format, questions)
+            save_markdown(markdown, "md/optimized_questions.md")
+            timer.run("generate_most_likely_questions", 1,
+                      generate_most_likely_questions, questions, "md/predicted_questions.md")
+            timer.run("markdown_to_pdf (first render)", 1,
+                      markdown_to_pdf, "md/optimized_questions.md", "output/output.pdf")
+            timer.run("markdown_to_pdf (repeat)", 1,
+                      markdown_to_pdf, "md/optimized_questions.md", "output/output.pdf")
+            llm_calls = fake.calls
+    finally:
+        os.chdir(previous_cwd)
+        tracemalloc.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "papers": len(pdf_paths),
+        "pages": pages,
+        "questions": len(questions),
+        "converted": sum(results.values()),
+        "llm_calls": llm_calls,
+        "latency": latency,
+        "workers": workers,
+        "stages": timer.results,
+        "metrics": metrics.summarize(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the QPAT pipeline offline.")
+    parser.add_argument("--papers", type=int, default=100, help="Synthetic papers added to the pdf/ samples")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per LLM call")
+    parser.add_argument("--workers", type=int, default=4, help="Papers converted concurrently")
+    parser.add_argument("--pdf-dir", default=os.path.join(REPO_ROOT, "pdf"), help="Folder of sample PDFs")
+    parser.add_argument("--no-save", action="store_true", help="Do not store the results")
+    args = parser.parse_args()
+
+    previous = previous_results()
+    current = run(args.papers, args.latency, args.workers, os.path.abspath(args.pdf_dir))
+    print(f"\n✅ {current['converted']}/{current['papers']} papers converted, "
+          f"{current['questions']} questions, {current['llm_calls']} LLM calls")
+
+    if previous:
+        compare(current, previous)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{current['revision']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"💾 Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,22 @@ import shutil
 import tempfile
 import base64
 from io import BytesIO
-from dotenv import load_dotenv
 import markdown
 import json
 
 # Import functions from existing files
-from src.pdf_to_json import configure_gemini_api, convert_pdf_to_json
-from src.json_to_markdown import collect_all_questions, ask_gemini_to_format, save_markdown
+from src.pdf_to_json import DEFAULT_MAX_WORKERS
 from src.markdown_to_pdf import markdown_to_pdf
-# Add import for most likely questions generator
-from src.most_likely_questions import generate_most_likely_questions
+from src.question_bank import QuestionBank
+from src.question_store import QuestionStore, paper_key_for_bytes
+from src.job_queue import JobQueue
+from src.llm import llm_cache_stats
+from src.worker import ensure_workers
+from src.workspace import new_workspace_id, workspace_for_session
+
+# Background worker processes started by the app (0 if workers are run separately)
+WORKER_COUNT = int(os.getenv("QPAT_WORKERS", 1))
+PIPELINE_STAGES = ["extract", "format", "predict", "render"]
 
 def get_binary_file_downloader_html(bin_file, file_label='File'):
     """Generate a download link for a binary file."""
@@ -22,6 +28,11 @@ def get_binary_file_downloader_html(bin_file, file_label='File'):
     b64 = base64.b64encode(data).decode()
     return f'<a href="data:application/octet-stream;base64,{b64}" download="{os.path.basename(bin_file)}">{file_label}</a>'
 
+@st.cache_resource
+def background_workers():
+    """Worker processes shared by every session of this app process."""
+    return []
+
 # App title and configuration
 st.set_page_config(
     page_title="Question Paper Analysing Tool (QPAT-01~)",
@@ -37,40 +48,73 @@ st.write("Analyze past papers, spot repeated questions, and focus on high-weight
 if 'api_configured' not in st.session_state:
     st.session_state.api_configured = False
 if 'json_data' not in st.session_state:
-    st.session_state.json_data = []
+    st.session_state.json_data = QuestionBank.from_dicts([])
 if 'markdown_content' not in st.session_state:
     st.session_state.markdown_content = ""
 if 'optimized_markdown' not in st.session_state:
     st.session_state.optimized_markdown = ""
 if 'pdf_path' not in st.session_state:
     st.session_state.pdf_path = ""
+if 'predicted_path' not in st.session_state:
+    st.session_state.predicted_path = ""
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+if 'job_result' not in st.session_state:
+    st.session_state.job_result = None
+if 'job_error' not in st.session_state:
+    st.session_state.job_error = None
+
+# Every session works in its own folder; the id is kept in the URL so a refresh finds it again
+try:
+    workspace = workspace_for_session(st.query_params.get("workspace"))
+except ValueError:
+    st.query_params["workspace"] = new_workspace_id()
+    workspace = workspace_for_session(st.query_params["workspace"])
 
 # Sidebar for Google API key
 st.sidebar.title("Configuration")
 api_key = st.sidebar.text_input("Enter your Google API Key", type="password")
 
-# Configure API if key provided
+# The key stays in this session and is handed to the worker with each job,
+# so sessions never share or overwrite each other's key through .env
 if api_key:
-    try:
-        # Create .env file and configure API
-        with open(".env", "w") as env_file:
-            env_file.write(f'GOOGLE_API_KEY="{api_key}"\n')
-        load_dotenv()
-        
-        # Configure the API
-        configure_gemini_api()
-        
-        st.session_state.api_configured = True
-        st.sidebar.success("✅ API Key configured successfully!")
-    except Exception as e:
-        st.sidebar.error(f"❌ Error configuring API: {e}")
-        st.session_state.api_configured = False
+    st.session_state.api_configured = True
+    st.sidebar.success("✅ API Key configured successfully!")
 else:
+    st.session_state.api_configured = False
     st.sidebar.warning("⚠️ Please provide a valid Google API Key.")
 
-# Create necessary directories
-for folder in ["pdf", "json_data", "md", "output"]:
-    os.makedirs(folder, exist_ok=True)
+max_workers = st.sidebar.slider(
+    "Papers processed in parallel",
+    min_value=1,
+    max_value=16,
+    value=DEFAULT_MAX_WORKERS,
+    help="Number of PDFs sent to Gemini at the same time."
+)
+
+formatter = st.sidebar.radio(
+    "Question bank formatter",
+    ["Local (offline)", "Gemini"],
+    help="The local formatter merges repeated questions deterministically without any API calls."
+)
+
+# Persistent question bank of this session, shared across its runs
+question_store = QuestionStore(workspace.store_path)
+stored_papers = question_store.papers()
+st.sidebar.subheader("Question Bank")
+st.sidebar.caption(f"{len(stored_papers)} papers, {sum(count for _, _, count in stored_papers)} questions stored")
+subject_choice = st.sidebar.selectbox("Subject", ["All subjects"] + question_store.subjects())
+subject_filter = None if subject_choice == "All subjects" else subject_choice
+if stored_papers and st.sidebar.button("Clear stored question bank"):
+    question_store.clear()
+    st.session_state.json_data = QuestionBank.from_dicts([])
+    st.session_state.optimized_markdown = ""
+    st.session_state.job_result = None
+    st.rerun()
+
+# Processing runs as queued jobs in background workers
+job_queue = JobQueue()
+ensure_workers(background_workers(), WORKER_COUNT)
 
 # File uploader
 st.subheader("Upload your previous year question papers")
@@ -81,77 +125,116 @@ if uploaded_files and st.button("Process Files"):
     if not st.session_state.api_configured:
         st.error("❌ Please configure the Google API Key first!")
     else:
-        # Create progress bar
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        # Clean directories
-        for folder in ["pdf", "json_data"]:
-            for file in os.listdir(folder):
-                file_path = os.path.join(folder, file)
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-        
-        # Save uploaded files
-        status_text.text("Saving uploaded files...")
-        for i, uploaded_file in enumerate(uploaded_files):
-            # Save file with original name
-            pdf_path = os.path.join("pdf", uploaded_file.name)
-            with open(pdf_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            progress_bar.progress((i + 1) / (len(uploaded_files) * 3))
-        
-        # Process PDFs to JSON
-        status_text.text("Converting PDFs to JSON...")
-        successful_files = 0
-        for i, uploaded_file in enumerate(uploaded_files):
-            pdf_path = os.path.join("pdf", uploaded_file.name)
-            if convert_pdf_to_json(pdf_path):
-                successful_files += 1
-            progress_bar.progress((len(uploaded_files) + i + 1) / (len(uploaded_files) * 3))
-        
-        # Collect all questions from JSON files
-        all_questions = collect_all_questions("json_data")
-        st.session_state.json_data = all_questions
-        
-        # Convert to markdown
-        status_text.text("Creating markdown content...")
-        if all_questions:
-            # Save combined questions to a single JSON file
-            with open("json_data/all_questions.json", "w", encoding="utf-8") as f:
-                json.dump(all_questions, f, indent=2, ensure_ascii=False)
-            
-            # Generate markdown from combined questions using Gemini
-            optimized_markdown = ask_gemini_to_format(all_questions)
-            
-            if optimized_markdown:
-                st.session_state.optimized_markdown = optimized_markdown
-                
-                # Save the markdown content to file before converting to PDF
-                save_markdown(optimized_markdown, "md/optimized_questions.md")
-                
-                # Generate most likely questions
-                status_text.text("Generating most likely questions...")
-                try:
-                    generate_most_likely_questions(all_questions, "md/predicted_questions.md")
-                except Exception as e:
-                    st.error(f"Error generating most likely questions: {str(e)}")
-                
-                # Create PDF using the saved markdown file
-                status_text.text("Converting markdown to PDF...")
-                
-                # Generate PDF
-                markdown_to_pdf(INPUT_FILE = "md/optimized_questions.md", OUTPUT_FILE = "output/output.pdf")
-                
-                # Set the PDF path in session state
-                st.session_state.pdf_path = "output/output.pdf"
-                
-                progress_bar.progress(1.0)
-                status_text.text(f"✅ Processing complete! Successfully processed {successful_files} out of {len(uploaded_files)} PDF files.")
+        # Hand the upload buffers to the job, skipping papers already in the question bank
+        uploads = []
+        skipped_files = 0
+        for uploaded_file in uploaded_files:
+            pdf_buffer = uploaded_file.getbuffer()
+            paper_key = paper_key_for_bytes(pdf_buffer)
+            if question_store.has_paper(paper_key):
+                skipped_files += 1
             else:
-                status_text.error("❌ Error generating markdown.")
-        else:
-            status_text.error("❌ No questions could be extracted from the PDFs.")
+                uploads.append((uploaded_file.name, paper_key, pdf_buffer))
+        if skipped_files:
+            st.info(f"ℹ️ {skipped_files} paper(s) already in the question bank were skipped.")
+
+        # The heavy work runs in a worker process, so reruns do not interrupt it
+        st.session_state.job_error = None
+        st.session_state.job_id = job_queue.submit(workspace.root, {
+            "max_workers": max_workers,
+            "formatter": "gemini" if formatter == "Gemini" else "local",
+            "subject": subject_filter,
+            "skipped": skipped_files,
+            "uploaded": len(uploaded_files),
+        }, uploads, api_key=api_key)
+
+def load_job_result(result):
+    """Copy a finished job's outputs into the session state."""
+    with open(result["bank_path"], "r", encoding="utf-8") as f:
+        st.session_state.optimized_markdown = f.read()
+    st.session_state.json_data = question_store.query_bank(subject=result["subject"])
+    st.session_state.predicted_path = result["predicted_path"]
+    st.session_state.pdf_path = result["pdf_path"]
+    st.session_state.job_result = result
+    st.session_state.job_error = None
+
+@st.fragment(run_every=1)
+def job_status():
+    """Poll the running job and show its stage, progress and partial output."""
+    job = job_queue.get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        return
+
+    # Format and predict run at the same time, so progress is summed over every stage
+    stage_progress = job["stage_progress"]
+    st.progress(min(1.0, sum(min(1.0, stage_progress.get(stage, 0.0)) for stage in PIPELINE_STAGES) / len(PIPELINE_STAGES)))
+    if job["status"] == "queued":
+        st.text(f"⏳ {job['message']} ({job_queue.pending()} job(s) pending)")
+    elif job["status"] == "running":
+        running = [stage for stage in PIPELINE_STAGES if 0.0 <= stage_progress.get(stage, -1.0) < 1.0]
+        st.text(", ".join(f"{stage.capitalize()}: {stage_progress[stage]:.0%}" for stage in running) or job["message"])
+        st.caption(job["message"])
+        if job["partial_bank"] or job["partial_predictions"]:
+            live_tabs = st.tabs(["Question Bank", "Most Likely Question"])
+            live_tabs[0].markdown(job["partial_bank"] or "")
+            live_tabs[1].markdown(job["partial_predictions"] or "")
+    elif job["status"] == "failed":
+        st.session_state.job_id = None
+        st.session_state.job_error = job["error"]
+        st.rerun()
+    else:
+        # Load the results and hand over to the results tabs below
+        st.session_state.job_id = None
+        load_job_result(job["result"])
+        st.rerun()
+
+# After a browser refresh, pick up the workspace's last job again
+if 'workspace_restored' not in st.session_state:
+    st.session_state.workspace_restored = True
+    last_job = job_queue.latest(workspace.root)
+    if last_job and last_job["status"] in ("queued", "running"):
+        st.session_state.job_id = last_job["id"]
+    elif last_job and last_job["status"] == "done" and os.path.exists(last_job["result"]["bank_path"]):
+        load_job_result(last_job["result"])
+
+if st.session_state.job_id:
+    job_status()
+elif st.session_state.job_error:
+    st.error(f"❌ {st.session_state.job_error}")
+
+job_result = st.session_state.job_result
+if job_result and not st.session_state.job_id:
+    if job_result["failed_files"]:
+        st.warning(f"⚠️ Could not process: {', '.join(job_result['failed_files'])}")
+    if job_result["prediction_error"]:
+        st.error(f"Error generating most likely questions: {job_result['prediction_error']}")
+    cache_stats = job_result["extraction_cache"]
+    st.sidebar.caption(f"Extraction cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    run_metrics = job_result.get("metrics")
+    if run_metrics:
+        with st.sidebar.expander("Last run metrics"):
+            st.caption(
+                f"{run_metrics['pages']} pages, {run_metrics['questions']} questions extracted, "
+                f"{run_metrics['llm_calls']} model calls ({run_metrics['prompt_tokens']} prompt / "
+                f"{run_metrics['output_tokens']} output tokens, ~{run_metrics.get('boilerplate_tokens', 0)} boilerplate "
+                f"tokens stripped), {run_metrics['retries']} retries, "
+                f"{run_metrics['errors']} errors, {run_metrics['cache_hits']} cache hits / "
+                f"{run_metrics['cache_misses']} misses"
+            )
+            st.table({"Stage": list(run_metrics["stages"]), "Seconds": list(run_metrics["stages"].values())})
+    st.success(
+        f"✅ Processing complete! Successfully processed {job_result['successful']} out of "
+        f"{job_result['uploaded']} PDF files."
+    )
+
+# The workers make the model calls, so their cache statistics come with the job result
+llm_stats = job_result["llm_cache"] if job_result else llm_cache_stats()
+if llm_stats["hits"] or llm_stats["misses"]:
+    st.sidebar.caption(
+        f"LLM response cache: {llm_stats['hits']} hits, {llm_stats['misses']} misses "
+        f"({llm_stats['hit_rate']:.0%} hit rate)"
+    )
 
 # Display results if available
 if st.session_state.optimized_markdown:
@@ -167,8 +250,8 @@ if st.session_state.optimized_markdown:
     with tabs[1]:
         # Content for Most Likely Questions tab
         try:
-            if os.path.exists("md/predicted_questions.md"):
-                with open("md/predicted_questions.md", "r") as f:
+            if st.session_state.predicted_path and os.path.exists(st.session_state.predicted_path):
+                with open(st.session_state.predicted_path, "r") as f:
                     predicted_questions_content = f.read()
                 st.markdown(predicted_questions_content)
             else:
@@ -196,11 +279,12 @@ if st.session_state.optimized_markdown:
             if st.button("Generate Question Bank PDF"):
                 try:
                     with st.spinner("Generating PDF..."):
+                        result = st.session_state.job_result
                         pdf_path = markdown_to_pdf(
-                            INPUT_FILE="md/optimized_questions.md", 
-                            OUTPUT_FILE="output/output.pdf"
+                            INPUT_FILE=result["bank_path"], 
+                            OUTPUT_FILE=workspace.pdf_path
                         )
-                        st.session_state.pdf_path = "output/output.pdf"
+                        st.session_state.pdf_path = pdf_path
                         st.session_state.pdf_generated = True
                         
                         # Show download button only after successful generation
@@ -228,7 +312,7 @@ if st.session_state.optimized_markdown:
         with col3:
             # Download as Markdown
             try:
-                with open("md/predicted_questions.md", "r") as f:
+                with open(st.session_state.predicted_path, "r") as f:
                     predicted_questions_md = f.read()
                 st.download_button(
                     label="Download Most Likely Questions Markdown",
@@ -245,8 +329,8 @@ if st.session_state.optimized_markdown:
                 try:
                     with st.spinner("Generating PDF..."):
                         pdf_path = markdown_to_pdf(
-                            INPUT_FILE="md/predicted_questions.md", 
-                            OUTPUT_FILE="output/most_likely_questions.pdf"
+                            INPUT_FILE=st.session_state.predicted_path, 
+                            OUTPUT_FILE=os.path.join(workspace.output_dir, "most_likely_questions.pdf")
                         )
                         
                         if pdf_path and os.path.exists(pdf_path):
@@ -267,7 +351,7 @@ if st.session_state.optimized_markdown:
         st.markdown("---")
         with st.expander("View Raw JSON Data"):
             if st.session_state.json_data:
-                st.json(st.session_state.json_data)
+                st.json(st.session_state.json_data.to_dicts())
             else:
                 st.info("No JSON data available.")
 
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Headless batch extraction
+
+Extracts the questions of every PDF under an input folder with a pool of
+parallel workers, streaming one JSON line per paper to the output file as
+papers finish. Per-file status is kept in a SQLite manifest next to the
+output, so an interrupted run picks up where it stopped:
+
+    python -m src.batch archive/ --output archive.jsonl --workers 16
+    python -m src.batch archive/ --output archive.jsonl --retry-failed
+
+Each output line is ``{"file", "paper_key", "questions"}``. A crash between
+writing a line and recording it in the manifest can repeat that paper
+once on resume, so consumers should deduplicate on ``paper_key``.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from src import metrics
+from src.boilerplate import BoilerplateTable
+from src.pdf_to_json import DEFAULT_MAX_WORKERS, configure_gemini_api, extract_paper, get_extraction_cache
+from src.question_store import QuestionStore, paper_key_for_bytes
+from src.workspace import WORKSPACE_ID_PATTERN, WORKSPACES_DIR, Workspace
+
+# PARTIAL papers kept only some of their questions and are processed again on the next run
+PENDING, DONE, PARTIAL, FAILED = "pending", "done", "partial", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    paper_key TEXT,
+    questions INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_status ON files(status);
+"""
+
+
+class Manifest:
+    """
+    Per-file status of a batch run, stored in SQLite.
+
+    Files are identified by their path relative to the input folder; a file
+    whose size or modification time changed since it was recorded is
+    processed again.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def sync(self, files):
+        """
+        Record the files found in the input folder.
+
+        Args:
+            files (list): ``(relative_path, size, mtime)`` of every PDF
+
+        Returns:
+            int: Number of new or changed files
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            known = {path: (size, mtime) for path, size, mtime in conn.execute("SELECT path, size, mtime FROM files")}
+            changed = [(path, size, mtime) for path, size, mtime in files if known.get(path) != (size, mtime)]
+            conn.executemany(
+                "INSERT INTO files (path, size, mtime, status, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "status = excluded.status, paper_key = NULL, questions = NULL, error = NULL, attempts = 0, "
+                "updated_at = excluded.updated_at",
+                [(path, size, mtime, PENDING, now) for path, size, mtime in changed],
+            )
+        return len(changed)
+
+    def todo(self, retry_failed=False):
+        """Relative paths still to process, in path order."""
+        statuses = (PENDING, PARTIAL, FAILED) if retry_failed else (PENDING, PARTIAL)
+        placeholders = ", ".join("?" for _ in statuses)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT path FROM files WHERE status IN ({placeholders}) ORDER BY path", statuses
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark(self, path, status, paper_key=None, questions=None, error=None):
+        """Record the outcome of one file."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE files SET status = ?, paper_key = ?, questions = ?, error = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE path = ?",
+                (status, paper_key, questions, error, time.time(), path),
+            )
+
+    def counts(self):
+        """Number of files per status."""
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+
+
+def find_pdfs(input_dir):
+    """Return ``(relative_path, size, mtime)`` of every PDF under a folder."""
+    files = []
+    for folder, _, filenames in os.walk(input_dir):
+        for filename in filenames:
+            if filename.lower().endswith(".pdf"):
+                path = os.path.join(folder, filename)
+                stat = os.stat(path)
+                files.append((os.path.relpath(path, input_dir), stat.st_size, stat.st_mtime))
+    files.sort()
+    return files
+
+
+def _process_file(input_dir, relative_path, boilerplate):
+    """Read and extract one paper; runs in a worker thread."""
+    with open(os.path.join(input_dir, relative_path), "rb") as f:
+        pdf_bytes = f.read()
+    paper_key = paper_key_for_bytes(pdf_bytes)
+    return (paper_key, *extract_paper(pdf_bytes, relative_path, boilerplate=boilerplate))
+
+
+def run_batch(input_dir, output_path, manifest_path=None, max_workers=DEFAULT_MAX_WORKERS,
+              retry_failed=False, store=None):
+    """
+    Extract every PDF under ``input_dir`` that the manifest does not list as done.
+
+    Results are appended to ``output_path`` as JSON lines in completion
+    order. On Ctrl+C, queued papers are cancelled and the ones in flight
+    are finished and recorded before returning. The papers of a run share
+    one boilerplate table, so lines repeated across papers are stripped
+    from the prompts once they have been seen.
+
+    Args:
+        input_dir (str): Folder searched recursively for PDFs
+        output_path (str): JSONL file the results are appended to
+        manifest_path (str): Manifest database (defaults to ``<output>.manifest.db``)
+        max_workers (int): Papers processed at once
+        retry_failed (bool): Also retry files that failed in an earlier run
+        store (QuestionStore): Optional question bank the papers are added to
+
+    Returns:
+        dict: Number of files per status after the run
+    """
+    manifest = Manifest(manifest_path or f"{output_path}.manifest.db")
+    changed = manifest.sync(find_pdfs(input_dir))
+    todo = manifest.todo(retry_failed)
+    print(f"🔍 {len(todo)} PDF(s) to process ({changed} new or changed) with {max_workers} workers.")
+    if not todo:
+        return manifest.counts()
+
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    started = time.monotonic()
+    completed = 0
+    interrupted = False
+    with open(output_path, "a", encoding="utf-8") as output, \
+            ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as executor:
+        boilerplate = BoilerplateTable()
+        futures = {executor.submit(_process_file, input_dir, path, boilerplate): path for path in todo}
+        pending = set(futures)
+        while pending:
+            try:
+                for future in as_completed(pending):
+                    pending.discard(future)
+                    path = futures[future]
+                    completed += 1
+                    try:
+                        paper_key, questions, complete = future.result()
+                    except Exception as e:
+                        paper_key, questions, complete = None, None, False
+                        print(f"❌ Unexpected error processing {path}: {e}")
+                    store_error = None
+                    if questions is not None and store is not None:
+                        # A locked or broken bank fails this paper, not the whole batch
+                        try:
+                            store.add_paper(paper_key, os.path.basename(path), questions, complete=complete)
+                        except Exception as e:
+                            store_error = f"could not store questions: {e}"
+                            print(f"⚠️ Could not store questions from {path}: {e}")
+                    if questions is None:
+                        manifest.mark(path, FAILED, paper_key, error="extraction failed")
+                    elif store_error:
+                        manifest.mark(path, FAILED, paper_key, len(questions), error=store_error)
+                    else:
+                        output.write(json.dumps(
+                            {"file": path, "paper_key": paper_key, "questions": questions, "complete": complete},
+                            ensure_ascii=False,
+                        ) + "\n")
+                        output.flush()
+                        manifest.mark(path, DONE if complete else PARTIAL, paper_key, len(questions),
+                                      error=None if complete else "some pages could not be extracted")
+                    rate = completed / (time.monotonic() - started)
+                    print(f"📦 {completed}/{len(todo)} done ({rate:.2f} papers/s), last: {path}")
+            except KeyboardInterrupt:
+                if interrupted:
+                    raise
+                interrupted = True
+                # Papers not started stay pending in the manifest for the next run
+                cancelled = sum(future.cancel() for future in pending)
+                pending = {future for future in pending if not future.cancelled()}
+                print(f"⏹️ Interrupted: {cancelled} queued paper(s) left for the next run, "
+                      f"finishing {len(pending)} in flight (Ctrl+C again to abort)...")
+
+    return manifest.counts()
+
+
+def store_path_for(value):
+    """
+    Resolve ``--store``: a workspace id (the ``workspace`` value in the app's URL) or a bank file path.
+
+    Returns:
+        str: Path of the question bank database
+    """
+    if WORKSPACE_ID_PATTERN.match(value):
+        return Workspace(os.path.join(WORKSPACES_DIR, value)).store_path
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract questions from a folder of PDFs, resumably.")
+    parser.add_argument("input_dir", help="Folder searched recursively for PDFs")
+    parser.add_argument("--output", default="questions.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--manifest", help="Manifest database (default: <output>.manifest.db)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="Papers processed at once")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry files that failed in an earlier run")
+    parser.add_argument("--store", metavar="WORKSPACE_OR_PATH",
+                        help="Also add the papers to the question bank of this app workspace id, or to this bank file")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"❌ The folder '{args.input_dir}' does not exist.")
+        return
+
+    load_dotenv()
+    if os.getenv("GOOGLE_API_KEY"):
+        configure_gemini_api()
+
+    try:
+        counts = run_batch(
+            args.input_dir, args.output, args.manifest, args.workers, args.retry_failed,
+            QuestionStore(store_path_for(args.store)) if args.store else None,
+        )
+    finally:
+        summary = metrics.summarize()
+        metrics.record_event("batch", input_dir=args.input_dir, summary=summary)
+        # This run's file replaces those of earlier runs; it stays until the next run or worker start
+        metrics.remove_stale_prometheus()
+        metrics.write_prometheus()
+    stats = get_extraction_cache().stats()
+    print(f"✅ {counts.get(DONE, 0)} done, {counts.get(PARTIAL, 0)} partial, {counts.get(FAILED, 0)} failed, "
+          f"{counts.get(PENDING, 0)} pending.")
+    print(f"📦 Extraction cache: {stats['hits']} hits, {stats['misses']} misses")
+    print(f"📈 {summary['pages']} pages, {summary['questions']} questions, {summary['llm_calls']} model calls, "
+          f"{summary['prompt_tokens']} prompt / {summary['output_tokens']} output tokens, {summary['retries']} retries, "
+          f"~{summary['boilerplate_tokens']} boilerplate tokens stripped")
+
+
+if __name__ == "__main__":
+    main()
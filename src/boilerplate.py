@@ -0,0 +1,204 @@
+"""
+Boilerplate detection for paper text sent to the model.
+
+Question papers repeat the same lines on every page (running headers,
+footers, register-number boxes) and across every paper of an institution
+(university name, affiliation, "Answer any five questions..."). A
+BoilerplateTable counts hashed, normalised lines per paper (on how many
+pages a line appears) and per batch (in how many papers), and strips the
+repeated ones from the text before it is prompted.
+
+Only lines in the margins of a page are considered: the block above the
+first unit heading or question, and the last few lines. Question text, so
+also a question asked again in another paper, is never touched, and lines
+carrying paper details (the exam session with its year, the subject line
+above "Time:", unit headings) are always kept.
+"""
+
+import os
+import re
+import hashlib
+import threading
+
+from src import metrics
+from src.rate_limit import estimate_tokens
+from src.rule_extractor import (
+    LABEL_PATTERN, NUMBERED_TEXT_PATTERN, OR_PATTERN, SUB_PART_PATTERN, TIME_PATTERN, UNIT_PATTERN, YEAR_PATTERN,
+)
+
+# A line is boilerplate once it repeats on this many pages of a paper, or in this many papers of a batch
+MIN_PAGES = int(os.getenv("QPAT_BOILERPLATE_MIN_PAGES", 2))
+MIN_PAPERS = int(os.getenv("QPAT_BOILERPLATE_MIN_PAPERS", 2))
+# Lines of a page, from the top, that can belong to its header block
+HEADER_LINES = 20
+# Lines at the bottom of a page treated as its footer
+FOOTER_LINES = 3
+# Lines with fewer letters (marks, "BL:", "OR", table cells) are always kept
+MIN_LETTERS = 4
+
+PAGE_SPLIT_PATTERN = re.compile(r'^(?==== Page \d+ ===)', re.MULTILINE)
+TABLES_MARKER = "=== Tables on Page"
+# Page markers and the details the pipeline adds to a prompt itself
+KEEP_PREFIX_PATTERN = re.compile(r'^(===|Subject:|Title:|Year:|Current unit:)', re.IGNORECASE)
+# "0 1 a) ..." as PyMuPDF renders a boxed question number
+SPLIT_NUMBER_PATTERN = re.compile(r'^\d(?:\s?\d)?\s+\(?[a-h][).]')
+
+
+def line_key(line):
+    """
+    Hash a line after normalising case, digits and punctuation.
+
+    Digits are folded so "Page 2" and "Page 3" count as the same line.
+
+    Returns:
+        int: 64-bit hash of the normalised line
+    """
+    text = re.sub(r'\d+', '#', line.casefold())
+    text = re.sub(r'[^a-z#]+', ' ', text).strip()
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _starts_body(line):
+    """True for the first line past a page's header block: a unit heading or a question."""
+    return bool(
+        UNIT_PATTERN.match(line) or NUMBERED_TEXT_PATTERN.match(line)
+        or SUB_PART_PATTERN.match(line) or SPLIT_NUMBER_PATTERN.match(line)
+    )
+
+
+def _is_protected(lines, index):
+    """True for lines that carry paper details or too little text to be worth removing."""
+    line = lines[index]
+    if sum(char.isalpha() for char in line) < MIN_LETTERS:
+        return True
+    if KEEP_PREFIX_PATTERN.match(line) or LABEL_PATTERN.match(line) or OR_PATTERN.match(line):
+        return True
+    if _starts_body(line) or YEAR_PATTERN.search(line):
+        return True
+    # The subject is printed just above "Time: ... Max. Marks: ..."
+    following = next((other for other in lines[index + 1:] if other), "")
+    return bool(TIME_PATTERN.match(following))
+
+
+def _margin_lines(text):
+    """
+    Yield ``(page, line index, stripped line)`` for the lines in the margins of every page.
+
+    Text before the first page marker (PDF metadata) counts as page 0.
+    """
+    for page, chunk in enumerate(PAGE_SPLIT_PATTERN.split(text)):
+        lines = [line.strip() for line in chunk.split("\n")]
+        # The table candidates appended after a page's text are part of its body
+        end = next((index for index, line in enumerate(lines) if line.startswith(TABLES_MARKER)), len(lines))
+        filled = [index for index, line in enumerate(lines[:end]) if line]
+        margin = set()
+        for index in filled[:HEADER_LINES]:
+            if _starts_body(lines[index]):
+                break
+            margin.add(index)
+        margin.update(filled[-FOOTER_LINES:])
+        for index in sorted(margin):
+            if not _is_protected(lines, index):
+                yield page, index, lines[index]
+
+
+class BoilerplateTable:
+    """
+    Hashed line-frequency tables for the papers of one batch.
+
+    Register every paper with ``add_paper`` (as early as possible, so later
+    papers benefit from earlier ones), then ``strip`` the text of a paper
+    before prompting. Safe to share between threads.
+    """
+
+    def __init__(self, min_pages=MIN_PAGES, min_papers=MIN_PAPERS):
+        self.min_pages = min_pages
+        self.min_papers = min_papers
+        # paper -> {line key: number of pages it appears on}
+        self._page_counts = {}
+        # line key -> number of papers it appears in
+        self._paper_counts = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, paper):
+        with self._lock:
+            return paper in self._page_counts
+
+    def add_paper(self, paper, text):
+        """
+        Count the margin lines of a paper's full text; a paper already added is ignored.
+
+        Args:
+            paper (str): Paper name, unique within the batch
+            text (str): Full extracted text with its "=== Page N ===" markers
+        """
+        pages = {}
+        for page, _, line in _margin_lines(text):
+            pages.setdefault(line_key(line), set()).add(page)
+        with self._lock:
+            if paper in self._page_counts:
+                return
+            self._page_counts[paper] = {key: len(found_on) for key, found_on in pages.items()}
+            for key in pages:
+                self._paper_counts[key] = self._paper_counts.get(key, 0) + 1
+
+    def is_boilerplate(self, paper, key):
+        """True if the line with ``key`` repeats across the pages of ``paper`` or across papers."""
+        with self._lock:
+            pages = self._page_counts.get(paper, {}).get(key, 0)
+            papers = self._paper_counts.get(key, 0)
+        return pages >= self.min_pages or papers >= self.min_papers
+
+    def strip(self, paper, text):
+        """
+        Remove the boilerplate margin lines from (part of) a paper's text.
+
+        Returns:
+            tuple: (stripped text, number of lines removed)
+        """
+        remove = {}
+        for page, index, line in _margin_lines(text):
+            if self.is_boilerplate(paper, line_key(line)):
+                remove.setdefault(page, set()).add(index)
+        if not remove:
+            return text, 0
+
+        chunks = []
+        for page, chunk in enumerate(PAGE_SPLIT_PATTERN.split(text)):
+            dropped = remove.get(page)
+            if dropped:
+                chunk = "\n".join(line for index, line in enumerate(chunk.split("\n")) if index not in dropped)
+            chunks.append(chunk)
+        stripped = re.sub(r'\n{3,}', '\n\n', "".join(chunks))
+        return stripped, sum(len(indexes) for indexes in remove.values())
+
+    def strip_paper(self, paper, texts):
+        """
+        Strip every text sent to the model for one paper and report the savings.
+
+        Args:
+            paper (str): Paper name used with add_paper
+            texts (list): Texts of the paper about to be prompted
+
+        Returns:
+            list: The stripped texts, in order
+        """
+        stripped, lines = [], 0
+        for text in texts:
+            text_stripped, removed = self.strip(paper, text)
+            stripped.append(text_stripped)
+            lines += removed
+        if lines:
+            report_savings(paper, "".join(texts), "".join(stripped), lines)
+        return stripped
+
+
+def report_savings(paper, original, stripped, lines):
+    """Print and record the characters and estimated tokens saved on one paper."""
+    chars = len(original) - len(stripped)
+    tokens = estimate_tokens(original) - estimate_tokens(stripped)
+    print(f"✂️ {paper}: stripped {lines} boilerplate line(s), {chars} characters (~{tokens} tokens)")
+    metrics.inc("qpat_boilerplate_lines_total", lines)
+    metrics.inc("qpat_boilerplate_chars_total", chars)
+    metrics.inc("qpat_boilerplate_tokens_total", tokens)
+    metrics.record_event("boilerplate", paper=paper, lines=lines, chars=chars, tokens=tokens)
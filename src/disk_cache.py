@@ -0,0 +1,160 @@
+import os
+import time
+import hashlib
+import threading
+
+from src import metrics
+
+
+class DiskCache:
+    """
+    Persistent key/value cache stored as one file per entry.
+
+    Entries are evicted least-recently-used first once the total size on disk
+    exceeds ``max_bytes``. Recency is tracked through the file access time and
+    age through the modification time, so both survive restarts. An optional
+    ``ttl`` (seconds) expires entries regardless of use. Lookups are also
+    counted in the process metrics under ``name`` (the folder name by default).
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, ttl=None, suffix=".bin", name=None):
+        self.cache_dir = cache_dir
+        self.name = name or os.path.basename(os.path.normpath(cache_dir))
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.suffix}")
+
+    def get(self, key):
+        """
+        Return the bytes stored under ``key``, or None on a miss.
+
+        Args:
+            key (str): Cache key (a hex digest)
+
+        Returns:
+            bytes | None: Stored value
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(path)
+                if self.ttl is not None and time.time() - mtime > self.ttl:
+                    os.remove(path)
+                    raise FileNotFoundError(path)
+                with open(path, "rb") as f:
+                    data = f.read()
+                # Bump the access time so the entry becomes the most recently used
+                os.utime(path, (time.time(), mtime))
+            except OSError:
+                self.misses += 1
+                metrics.inc("qpat_cache_requests_total", cache=self.name, result="miss")
+                return None
+            self.hits += 1
+            metrics.inc("qpat_cache_requests_total", cache=self.name, result="hit")
+            return data
+
+    def set(self, key, data):
+        """
+        Store ``data`` under ``key`` and evict old entries if over budget.
+
+        Args:
+            key (str): Cache key (a hex digest)
+            data (bytes): Value to store
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ Could not write cache entry {path}: {e}")
+                return
+            try:
+                self._evict()
+            except OSError as e:
+                print(f"⚠️ Could not evict entries from {self.cache_dir}: {e}")
+
+    def delete(self, key):
+        """Remove the entry stored under ``key``, if any."""
+        with self._lock:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Evicted or replaced by another process since the scan
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        # Least recently used first
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(self.suffix):
+                    os.remove(entry.path)
+
+    def stats(self):
+        """
+        Return hit/miss counters for this cache.
+
+        Returns:
+            dict: Hits, misses, evictions and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def hash_key(*parts):
+    """
+    Build a cache key from strings or bytes.
+
+    Returns:
+        str: Hex SHA-256 digest of all parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
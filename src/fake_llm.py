@@ -0,0 +1,225 @@
+"""
+Deterministic local stand-in for Gemini.
+
+Recognises the prompts QPAT sends (question extraction, question-bank
+formatting, prediction) and answers them from the prompt itself, with a
+configurable simulated latency. Used for offline benchmarks and load tests;
+it never touches the network. A FakeQuota can be attached to answer like
+a throttled or flaky API (429 over a request quota, random 503s).
+"""
+
+import os
+import re
+import json
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from src import llm, metrics
+from src.rate_limit import estimate_tokens
+
+EXTRACTION_MARKER = "Use the following extracted text:"
+FORMAT_MARKER = "formats academic exam question banks"
+PREDICTION_MARKER = "predicting exam questions"
+SHARD_MARKER = "Do not add subject or unit headings"
+
+QUESTION_LINE = re.compile(r'^\s*(?:Q\.?\s*)?\d+\s*[.)]\s*(?:[a-z]\)\s*)?(?P<text>.+)$', re.IGNORECASE)
+MARKS = re.compile(r'[\[(]\s*(\d+)\s*(?:marks?)?\s*[\])]\s*$', re.IGNORECASE)
+YEAR = re.compile(r'\b(19\d\d|20\d\d)\b')
+UNIT = re.compile(r'^\s*unit\s*[-–:]?\s*([ivx]+|\d+)\b', re.IGNORECASE)
+SUBJECT = re.compile(r'^\s*(?:Subject|Title)\s*:\s*(.+)$', re.IGNORECASE)
+PAGE = re.compile(r'^=== Page (\d+) ===')
+JSON_QUESTION = re.compile(r'^\s*"question":\s*"(?P<text>.*)",?\s*$')
+
+
+def _extract_questions(text):
+    """Pull numbered questions, marks, year, unit, subject and page out of paper text."""
+    year_match = YEAR.search(text)
+    year = int(year_match.group(1)) if year_match else None
+    subject = None
+    unit = None
+    page = None
+    questions = []
+    for line in text.splitlines():
+        page_match = PAGE.match(line)
+        if page_match:
+            page = int(page_match.group(1))
+            continue
+        if subject is None:
+            subject_match = SUBJECT.match(line)
+            if subject_match:
+                subject = subject_match.group(1).strip()
+                continue
+        unit_match = UNIT.match(line)
+        if unit_match:
+            unit = f"Unit {unit_match.group(1).upper()}"
+            continue
+        question_match = QUESTION_LINE.match(line)
+        if not question_match:
+            continue
+        question = question_match.group("text").strip()
+        marks_match = MARKS.search(question)
+        marks = int(marks_match.group(1)) if marks_match else None
+        if marks_match:
+            question = question[:marks_match.start()].strip()
+        if question:
+            questions.append(
+                {"question": question, "marks": marks, "year": year, "unit": unit, "subject": None, "page": page}
+            )
+    for question in questions:
+        question["subject"] = subject
+    return questions
+
+
+def fake_response(model_name, prompt):
+    """
+    Answer a QPAT prompt deterministically.
+
+    Args:
+        model_name (str): Requested model (ignored, kept for signature parity)
+        prompt (str): Full prompt text
+
+    Returns:
+        str: Response text shaped like Gemini's answer to that prompt
+    """
+    if EXTRACTION_MARKER in prompt:
+        text = prompt.split(EXTRACTION_MARKER, 1)[1].split("\nImportant:", 1)[0]
+        return json.dumps(_extract_questions(text), indent=2)
+
+    if FORMAT_MARKER in prompt:
+        # Imported here: json_to_markdown itself depends on src.llm
+        from src.json_to_markdown import format_questions_locally
+        payload = prompt.split("```json", 1)[1]
+        payload = payload[:payload.rindex("]") + 1]
+        markdown_text = format_questions_locally(json.loads(payload))
+        if SHARD_MARKER in prompt:
+            # Per-unit shards are answered without subject and unit headings
+            markdown_text = "\n".join(line for line in markdown_text.splitlines() if not line.startswith("#"))
+        return markdown_text.strip()
+
+    if PREDICTION_MARKER in prompt:
+        # The bank arrives either as question-bank Markdown or as a JSON dump
+        candidates = []
+        for line in prompt.splitlines():
+            match = QUESTION_LINE.match(line) or JSON_QUESTION.match(line)
+            if match:
+                candidates.append(match.group("text"))
+        return "\n".join(f"{number}. {text}" for number, text in enumerate(candidates[:20], start=1))
+
+    # Anything else (e.g. the recheck pass) is echoed back unchanged
+    return prompt
+
+
+class FakeQuota:
+    """
+    Simulated API quota: at most ``limit`` requests per ``window`` seconds.
+
+    Requests over the quota are refused with 429, and a share
+    ``error_rate`` of the admitted ones fails with 503. Refused requests
+    do not count against the quota, as with the real API.
+    """
+
+    def __init__(self, limit=0, window=60.0, error_rate=0.0, retry_after=None, seed=None):
+        self.limit = limit
+        self.window = window
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.throttled = 0
+        self.failed = 0
+        self._sent = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Admit or refuse one request.
+
+        Returns:
+            tuple | None: ``(status, message)`` of the error to answer with,
+                or None if the request goes through
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0] >= self.window:
+                self._sent.popleft()
+            if self.limit and len(self._sent) >= self.limit:
+                self.throttled += 1
+                return 429, "Resource has been exhausted (e.g. check quota)."
+            self._sent.append(now)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.failed += 1
+                return 503, "The model is overloaded. Please try again later."
+        return None
+
+
+def quota_from_env():
+    """Build a FakeQuota from QPAT_FAKE_LLM_RPM and QPAT_FAKE_LLM_ERROR_RATE, or None if both are unset."""
+    limit = int(os.getenv("QPAT_FAKE_LLM_RPM", 0))
+    error_rate = float(os.getenv("QPAT_FAKE_LLM_ERROR_RATE", 0))
+    if not limit and not error_rate:
+        return None
+    return FakeQuota(limit, 60.0, error_rate)
+
+
+class FakeBackend(llm.LLMBackend):
+    """LLM backend answering with fake_response after a simulated latency, optionally behind a FakeQuota."""
+
+    name = "fake"
+
+    def __init__(self, latency=0.0, chunk_size=200, quota=None):
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.quota = quota
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+        refusal = self.quota.check() if self.quota is not None else None
+        if refusal is not None:
+            status, message = refusal
+            raise llm.LLMHTTPError(status, message, self.quota.retry_after if status == 429 else None)
+
+    @staticmethod
+    def _record_usage(model_name, prompt, text):
+        # Same rough four-characters-per-token estimate as the mock server
+        metrics.record_tokens(model_name, estimate_tokens(prompt), estimate_tokens(text))
+
+    def generate(self, model_name, prompt, generation_config=None):
+        self._count()
+        time.sleep(self.latency)
+        text = fake_response(model_name, prompt)
+        self._record_usage(model_name, prompt, text)
+        return text
+
+    def stream(self, model_name, prompt, generation_config=None):
+        self._count()
+        text = fake_response(model_name, prompt)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield chunk
+        self._record_usage(model_name, prompt, text)
+
+
+@contextmanager
+def fake_llm(latency=0.0, quota=None):
+    """
+    Route every model call through a FakeBackend for the duration of the block.
+
+    Args:
+        latency (float): Simulated seconds per call
+        quota (FakeQuota): Optional simulated quota to throttle against
+
+    Yields:
+        FakeBackend: The installed stand-in, whose ``calls`` counts requests
+    """
+    fake = FakeBackend(latency, quota=quota)
+    previous = llm.set_backend(fake)
+    try:
+        yield fake
+    finally:
+        llm.set_backend(previous)
@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+from contextlib import closing
+
+DEFAULT_QUEUE_PATH = os.getenv("QPAT_QUEUE_PATH", os.path.join("data", "jobs.db"))
+# A running job whose worker has not reported for this many seconds is requeued
+STALE_AFTER = float(os.getenv("QPAT_JOB_STALE_AFTER", 120))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    stage_progress TEXT,
+    message TEXT,
+    options TEXT NOT NULL,
+    workspace TEXT NOT NULL,
+    api_key TEXT,
+    result TEXT,
+    error TEXT,
+    partial_bank TEXT,
+    partial_predictions TEXT,
+    worker_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_workspace ON jobs(workspace, created_at);
+CREATE TABLE IF NOT EXISTS uploads (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    paper_key TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+
+class JobQueue:
+    """
+    Persistent queue of processing jobs stored in SQLite.
+
+    The Streamlit app submits jobs and polls their status; worker processes
+    (src/worker.py) claim queued jobs one at a time and report stage,
+    progress and partial output as they go. Several app sessions and
+    workers can share one queue file; each job writes its outputs to the
+    workspace of the session that submitted it.
+    """
+
+    def __init__(self, db_path=DEFAULT_QUEUE_PATH):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            # Queues created before stages could run in parallel
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "stage_progress" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN stage_progress TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @staticmethod
+    def _as_dict(row, with_api_key=False):
+        if row is None:
+            return None
+        job = dict(row)
+        if not with_api_key:
+            job.pop("api_key", None)
+        job["options"] = json.loads(job["options"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["stage_progress"] = json.loads(job["stage_progress"]) if job["stage_progress"] else {}
+        return job
+
+    def submit(self, workspace, options, uploads=(), api_key=None):
+        """
+        Queue a job.
+
+        The uploaded PDFs travel with the job inside the queue file, so the
+        worker reads them without any temp files. They are dropped once the
+        job finishes, together with the job's API key.
+
+        Args:
+            workspace (str): Root of the submitting session's workspace
+            options (dict): JSON-serializable job arguments (see worker.run_job)
+            uploads (iterable): ``(filename, paper_key, pdf_bytes)`` of the
+                papers to process; ``pdf_bytes`` may be a memoryview
+            api_key (str): Google API key of the submitting session
+
+        Returns:
+            str: The new job id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, message, options, workspace, api_key, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, "Waiting for a worker...", json.dumps(options), workspace, api_key, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO uploads (job_id, position, filename, paper_key, data) VALUES (?, ?, ?, ?, ?)",
+                ((job_id, position, filename, paper_key, data)
+                 for position, (filename, paper_key, data) in enumerate(uploads)),
+            )
+        return job_id
+
+    def uploads(self, job_id):
+        """Return the ``(filename, paper_key, pdf_bytes)`` uploads of a job, in submission order."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT filename, paper_key, data FROM uploads WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def claim_next(self, worker_pid):
+        """
+        Atomically mark the oldest queued job as running.
+
+        Returns:
+            dict: The claimed job, or None if the queue is empty
+        """
+        with closing(self._connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_pid = ?, attempts = attempts + 1, stage_progress = NULL, "
+                    "updated_at = ? WHERE id = ?",
+                    (RUNNING, worker_pid, time.time(), row["id"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        job = self._as_dict(row, with_api_key=True)
+        job["status"] = RUNNING
+        return job
+
+    def update_progress(self, job_id, stage, progress, message, bank=None, predictions=None):
+        """
+        Record a job's latest stage and, optionally, its partial output.
+
+        Stages may run in parallel, so the progress of each one is also kept
+        in ``stage_progress``, a map of stage to fraction done.
+        """
+        columns = {"stage": stage, "progress": progress, "message": message, "updated_at": time.time()}
+        if bank is not None:
+            columns["partial_bank"] = bank
+        if predictions is not None:
+            columns["partial_predictions"] = predictions
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments}, stage_progress = json_set(COALESCE(stage_progress, '{{}}'), ?, ?) "
+                "WHERE id = ?",
+                (*columns.values(), f"$.{stage}", progress, job_id),
+            )
+
+    def heartbeat(self, job_id):
+        """Tell the queue the job's worker is still alive."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def complete(self, job_id, result):
+        """Mark a job as done, store its result and drop its uploads."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM uploads WHERE job_id = ?", (job_id,))
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, message = ?, result = ?, api_key = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (DONE, "Processing complete.", json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id, error):
+        """Mark a job as failed with an error message and drop its uploads."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM uploads WHERE job_id = ?", (job_id,))
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, message = ?, api_key = NULL, updated_at = ? WHERE id = ?",
+                (FAILED, error, error, time.time(), job_id),
+            )
+
+    def get(self, job_id):
+        """Return a job as a dictionary, or None if it does not exist."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._as_dict(row)
+
+    def latest(self, workspace):
+        """Return the most recent job submitted from a workspace, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE workspace = ? ORDER BY created_at DESC LIMIT 1", (workspace,)
+            ).fetchone()
+        return self._as_dict(row)
+
+    def active_workspaces(self):
+        """Workspaces with queued or running jobs."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT workspace FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def forget_workspace(self, workspace):
+        """Delete the finished jobs of a removed workspace."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM jobs WHERE workspace = ? AND status IN (?, ?)", (workspace, DONE, FAILED))
+
+    def pending(self):
+        """Number of queued or running jobs."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()
+        return row[0]
+
+    def requeue_stale(self, stale_after=STALE_AFTER, max_attempts=3):
+        """
+        Put running jobs whose worker stopped reporting back in the queue.
+
+        Jobs that already used ``max_attempts`` are marked as failed instead.
+
+        Returns:
+            int: Number of jobs requeued or failed
+        """
+        cutoff = time.time() - stale_after
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM uploads WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE status = ? AND updated_at < ? AND attempts >= ?)",
+                (RUNNING, cutoff, max_attempts),
+            )
+            failed = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, message = ?, api_key = NULL, updated_at = ? "
+                "WHERE status = ? AND updated_at < ? AND attempts >= ?",
+                (FAILED, "Worker stopped responding.", "Worker stopped responding.", time.time(),
+                 RUNNING, cutoff, max_attempts),
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = NULL, message = ?, updated_at = ? "
+                "WHERE status = ? AND updated_at < ?",
+                (QUEUED, "Requeued after the worker stopped responding.", time.time(), RUNNING, cutoff),
+            ).rowcount
+        return failed + requeued
@@ -0,0 +1,90 @@
+"""
+Incremental parsing of JSON arrays of objects.
+
+Model responses are read as they stream in; every top-level object is
+decoded as soon as its closing brace arrives, so the objects of an array
+that is cut off or broken half-way are not lost with the rest.
+"""
+
+import json
+
+
+class JSONArrayParser:
+    """
+    Parse a JSON array of objects fed to it piece by piece.
+
+    Text around the array (code fences, a sentence before it) is ignored.
+    A response holding a single object instead of an array is accepted too.
+
+    Attributes:
+        malformed (int): Objects that were complete but did not decode
+    """
+
+    def __init__(self):
+        self.malformed = 0
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._array_open = False
+        self._array_closed = False
+        self._objects = 0
+
+    @property
+    def complete(self):
+        """True once the whole array (or the single object) has been read."""
+        if self._depth:
+            return False
+        return self._array_closed if self._array_open else self._objects > 0
+
+    def feed(self, text):
+        """
+        Consume the next piece of the response.
+
+        Args:
+            text (str): Next piece of the response
+
+        Returns:
+            list: Objects completed by this piece, in order, with None in
+                place of an object that failed to decode
+        """
+        results = []
+        for char in text:
+            if not self._depth:
+                # Between objects: only the array brackets and an object start matter
+                if char == "{":
+                    self._depth = 1
+                    self._buffer = [char]
+                elif char == "[" and not self._array_open:
+                    self._array_open = True
+                elif char == "]" and self._array_open:
+                    self._array_closed = True
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if not self._depth:
+                    results.append(self._decode())
+        return results
+
+    def _decode(self):
+        self._objects += 1
+        try:
+            return json.loads("".join(self._buffer))
+        except json.JSONDecodeError:
+            self.malformed += 1
+            return None
+        finally:
+            self._buffer = []
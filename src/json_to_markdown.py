@@ -1,7 +1,47 @@
 import os
+import re
 import json
+import math
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import google.generativeai as genai
+
+from src import metrics
+from src.disk_cache import DiskCache, hash_key
+from src.llm import configure_gemini, generate_text, model_for, stream_text
+from src.question_bank import QuestionBank
+
+# Jaccard similarity of question word sets at or above which two questions
+# are treated as the same question asked again
+DEFAULT_SIMILARITY_THRESHOLD = 0.8
+
+# Subject/unit shards formatted at once, and attempts per shard
+FORMAT_MAX_WORKERS = int(os.getenv("QPAT_FORMAT_MAX_WORKERS", 8))
+FORMAT_ATTEMPTS = int(os.getenv("QPAT_FORMAT_ATTEMPTS", 3))
+
+# Bump whenever the shard prompt changes so cached sections are regenerated
+SECTION_FORMAT_VERSION = "1"
+SECTION_CACHE_DIR = os.getenv("QPAT_SECTION_CACHE_DIR", os.path.join("cache", "sections"))
+SECTION_CACHE_MAX_BYTES = int(os.getenv("QPAT_SECTION_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+# Words too common to tell questions apart
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it its of on or the this to what which with".split()
+)
+
+ROMAN_NUMERALS = [
+    (1000, "M"), (900, "CM"), (500, "D"), (400, "CD"), (100, "C"), (90, "XC"),
+    (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I"),
+]
+ROMAN_VALUES = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}
+
+_section_cache = None
+
+def get_section_cache():
+    """Return the shared on-disk cache of formatted subject/unit sections."""
+    global _section_cache
+    if _section_cache is None:
+        _section_cache = DiskCache(SECTION_CACHE_DIR, max_bytes=SECTION_CACHE_MAX_BYTES, suffix=".md")
+    return _section_cache
 
 def setup_api():
     """Set up the Google Generative AI API with the API key from environment variables."""
@@ -11,7 +51,7 @@ def setup_api():
     if not api_key:
         raise ValueError("Google API Key is not set. Please provide it in the .env file.")
     
-    genai.configure(api_key=api_key)
+    configure_gemini(api_key)
     print("✅ API configured successfully")
     
 def collect_all_questions(json_root_folder):
@@ -22,14 +62,14 @@ def collect_all_questions(json_root_folder):
         json_root_folder (str): Path to the root folder containing JSON files
         
     Returns:
-        list: List of question dictionaries
+        QuestionBank: Columnar bank of all questions found
     """
     all_questions = []
     
     # Check if the folder exists
     if not os.path.exists(json_root_folder):
         print(f"❌ Folder not found: {json_root_folder}")
-        return all_questions
+        return QuestionBank.from_dicts([])
         
     print(f"🔍 Searching for JSON files in {json_root_folder}")
     
@@ -50,56 +90,485 @@ def collect_all_questions(json_root_folder):
                 except Exception as e:
                     print(f"⚠️ Error reading {full_path}: {e}")
     
-    print(f"📊 Total questions collected: {len(all_questions)}")
-    return all_questions
+    bank = QuestionBank.from_dicts(all_questions)
+    print(f"📊 Total questions collected: {len(bank)}")
+    return bank
 
-def ask_gemini_to_format(questions):
+def to_roman(number):
+    """Convert a positive integer to Roman numerals."""
+    result = []
+    for value, numeral in ROMAN_NUMERALS:
+        count, number = divmod(number, value)
+        result.append(numeral * count)
+    return "".join(result)
+
+def from_roman(numeral):
+    """Convert Roman numerals to an integer, or None if the string is not valid."""
+    numeral = numeral.upper()
+    if not numeral or any(char not in ROMAN_VALUES for char in numeral):
+        return None
+    total = 0
+    for current, following in zip(numeral, numeral[1:] + " "):
+        value = ROMAN_VALUES[current]
+        total += -value if value < ROMAN_VALUES.get(following, 0) else value
+    return total if total > 0 and to_roman(total) == numeral else None
+
+def parse_unit_number(unit):
     """
-    Send raw JSON question list to Gemini and request well-formatted Markdown.
-    
+    Read the unit number from labels such as "Unit 1", "UNIT-II" or "Unit – III".
+
+    Returns:
+        int | None: The unit number, or None if the label has none
+    """
+    if unit is None:
+        return None
+    match = re.search(r'\bunit\s*[-–—:.]?\s*([ivxlcdm]+|\d+)\b', str(unit), re.IGNORECASE)
+    if not match:
+        return None
+    value = match.group(1)
+    return int(value) if value.isdigit() else from_roman(value)
+
+def question_tokens(text):
+    """
+    Normalize question text into a set of words for similarity checks.
+
+    Case, punctuation, leading question numbers and common stop words are
+    ignored, so trivial rewordings of the same question compare equal.
+    """
+    text = str(text or "").lower()
+    text = re.sub(r'^\s*(q(uestion)?\s*)?\d+\s*[.)]\s*', '', text)
+    return frozenset(word for word in re.findall(r'[a-z0-9]+', text) if word not in STOPWORDS)
+
+def find_near_duplicates(token_sets, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Group sets whose Jaccard similarity is at least ``threshold``.
+
+    Uses prefix filtering: with tokens ordered rarest first, two sets that
+    are similar enough must share a token within their first
+    ``len - ceil(threshold * len) + 1`` tokens. Only sets sharing such a
+    prefix token are compared, which keeps the join far below quadratic
+    on real question banks.
+
+    Args:
+        token_sets (list): One frozenset of tokens per question
+        threshold (float): Minimum Jaccard similarity for a match
+
+    Returns:
+        list: Group id for every input set; matching sets share an id
+    """
+    parent = list(range(len(token_sets)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def union(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+
+    frequency = {}
+    for tokens in token_sets:
+        for token in tokens:
+            frequency[token] = frequency.get(token, 0) + 1
+
+    # Empty sets only match each other
+    empty = [index for index, tokens in enumerate(token_sets) if not tokens]
+    for index in empty[1:]:
+        union(empty[0], index)
+
+    # Visit sets from smallest to largest so the length filter only looks back
+    order = sorted((index for index, tokens in enumerate(token_sets) if tokens), key=lambda i: len(token_sets[i]))
+    index_by_token = {}
+    for index in order:
+        tokens = token_sets[index]
+        size = len(tokens)
+        ranked = sorted(tokens, key=lambda token: (frequency[token], token))
+        prefix = ranked[:size - math.ceil(threshold * size) + 1]
+
+        candidates = set()
+        for token in prefix:
+            candidates.update(index_by_token.get(token, ()))
+        for candidate in candidates:
+            other = token_sets[candidate]
+            if len(other) < threshold * size:
+                continue
+            overlap = len(tokens & other)
+            if overlap / (size + len(other) - overlap) >= threshold:
+                union(index, candidate)
+
+        for token in prefix:
+            index_by_token.setdefault(token, []).append(index)
+
+    return [find(index) for index in range(len(token_sets))]
+
+def _appearance_tag(marks, year):
+    """Format one appearance as "marks-year", or None if both are unknown."""
+    if marks is None and year is None:
+        return None
+    if isinstance(marks, float) and marks.is_integer():
+        marks = int(marks)
+    return f"{'?' if marks is None else marks}-{'?' if year is None else year}"
+
+def _year_sort_key(year):
+    try:
+        return (0, int(year))
+    except (TypeError, ValueError):
+        return (1, 0)
+
+def _render_question(number, text, tags):
+    """Render one numbered question, moving any Markdown table below the question line."""
+    lines = str(text or "").strip().splitlines()
+    head, table, tail = [], [], []
+    for line in lines:
+        if line.strip().startswith("|") and not tail:
+            table.append(line.strip())
+        elif table:
+            tail.append(line.strip())
+        else:
+            head.append(line.strip())
+
+    tag_text = f" [{', '.join(tags)}]" if tags else ""
+    parts = [f"{number}. {' '.join(part for part in head if part)}{tag_text}"]
+    if table:
+        parts.append("\n" + "\n".join(table) + "\n")
+    if any(tail):
+        parts.append(" ".join(part for part in tail if part) + "\n")
+    return "\n".join(parts)
+
+def group_by_subject(questions):
+    """
+    Group question indexes by subject (case-insensitive), in first-seen order.
+
+    Returns:
+        dict: casefolded subject -> (display name, list of question indexes)
+    """
+    subjects = {}
+    for index, question in enumerate(questions):
+        subject = str(question.get("subject") or "General").strip() or "General"
+        subjects.setdefault(subject.casefold(), (subject, []))[1].append(index)
+    return subjects
+
+def cluster_questions(questions, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Find repeated questions within each subject.
+
     Args:
         questions (list): List of question dictionaries
-        
+        threshold (float): Minimum Jaccard similarity for two questions to merge
+
+    Returns:
+        list: For every question, the index of the first question of its cluster
+    """
+    clusters = [0] * len(questions)
+    for _, indexes in group_by_subject(questions).values():
+        groups = find_near_duplicates([question_tokens(questions[i].get("question")) for i in indexes], threshold)
+        for position, group in enumerate(groups):
+            clusters[indexes[position]] = indexes[group]
+    return clusters
+
+def unit_heading(raw_unit):
+    """
+    Return (sort key, heading) for a unit label.
+
+    Numbered units sort first by number and are shown as "Unit I", "Unit II"...;
+    other labels follow in alphabetical order, then questions without a unit.
+    """
+    number = parse_unit_number(raw_unit)
+    if number is not None:
+        return (0, number, ""), f"Unit {to_roman(number)}"
+    if raw_unit:
+        return (1, 0, str(raw_unit).strip().casefold()), str(raw_unit).strip()
+    return (2, 0, ""), "Unit not specified"
+
+def appearance_tags(appearances):
+    """Format (year, marks) appearances as unique "marks-year" tags, oldest first."""
+    tags = []
+    for year, marks in sorted(appearances, key=lambda item: _year_sort_key(item[0])):
+        tag = _appearance_tag(marks, year)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+def format_questions_locally(questions, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Format the question list into the question-bank Markdown without an LLM.
+
+    Questions are grouped by subject and unit. Within a subject, repeated
+    questions (near-duplicates by word similarity) are merged into one entry
+    listing every appearance as ``[marks-year, marks-year]``. The merged
+    entry is placed under the unit and wording of its first appearance. The
+    output is deterministic for a given input order.
+
+    Args:
+        questions (list): List of question dictionaries
+        threshold (float): Minimum Jaccard similarity for two questions to merge
+
     Returns:
         str: Formatted markdown text
     """
-    print("🤖 Sending questions to Gemini for formatting...")
-    
-    prompt = f"""
+    print("🧮 Formatting questions locally...")
+
+    clusters = cluster_questions(questions, threshold)
+
+    sections = []
+    for subject_name, indexes in group_by_subject(questions).values():
+        # Collect the appearances of each merged question
+        merged = {}
+        for index in indexes:
+            question = questions[index]
+            entry = merged.setdefault(clusters[index], {"question": questions[clusters[index]], "appearances": []})
+            entry["appearances"].append((question.get("year"), question.get("marks")))
+
+        # Place each merged question under the unit of its first appearance
+        units = {}
+        for entry in merged.values():
+            key, label = unit_heading(entry["question"].get("unit"))
+            units.setdefault(key, (label, []))[1].append(entry)
+
+        lines = [f"# {subject_name}"]
+        for key in sorted(units):
+            label, entries = units[key]
+            lines.append(f"## {label}")
+            for number, entry in enumerate(entries, start=1):
+                tags = appearance_tags(entry["appearances"])
+                lines.append(_render_question(number, entry["question"].get("question"), tags))
+            lines.append("")
+        sections.append("\n".join(lines))
+
+    print(f"✅ Formatted {len(questions)} questions locally")
+    return "\n\n".join(sections).strip() + "\n"
+
+def stream_gemini_response(model_name, prompt):
+    """
+    Yield the text of a Gemini response chunk by chunk as it is generated.
+
+    Errors are printed and end the stream early, like the blocking calls
+    that return None on failure. The generator returns True if the response
+    was complete and False if it ended early (see ``yield from``).
+    """
+    try:
+        yield from stream_text(model_name, prompt)
+        print("✅ Finished streaming response from Gemini")
+        return True
+    except Exception as e:
+        print(f"❌ Error communicating with Gemini API: {e}")
+        return False
+
+def _collecting(chunks, collected):
+    """Pass the chunks of a generator through, appending them to ``collected``, and return its return value."""
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as stop:
+            return stop.value
+        collected.append(chunk)
+        yield chunk
+
+def shard_questions(questions):
+    """
+    Partition the question list by subject and unit, in a stable order.
+
+    Subjects keep their first-seen order and units sort as in the local
+    formatter, so the stitched document is the same however the shards
+    are scheduled.
+
+    Returns:
+        list: (subject name, unit heading, list of question dictionaries) per shard
+    """
+    shards = []
+    for subject_name, indexes in group_by_subject(questions).values():
+        units = {}
+        for index in indexes:
+            key, label = unit_heading(questions[index].get("unit"))
+            units.setdefault(key, (label, []))[1].append(questions[index])
+        for key in sorted(units):
+            label, unit_questions = units[key]
+            shards.append((subject_name, label, unit_questions))
+    return shards
+
+def _shard_prompt(subject_name, unit_label, questions):
+    """Build the formatting prompt for the questions of one subject unit."""
+    return f"""
 You are an assistant that formats academic exam question banks into clean **Markdown**.
 
+All of the questions below belong to the subject "{subject_name}", {unit_label}.
+
 ### Your task is:
-1. Group all questions by `"subject"` and then by `"unit"` (e.g., Unit I, Unit II).
-2. Within each unit, number the questions sequentially starting from 1.
-3. If the **same question** appears in **multiple years** or with different marks, merge their appearances like this:
+1. Number the questions sequentially starting from 1.
+2. If the **same question** appears in **multiple years** or with different marks, merge their appearances like this:
    - Example: `What is data mining? [6-2021, 4-2022]`
-4. If a question includes a **table or structured data**, display that part as a properly formatted Markdown table. Ensure newlines before and after the table so it renders correctly.
-5. Follow this **exact structure**:
-Subject Name
-Unit Name
-Question text [marks-year, marks-year]
-Another question [marks-year]
-6. Use **Markdown** syntax for formatting, including:
-- Headers
-- Lists
-- Tables
-7. Do not include any additional text or explanations outside of the Markdown content.
-8. each questions should be well structured and easy to read.
+3. If a question includes a **table or structured data**, display that part as a properly formatted Markdown table. Ensure newlines before and after the table so it renders correctly.
+4. Follow this **exact structure**:
+1. Question text [marks-year, marks-year]
+2. Another question [marks-year]
+5. Do not add subject or unit headings; they are added separately.
+6. Do not include any additional text or explanations outside of the Markdown content.
+7. each questions should be well structured and easy to read.
 Here is the raw question data in JSON format:  
 ```json
 {json.dumps(questions, indent=2)}
 
-Return ONLY the formatted Markdown content. Do not include any explanation or surrounding text.
+Return only the numbered list in Markdown. Do not include any explanation or surrounding text.
 """
+
+def section_key(shard):
+    """
+    Content hash of one subject/unit section: its questions, headings, the model and the prompt version.
+
+    A section whose key is unchanged since the last run is reused as is.
+    """
+    subject_name, unit_label, questions = shard
+    return hash_key(
+        SECTION_FORMAT_VERSION, model_for("format"), subject_name, unit_label,
+        json.dumps(questions, sort_keys=True, default=str),
+    )
+
+def _cached_section(shard):
+    """Return the section body formatted for this shard before, or None."""
+    data = get_section_cache().get(section_key(shard))
+    return data.decode("utf-8") if data is not None else None
+
+def _store_section(shard, body):
+    get_section_cache().set(section_key(shard), body.encode("utf-8"))
+
+def _report_sections(shards):
+    """Print how many sections are reused and how many must be formatted, and return the cached bodies."""
+    cached = [_cached_section(shard) for shard in shards]
+    reused = sum(body is not None for body in cached)
+    metrics.inc("qpat_format_sections_total", reused, result="reused")
+    metrics.inc("qpat_format_sections_total", len(shards) - reused, result="formatted")
+    print(f"♻️ Reusing {reused} of {len(shards)} formatted sections; formatting {len(shards) - reused}")
+    return cached
+
+def _format_shard(shard, attempts=FORMAT_ATTEMPTS):
+    """Format one shard with Gemini, retrying only that shard; fall back to local formatting."""
+    subject_name, unit_label, questions = shard
+    prompt = _shard_prompt(subject_name, unit_label, questions)
+    for attempt in range(1, attempts + 1):
+        try:
+            # Retries bypass the response cache so a bad cached answer is replaced
+            text = generate_text(model_for("format"), prompt, use_cache=attempt == 1)
+            if text and text.strip():
+                # Only model output is kept; a local fallback is retried on the next run
+                _store_section(shard, text.strip())
+                return text.strip()
+            raise ValueError("Empty response from Gemini API.")
+        except Exception as e:
+            print(f"⚠️ Formatting {subject_name} / {unit_label} failed (attempt {attempt}/{attempts}): {e}")
+            if attempt < attempts:
+                metrics.inc("qpat_retries_total", stage="format")
+    print(f"❌ Formatting {subject_name} / {unit_label} locally after {attempts} failed attempts")
+    metrics.record_event("error", stage="format_shard", subject=subject_name, unit=unit_label,
+                         error="fell back to local formatting")
+    return _local_shard_body(questions)
+
+def _local_shard_body(questions):
+    """Numbered list for one shard from the local formatter, without its headings."""
+    markdown_text = format_questions_locally(questions)
+    return "\n".join(line for line in markdown_text.splitlines() if not line.startswith("#")).strip()
+
+def _stitch(subject_name, unit_label, body, previous_subject):
+    """Return the Markdown of one shard, with the subject heading when the subject changes."""
+    heading = f"# {subject_name}\n" if subject_name != previous_subject else ""
+    separator = "\n\n" if previous_subject is not None else ""
+    return f"{separator}{heading}## {unit_label}\n{body}\n"
+
+def _stream_shards(shards, cached, max_workers):
+    """
+    Yield the sections in order: cached ones as they are, the first one to format token by token.
+
+    The other sections to format run concurrently while the first streams.
+    The generator returns the complete document, which differs from the
+    yielded chunks only when the streamed section was cut off and had to be
+    formatted again.
+    """
+    pending = [index for index, body in enumerate(cached) if body is None]
+    streamed_index = pending[0] if pending else None
+    document = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending) or 1))) as executor:
+        futures = {index: executor.submit(_format_shard, shards[index]) for index in pending[1:]}
+
+        previous_subject = None
+        for index, (subject_name, unit_label, questions) in enumerate(shards):
+            if index != streamed_index:
+                body = cached[index] if cached[index] is not None else futures[index].result()
+                document.append(_stitch(subject_name, unit_label, body, previous_subject))
+                yield document[-1]
+                previous_subject = subject_name
+                continue
+
+            heading = _stitch(subject_name, unit_label, "", previous_subject).rstrip("\n") + "\n"
+            yield heading
+            streamed = []
+            finished = yield from _collecting(
+                stream_gemini_response(model_for("format"), _shard_prompt(subject_name, unit_label, questions)), streamed
+            )
+            body = "".join(streamed)
+            if finished and body.strip():
+                _store_section(shards[index], body.strip())
+            else:
+                # A cut-off section is never cached; it is formatted again and replaces the
+                # streamed text in the returned document
+                if body.strip():
+                    print(f"⚠️ Streaming {subject_name} / {unit_label} ended early; formatting it again")
+                body = _format_shard(shards[index])
+                if not streamed:
+                    yield body
+            yield "\n"
+            document.append(f"{heading}{body}\n")
+            previous_subject = subject_name
+    return "".join(document)
+
+def ask_gemini_to_format(questions, stream=False, max_workers=FORMAT_MAX_WORKERS):
+    """
+    Send raw JSON question list to Gemini and request well-formatted Markdown.
+
+    The list is split into one shard per subject and unit. Shards are
+    formatted as concurrent requests and stitched back in a stable order, so
+    latency follows the largest shard rather than the whole bank. A failed
+    shard is retried on its own and, if it keeps failing, formatted locally.
+    Formatted sections are kept by content hash (see section_key): a shard
+    whose questions did not change since a previous run is spliced back in
+    byte for byte, so adding a paper only formats the sections it touches.
     
+    Args:
+        questions (list): List of question dictionaries
+        stream (bool): Return a generator of partial Markdown chunks instead
+            of waiting for the full response; the generator returns the
+            final Markdown, which replaces a section whose stream was cut off
+        max_workers (int): Maximum number of shards formatted at once
+        
+    Returns:
+        str: Formatted markdown text (a generator of chunks if ``stream``)
+    """
+    shards = shard_questions(questions)
+    print(f"🤖 Sending {len(shards)} subject/unit shards to Gemini for formatting...")
+    if not shards:
+        return iter(()) if stream else None
+
+    cached = _report_sections(shards)
+    if stream:
+        return _stream_shards(shards, cached, max_workers)
+
+    pending = [shard for shard, body in zip(shards, cached) if body is None]
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content(prompt)
-        print("✅ Received formatted response from Gemini")
-        return response.text
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending) or 1))) as executor:
+            formatted = iter(list(executor.map(_format_shard, pending)))
     except Exception as e:
         print(f"❌ Error communicating with Gemini API: {e}")
         return None
+    bodies = [body if body is not None else next(formatted) for body in cached]
+
+    parts = []
+    previous_subject = None
+    for (subject_name, unit_label, _), body in zip(shards, bodies):
+        parts.append(_stitch(subject_name, unit_label, body, previous_subject))
+        previous_subject = subject_name
+    print("✅ Received formatted response from Gemini")
+    return "".join(parts)
 
 def save_markdown(markdown_text, output_path):
     """
@@ -110,6 +579,8 @@ def save_markdown(markdown_text, output_path):
         output_path (str): Path to save the output file
     """
     try:
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
         with open(output_path, "w", encoding="utf-8") as f:
             f.write(markdown_text)
         print(f"✅ Optimized Markdown saved to '{output_path}'")
@@ -127,10 +598,8 @@ def recheck(markdown_text):
         str: Cleaned markdown text
     """
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content(markdown_text)
+        markdown_text = generate_text(model_for("recheck"), markdown_text)
         print("✅ Received formatted response from Gemini")
-        markdown_text = response.text
     except Exception as e:
         print(f"❌ Error communicating with Gemini API: {e}")
         return None
@@ -154,14 +623,18 @@ def main():
         return
     
     # Step 1: Collect JSON data
-    questions = collect_all_questions(json_folder)
-    if not questions:
+    bank = collect_all_questions(json_folder)
+    if not bank:
         print("❌ No questions found in the specified folder.")
         return
+    questions = bank.to_dicts()
     
-    # Step 2: Ask Gemini to generate Markdown
-    markdown_output = ask_gemini_to_format(questions)
-    markdown_output = recheck(markdown_output)
+    # Step 2: Generate Markdown locally, or with Gemini if requested
+    if os.getenv("QPAT_FORMATTER", "local") == "gemini":
+        markdown_output = ask_gemini_to_format(questions)
+        markdown_output = recheck(markdown_output)
+    else:
+        markdown_output = format_questions_locally(questions)
     if not markdown_output:
         print("❌ Failed to generate markdown.")
         return
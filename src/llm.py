@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import threading
+import http.client
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import google.generativeai as genai
+
+from src import metrics
+from src.disk_cache import DiskCache, hash_key
+from src.rate_limit import RequestScheduler, estimate_tokens
+
+LLM_CACHE_DIR = os.getenv("QPAT_LLM_CACHE_DIR", os.path.join("cache", "llm"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("QPAT_LLM_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+# Seconds before a cached response expires (default: one week)
+LLM_CACHE_TTL = float(os.getenv("QPAT_LLM_CACHE_TTL", 7 * 24 * 3600))
+
+# Model used by each pipeline stage: QPAT_MODEL_<STAGE> overrides QPAT_MODEL
+DEFAULT_MODEL = os.getenv("QPAT_MODEL", "gemini-2.0-flash")
+STAGE_MODELS = {
+    stage: os.getenv(f"QPAT_MODEL_{stage.upper()}", DEFAULT_MODEL)
+    for stage in ("extract", "format", "recheck", "predict")
+}
+
+_llm_cache = None
+_backend = None
+_scheduler = None
+_backend_lock = threading.Lock()
+
+def model_for(stage):
+    """Return the model name configured for a pipeline stage."""
+    return STAGE_MODELS.get(stage, DEFAULT_MODEL)
+
+class LLMBackend:
+    """Interface every model backend implements."""
+
+    name = "base"
+
+    def generate(self, model_name, prompt, generation_config=None):
+        """Return the full response text for a prompt."""
+        raise NotImplementedError
+
+    def stream(self, model_name, prompt, generation_config=None):
+        """Yield the response text chunk by chunk."""
+        yield self.generate(model_name, prompt, generation_config)
+
+class GeminiBackend(LLMBackend):
+    """
+    Google Gemini through the google-generativeai SDK.
+
+    One GenerativeModel is kept per model name and shared by all threads,
+    so the SDK's underlying client and connections are reused across calls.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key=None):
+        self._models = {}
+        self._lock = threading.Lock()
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if api_key:
+            self.configure(api_key)
+
+    def configure(self, api_key):
+        """Set the API key and drop models created with the previous one."""
+        genai.configure(api_key=api_key)
+        with self._lock:
+            self._models.clear()
+
+    def _model(self, model_name):
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = self._models[model_name] = genai.GenerativeModel(model_name)
+            return model
+
+    @staticmethod
+    def _record_usage(model_name, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            metrics.record_tokens(model_name, usage.prompt_token_count, usage.candidates_token_count)
+
+    def generate(self, model_name, prompt, generation_config=None):
+        response = self._model(model_name).generate_content(prompt, generation_config=generation_config)
+        self._record_usage(model_name, response)
+        return response.text
+
+    def stream(self, model_name, prompt, generation_config=None):
+        last_chunk = None
+        for chunk in self._model(model_name).generate_content(prompt, generation_config=generation_config, stream=True):
+            last_chunk = chunk
+            if chunk.text:
+                yield chunk.text
+        # Usage metadata is cumulative, so the last chunk carries the totals
+        self._record_usage(model_name, last_chunk)
+
+class LLMHTTPError(Exception):
+    """Non-2xx answer from an HTTP backend."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        # Seconds the server asked clients to wait (Retry-After header)
+        self.retry_after = retry_after
+
+class HTTPBackend(LLMBackend):
+    """
+    Any server speaking the Gemini REST protocol (generateContent and
+    streamGenerateContent), such as src/mock_llm_server.py.
+
+    Each thread keeps one persistent keep-alive connection, so repeated
+    calls do not pay for a new TCP handshake.
+    """
+
+    name = "http"
+
+    def __init__(self, base_url, api_key=None, timeout=300):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = self._local.conn = conn_class(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _reset_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def _request(self, model_name, method, prompt, generation_config, query=""):
+        body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if generation_config:
+            body["generationConfig"] = generation_config
+        path = f"{self.base_path}/v1beta/models/{model_name}:{method}{query}"
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["x-goog-api-key"] = self.api_key
+
+        # A pooled connection may have been closed by the server; retry once on a fresh one
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", path, body=json.dumps(body), headers=headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                self._reset_connection()
+                if attempt:
+                    raise
+                continue
+            if response.status >= 400:
+                message = response.read().decode("utf-8", "replace")
+                retry_after = response.getheader("Retry-After")
+                raise LLMHTTPError(
+                    response.status, message, float(retry_after) if retry_after and retry_after.isdigit() else None
+                )
+            return response
+
+    @staticmethod
+    def _text(payload):
+        parts = []
+        for candidate in payload.get("candidates", [])[:1]:
+            for part in candidate.get("content", {}).get("parts", []):
+                parts.append(part.get("text", ""))
+        return "".join(parts)
+
+    @staticmethod
+    def _record_usage(model_name, payload):
+        usage = (payload or {}).get("usageMetadata")
+        if usage:
+            metrics.record_tokens(model_name, usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+    def generate(self, model_name, prompt, generation_config=None):
+        response = self._request(model_name, "generateContent", prompt, generation_config)
+        payload = json.loads(response.read())
+        self._record_usage(model_name, payload)
+        return self._text(payload)
+
+    def stream(self, model_name, prompt, generation_config=None):
+        response = self._request(model_name, "streamGenerateContent", prompt, generation_config, "?alt=sse")
+        payload = None
+        for line in response:
+            line = line.strip()
+            if line.startswith(b"data:"):
+                payload = json.loads(line[5:])
+                text = self._text(payload)
+                if text:
+                    yield text
+        # Usage metadata is cumulative, so the last event carries the totals
+        self._record_usage(model_name, payload)
+
+def _backend_from_env():
+    kind = os.getenv("QPAT_LLM_BACKEND", "gemini")
+    if kind == "http":
+        return HTTPBackend(os.getenv("QPAT_LLM_URL", "http://127.0.0.1:8765"))
+    if kind == "fake":
+        # Imported here: fake_llm itself depends on this module
+        from src.fake_llm import FakeBackend, quota_from_env
+        return FakeBackend(float(os.getenv("QPAT_FAKE_LLM_LATENCY", 0)), quota=quota_from_env())
+    return GeminiBackend()
+
+def get_backend():
+    """Return the active backend, created from QPAT_LLM_BACKEND on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _backend_from_env()
+        return _backend
+
+def set_backend(backend):
+    """
+    Replace the active backend.
+
+    Returns:
+        LLMBackend: The previous backend, so callers can restore it
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+def get_scheduler():
+    """Return the scheduler every model call passes through, created from the QPAT_LLM_* settings on first use."""
+    global _scheduler
+    with _backend_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+def set_scheduler(scheduler):
+    """
+    Replace the request scheduler.
+
+    Returns:
+        RequestScheduler: The previous scheduler, so callers can restore it
+    """
+    global _scheduler
+    with _backend_lock:
+        previous, _scheduler = _scheduler, scheduler
+    return previous
+
+def configure_gemini(api_key):
+    """
+    Configure the Gemini API key for the active backend.
+
+    Passing None forgets a key configured earlier in the process (the SDK
+    then falls back to GOOGLE_API_KEY from the environment, if any).
+    """
+    backend = get_backend()
+    if isinstance(backend, GeminiBackend):
+        backend.configure(api_key)
+    else:
+        genai.configure(api_key=api_key)
+        if isinstance(backend, HTTPBackend):
+            backend.api_key = api_key
+
+@contextmanager
+def _tracked_call(model_name):
+    """Count a backend call and record its latency and failure."""
+    metrics.inc("qpat_llm_calls_total", model=model_name)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        metrics.inc("qpat_llm_errors_total", model=model_name)
+        metrics.record_event("llm_error", model=model_name, error=str(e))
+        raise
+    finally:
+        metrics.observe("qpat_llm_call_seconds", time.perf_counter() - start, model=model_name)
+
+def get_llm_cache():
+    """Return the shared on-disk cache of model responses."""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = DiskCache(LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL, suffix=".txt")
+    return _llm_cache
+
+def llm_cache_key(model_name, prompt, generation_config=None):
+    """Build the cache key from the model name, the prompt and the generation config."""
+    config = json.dumps(generation_config or {}, sort_keys=True, default=str)
+    return hash_key(model_name, hash_key(prompt), config)
+
+def generate_text(model_name, prompt, generation_config=None, use_cache=True):
+    """
+    Generate a response, serving identical requests from the on-disk cache.
+
+    Fresh requests go through the shared RequestScheduler, which keeps
+    them within the configured quota and retries throttling and server
+    errors.
+
+    Args:
+        model_name (str): Model name
+        prompt (str): Full prompt text
+        generation_config (dict): Optional generation settings, part of the cache key
+        use_cache (bool): Set to False to force a fresh call (the result is
+            still stored, replacing any cached response)
+
+    Returns:
+        str: Response text
+    """
+    cache = get_llm_cache()
+    key = llm_cache_key(model_name, prompt, generation_config)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+    def request():
+        with _tracked_call(model_name):
+            return get_backend().generate(model_name, prompt, generation_config)
+
+    text = get_scheduler().call(request, estimate_tokens(prompt), model_name)
+    if text and text.strip():
+        cache.set(key, text.encode("utf-8"))
+    return text
+
+def stream_text(model_name, prompt, generation_config=None, use_cache=True):
+    """
+    Yield a response chunk by chunk, serving identical requests from the cache.
+
+    A cached response is yielded as a single chunk. A fresh response is
+    stored once the stream completes. A request throttled or failed before
+    its first chunk is retried by the scheduler.
+    """
+    cache = get_llm_cache()
+    key = llm_cache_key(model_name, prompt, generation_config)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached.decode("utf-8")
+            return
+
+    scheduler = get_scheduler()
+    chunks = []
+    attempt = 0
+    while True:
+        started = scheduler.acquire(estimate_tokens(prompt))
+        error = None
+        try:
+            with _tracked_call(model_name):
+                for chunk in get_backend().stream(model_name, prompt, generation_config):
+                    chunks.append(chunk)
+                    yield chunk
+        except Exception as e:
+            error = e
+        finally:
+            scheduler.release(started, error, estimate_tokens("".join(chunks)) if error is None else 0)
+        if error is None:
+            break
+        # Once chunks have reached the caller the stream cannot be restarted
+        if chunks or not scheduler.should_retry(error, attempt):
+            raise error
+        scheduler.backoff(error, attempt, model_name)
+        attempt += 1
+    text = "".join(chunks)
+    if text.strip():
+        cache.set(key, text.encode("utf-8"))
+
+def forget_response(model_name, prompt, generation_config=None):
+    """Drop a cached response, e.g. one that turned out to be unusable."""
+    get_llm_cache().delete(llm_cache_key(model_name, prompt, generation_config))
+
+def llm_cache_stats():
+    """Return hit/miss statistics of the response cache."""
+    return get_llm_cache().stats()
@@ -6,12 +6,48 @@ This script converts a specified Markdown file to PDF.
 Input and output file paths are defined directly in the script.
 """
 
-import markdown
+import json
 from fpdf import FPDF
 import os
 import re
 import streamlit as st
 
+from src.disk_cache import DiskCache, hash_key
+
+# Bump whenever the rendering code changes so cached PDFs are rebuilt
+RENDERER_VERSION = "2"
+PDF_SETTINGS = {"font": "Arial", "font_size": 10, "margin": 15}
+
+PDF_CACHE_DIR = os.getenv("QPAT_PDF_CACHE_DIR", os.path.join("cache", "pdf"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("QPAT_PDF_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_pdf_cache = None
+# Output path -> (cache key, mtime, size) of the PDF last written there
+_rendered_outputs = {}
+
+def get_pdf_cache():
+    """Return the shared on-disk cache of rendered PDFs."""
+    global _pdf_cache
+    if _pdf_cache is None:
+        _pdf_cache = DiskCache(PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_BYTES, suffix=".pdf")
+    return _pdf_cache
+
+def pdf_cache_key(md_content):
+    """Build the cache key from the markdown content and the renderer settings."""
+    return hash_key(md_content, RENDERER_VERSION, json.dumps(PDF_SETTINGS, sort_keys=True))
+
+def _remember_output(output_path, key):
+    stat = os.stat(output_path)
+    _rendered_outputs[output_path] = (key, stat.st_mtime, stat.st_size)
+
+def _output_is_current(output_path, key):
+    """True if output_path still holds the PDF we last rendered for this key."""
+    try:
+        stat = os.stat(output_path)
+    except OSError:
+        return False
+    return _rendered_outputs.get(output_path) == (key, stat.st_mtime, stat.st_size)
+
 
 def clean_text(text):
     """Clean text to avoid encoding issues"""
@@ -32,10 +68,17 @@ def clean_text(text):
     
     return text
 
-def markdown_to_pdf(INPUT_FILE, OUTPUT_FILE):
+def markdown_to_pdf(INPUT_FILE, OUTPUT_FILE, md_content=None):
     """
     Convert the specified Markdown file to PDF using fpdf2.
     Returns the path to the generated PDF file.
+
+    Pass ``md_content`` to render markdown already in memory instead of
+    reading INPUT_FILE, which then only names the source in messages.
+
+    Rendered PDFs are cached by the hash of the markdown content and the
+    renderer settings, so converting unchanged markdown again is served
+    from the existing file or the cache instead of being re-rendered.
     """
     # Get absolute paths to ensure consistency
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -56,31 +99,45 @@ def markdown_to_pdf(INPUT_FILE, OUTPUT_FILE):
     os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
     
     # Read the markdown file
-    try:
-        with open(input_path, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-        print(f"Successfully read '{input_path}'")
-    except Exception as e:
-        print(f"Error reading input file: {e}")
-        return None
+    if md_content is None:
+        try:
+            with open(input_path, 'r', encoding='utf-8') as f:
+                md_content = f.read()
+            print(f"Successfully read '{input_path}'")
+        except Exception as e:
+            print(f"Error reading input file: {e}")
+            return None
     
-    # Convert markdown to HTML
-    html_content = markdown.markdown(
-        md_content,
-        extensions=['extra', 'codehilite', 'tables', 'toc']
-    )
+    # Serve unchanged content without rendering again
+    key = pdf_cache_key(md_content)
+    if _output_is_current(output_path, key):
+        print(f"PDF for '{input_path}' is up to date at: {output_path}")
+        return output_path
+    cache = get_pdf_cache()
+    cached_pdf = cache.get(key)
+    if cached_pdf is not None:
+        try:
+            with open(output_path, 'wb') as f:
+                f.write(cached_pdf)
+            _remember_output(output_path, key)
+            print(f"Served cached PDF for '{input_path}' at: {output_path}")
+            return output_path
+        except OSError as e:
+            print(f"Error writing cached PDF, rendering instead: {e}")
     
     # fpdf2 PDF Generation
     try:
         # Create a FPDF object
         pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
+        pdf.set_auto_page_break(auto=True, margin=PDF_SETTINGS["margin"])
         pdf.add_page()
-        pdf.set_font("Arial", size=10)
+        pdf.set_font(PDF_SETTINGS["font"], size=PDF_SETTINGS["font_size"])
         
         # Process markdown
         lines = md_content.split('\n')
         for line in lines:
+            # fpdf2 leaves the cursor right of a multi_cell, so start every line at the margin
+            pdf.set_x(pdf.l_margin)
             # Handle headers
             if line.startswith('# '):
                 pdf.set_font("Arial", 'B', 16)
@@ -123,6 +180,9 @@ def markdown_to_pdf(INPUT_FILE, OUTPUT_FILE):
         # Verify file existence
         if os.path.exists(output_path):
             print(f"PDF file confirmed at: {output_path}")
+            with open(output_path, 'rb') as f:
+                cache.set(key, f.read())
+            _remember_output(output_path, key)
             return output_path
         else:
             print(f"PDF file not found at: {output_path}")
@@ -0,0 +1,306 @@
+"""
+Process-wide pipeline metrics.
+
+Counters (pages, questions, tokens, retries, cache hits, errors) and timings
+(per-stage wall time, model call latency) are kept in memory, appended as
+JSON lines to ``QPAT_METRICS_DIR/events.jsonl`` as they happen and exported
+in the Prometheus text format to ``QPAT_METRICS_DIR/qpat_<pid>.prom``, a
+layout the node_exporter textfile collector reads directly. Set
+QPAT_METRICS_PORT to also serve them over HTTP at ``/metrics``.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_DIR = os.getenv("QPAT_METRICS_DIR", "metrics")
+# Set to 0 to keep metrics in memory only
+METRICS_EVENTS = os.getenv("QPAT_METRICS_EVENTS", "1") == "1"
+
+PROMETHEUS_FILE_PATTERN = re.compile(r"^qpat_(\d+)\.prom(\.tmp)?$")
+
+HELP = {
+    "qpat_stage_seconds": "Wall time spent in a pipeline stage",
+    "qpat_stage_errors_total": "Pipeline stage runs that raised",
+    "qpat_pages_total": "PDF pages extracted",
+    "qpat_pages_routed_total": "Pages extracted by the layout rules or sent to the model, by route",
+    "qpat_papers_total": "Papers processed, by outcome",
+    "qpat_questions_total": "Questions produced, by stage",
+    "qpat_llm_calls_total": "Model calls sent to the backend",
+    "qpat_llm_call_seconds": "Latency of model calls",
+    "qpat_llm_errors_total": "Model calls that failed",
+    "qpat_llm_prompt_tokens_total": "Prompt tokens sent to the model",
+    "qpat_llm_output_tokens_total": "Tokens generated by the model",
+    "qpat_retries_total": "Retried requests, by stage",
+    "qpat_llm_throttled_total": "Model calls refused with 429 by the backend",
+    "qpat_llm_queue_seconds": "Time model calls waited for quota or a concurrency slot",
+    "qpat_extraction_salvaged_total": "Valid questions kept from incomplete extraction responses",
+    "qpat_extraction_rejected_total": "Extracted objects rejected by the question schema",
+    "qpat_boilerplate_lines_total": "Repeated header, footer and instruction lines stripped before prompting",
+    "qpat_boilerplate_chars_total": "Characters of boilerplate stripped before prompting",
+    "qpat_boilerplate_tokens_total": "Estimated prompt tokens saved by stripping boilerplate",
+    "qpat_format_sections_total": "Subject/unit sections of the question bank reused or formatted by the model",
+    "qpat_cache_requests_total": "Cache lookups, by cache and result",
+}
+
+_lock = threading.Lock()
+_events_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items() if value is not None))
+
+
+def record_event(event, **fields):
+    """Append one structured event to the JSON-lines log."""
+    if not METRICS_EVENTS:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "pid": os.getpid(), "event": event, **fields}, default=str)
+    try:
+        with _events_lock:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(os.path.join(METRICS_DIR, "events.jsonl"), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"⚠️ Could not write metrics event: {e}")
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter."""
+    if not value:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Record one duration in a timing summary (count, sum, max)."""
+    key = _key(name, labels)
+    with _lock:
+        count, total, peak = _timings.get(key, (0, 0.0, 0.0))
+        _timings[key] = (count + 1, total + seconds, max(peak, seconds))
+
+
+@contextmanager
+def timed(stage, **labels):
+    """
+    Time a pipeline stage.
+
+    Records ``qpat_stage_seconds`` and, if the block raises,
+    ``qpat_stage_errors_total`` plus an ``error`` event.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        inc("qpat_stage_errors_total", stage=stage, **labels)
+        record_event("error", stage=stage, error=str(e), **labels)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe("qpat_stage_seconds", seconds, stage=stage, **labels)
+        record_event("stage", stage=stage, seconds=round(seconds, 6), **labels)
+
+
+def record_tokens(model_name, prompt_tokens, output_tokens):
+    """Count the tokens of one model call."""
+    inc("qpat_llm_prompt_tokens_total", prompt_tokens or 0, model=model_name)
+    inc("qpat_llm_output_tokens_total", output_tokens or 0, model=model_name)
+
+
+def snapshot():
+    """Return a copy of every counter and timing, keyed by (name, labels)."""
+    with _lock:
+        return {"counters": dict(_counters), "timings": dict(_timings)}
+
+
+def summarize(before=None, after=None):
+    """
+    Summarize the metrics recorded between two snapshots.
+
+    Args:
+        before (dict): Snapshot taken at the start (nothing if None)
+        after (dict): Snapshot taken at the end (now if None)
+
+    Returns:
+        dict: Per-stage seconds plus totals of pages, questions, model
+            calls, tokens, retries, boilerplate tokens stripped, errors and cache hits/misses
+    """
+    before = before or {"counters": {}, "timings": {}}
+    after = after or snapshot()
+
+    def counter(name, **match):
+        total = 0
+        for (key_name, labels), value in after["counters"].items():
+            if key_name == name and all(dict(labels).get(label) == str(v) for label, v in match.items()):
+                total += value - before["counters"].get((key_name, labels), 0)
+        return total
+
+    stages = {}
+    for (name, labels), (count, total, _) in after["timings"].items():
+        if name != "qpat_stage_seconds":
+            continue
+        previous_count, previous_total, _ = before["timings"].get((name, labels), (0, 0.0, 0.0))
+        if count > previous_count:
+            stage = dict(labels)["stage"]
+            stages[stage] = round(stages.get(stage, 0.0) + total - previous_total, 3)
+
+    return {
+        "stages": stages,
+        "pages": counter("qpat_pages_total"),
+        "questions": counter("qpat_questions_total", stage="extract"),
+        "llm_calls": counter("qpat_llm_calls_total"),
+        "prompt_tokens": counter("qpat_llm_prompt_tokens_total"),
+        "output_tokens": counter("qpat_llm_output_tokens_total"),
+        "retries": counter("qpat_retries_total"),
+        "boilerplate_tokens": counter("qpat_boilerplate_tokens_total"),
+        "errors": counter("qpat_stage_errors_total") + counter("qpat_llm_errors_total"),
+        "cache_hits": counter("qpat_cache_requests_total", result="hit"),
+        "cache_misses": counter("qpat_cache_requests_total", result="miss"),
+    }
+
+
+def _labels_text(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+
+def render_prometheus():
+    """Return every metric in the Prometheus text exposition format."""
+    current = snapshot()
+    lines = []
+    for name in sorted({name for name, _ in current["counters"]}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (key_name, labels), value in sorted(current["counters"].items()):
+            if key_name == name:
+                lines.append(f"{name}{_labels_text(labels)} {value}")
+    for name in sorted({name for name, _ in current["timings"]}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} summary")
+        for (key_name, labels), (count, total, _) in sorted(current["timings"].items()):
+            if key_name == name:
+                lines.append(f"{name}_count{_labels_text(labels)} {count}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {total:.6f}")
+        # The longest observation is not a quantile of a window; export it as its own gauge
+        lines.append(f"# HELP {name}_max Longest observation of: {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name}_max gauge")
+        for (key_name, labels), (_, _, peak) in sorted(current["timings"].items()):
+            if key_name == name:
+                lines.append(f"{name}_max{_labels_text(labels)} {peak:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=None):
+    """
+    Atomically write the Prometheus text file for this process.
+
+    Returns:
+        str: Path of the written file, or None on error
+    """
+    path = path or os.path.join(METRICS_DIR, f"qpat_{os.getpid()}.prom")
+    try:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp_path, path)
+        return path
+    except OSError as e:
+        print(f"⚠️ Could not write metrics file: {e}")
+        return None
+
+
+def remove_prometheus(path=None):
+    """Remove the Prometheus text file of this process, so an exited process stops being reported."""
+    path = path or os.path.join(METRICS_DIR, f"qpat_{os.getpid()}.prom")
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"⚠️ Could not remove metrics file: {e}")
+
+
+def _process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+
+def remove_stale_prometheus(directory=None):
+    """
+    Remove the Prometheus text files of processes that are no longer running.
+
+    Covers workers that were killed before they could remove their own file
+    and finished batch runs.
+
+    Args:
+        directory (str): Metrics directory (METRICS_DIR if None)
+
+    Returns:
+        list: Paths of the removed files
+    """
+    directory = directory or METRICS_DIR
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        print(f"⚠️ Could not list metrics files: {e}")
+        return []
+
+    removed = []
+    for file_name in names:
+        match = PROMETHEUS_FILE_PATTERN.match(file_name)
+        if not match or int(match.group(1)) == os.getpid() or _process_running(int(match.group(1))):
+            continue
+        path = os.path.join(directory, file_name)
+        try:
+            os.remove(path)
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"⚠️ Could not remove metrics file: {e}")
+    return removed
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve /metrics from a background thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Local Gemini stand-in server
+
+Speaks the subset of the Gemini REST protocol QPAT uses
+(``models/<model>:generateContent`` and ``:streamGenerateContent?alt=sse``)
+and answers with the deterministic responses of src/fake_llm.py after a
+realistic delay. Point the app at it for air-gapped load tests:
+
+    python -m src.mock_llm_server --port 8765 --latency 1.5 --per-token 0.002
+    QPAT_LLM_BACKEND=http QPAT_LLM_URL=http://127.0.0.1:8765 streamlit run main.py
+
+Add ``--rpm 30 --error-rate 0.05`` to answer like a throttled, flaky API.
+"""
+
+import re
+import json
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.fake_llm import FakeQuota, fake_response
+from src.rate_limit import estimate_tokens
+
+ROUTE = re.compile(r'^(?:/[^?]*)?/models/(?P<model>[^/:?]+):(?P<method>generateContent|streamGenerateContent)')
+
+
+def _payload(text, prompt_tokens, output_tokens):
+    """Build a Gemini-shaped response body."""
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+    }
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Overridden by serve()
+    latency = 0.5
+    per_token = 0.0
+    chunk_size = 200
+    quota = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length)
+        match = ROUTE.match(self.path)
+        if not match:
+            self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {self.path}"}})
+            return
+        try:
+            request = json.loads(raw_body or b"{}")
+            prompt = "".join(
+                part.get("text", "")
+                for content in request.get("contents", [])
+                for part in content.get("parts", [])
+            )
+        except (ValueError, AttributeError) as e:
+            self._send_json(400, {"error": {"code": 400, "message": f"Invalid request body: {e}"}})
+            return
+
+        refusal = self.quota.check() if self.quota is not None else None
+        if refusal is not None:
+            status, message = refusal
+            headers = {"Retry-After": str(self.quota.retry_after)} if status == 429 and self.quota.retry_after else None
+            self._send_json(status, {"error": {"code": status, "message": message}}, headers)
+            return
+
+        text = fake_response(match.group("model"), prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(text)
+        time.sleep(self.latency)
+
+        if match.group("method") == "generateContent":
+            time.sleep(self.per_token * output_tokens)
+            self._send_json(200, _payload(text, prompt_tokens, output_tokens))
+            return
+
+        # Server-sent events, one chunk at a time, as the real API does with alt=sse
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        sent_tokens = 0
+        for chunk in chunks:
+            time.sleep(self.per_token * estimate_tokens(chunk))
+            # Like the real API, usage counts are cumulative over the stream
+            sent_tokens += estimate_tokens(chunk)
+            event = f"data: {json.dumps(_payload(chunk, prompt_tokens, sent_tokens))}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(host="127.0.0.1", port=8765, latency=0.5, per_token=0.0, quota=None):
+    """
+    Start the stand-in server and block until interrupted.
+
+    Args:
+        host (str): Interface to bind
+        port (int): Port to listen on
+        latency (float): Seconds before the first byte of every answer
+        per_token (float): Additional seconds per generated token
+        quota (FakeQuota): Optional simulated quota; refused requests get 429 or 503
+    """
+    handler = type("ConfiguredHandler", (MockGeminiHandler,),
+                   {"latency": latency, "per_token": per_token, "quota": quota})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"🧪 Mock Gemini server on http://{host}:{port} (latency {latency}s, {per_token}s/token)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Gemini stand-in server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before each answer starts")
+    parser.add_argument("--per-token", type=float, default=0.0, help="Seconds per generated token")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before answering 429 (0: no limit)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with 429 answers")
+    args = parser.parse_args()
+    quota = None
+    if args.rpm or args.error_rate:
+        quota = FakeQuota(args.rpm, 60.0, args.error_rate, args.retry_after or None)
+    serve(args.host, args.port, args.latency, args.per_token, quota)
+
+
+if __name__ == "__main__":
+    main()
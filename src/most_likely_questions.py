@@ -1,32 +1,90 @@
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import json
 
-# Configure Gemini API
+from src.llm import generate_text, model_for, stream_text
+from src.question_scoring import score_questions
+
+# Number of top-ranked question clusters sent to the model for phrasing
+DEFAULT_TOP_N = int(os.getenv("QPAT_PREDICT_TOP_N", 30))
+
+# The Gemini backend reads GOOGLE_API_KEY from the environment when first used
 load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=api_key)
 
-def generate_most_likely_questions(questions_data, output_file="md/predicted_questions.md"):
+def _write_predictions(output_file, predicted_questions):
+    """Write the predicted questions to a markdown file."""
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, "w") as file:
+        file.write("# Most Likely Upcoming Questions\n\n")
+        file.write(predicted_questions)
+
+    print(f"Predicted questions written to: {output_file}")
+
+def _stream_predictions(model_name, prompt, output_file):
+    """Yield predicted questions as they are generated, then write the full text to disk."""
+    chunks = []
+    for chunk in stream_text(model_name, prompt):
+        chunks.append(chunk)
+        yield chunk
+    _write_predictions(output_file, "".join(chunks))
+
+def build_candidate_summary(questions, top_n=DEFAULT_TOP_N):
+    """
+    Rank the question bank locally and summarize the top candidates for the prompt.
+
+    Args:
+        questions (list): List of question dictionaries
+        top_n (int): Number of question clusters to include
+
+    Returns:
+        str: Markdown listing unit weightage and the top-ranked questions
+    """
+    ranked, units = score_questions(questions)
+    lines = ["## Unit weightage (share of each subject's marks)"]
+    for unit in units:
+        lines.append(f"- {unit['subject']} / {unit['unit']}: {unit['share']:.0%} ({unit['questions']} questions)")
+    lines.append("")
+    lines.append(f"## Top {min(top_n, len(ranked))} candidate questions (highest score first)")
+    for number, candidate in enumerate(ranked[:top_n], start=1):
+        tags = f" [{', '.join(candidate['appearances'])}]" if candidate["appearances"] else ""
+        lines.append(
+            f"{number}. ({candidate['subject']} / {candidate['unit']}, score {candidate['score']:.2f}) "
+            f"{candidate['question']}{tags}"
+        )
+    return "\n".join(lines)
+
+def generate_most_likely_questions(questions_data, output_file="md/predicted_questions.md", stream=False, top_n=DEFAULT_TOP_N,
+                                   bank_file="md/optimized_questions.md", bank_markdown=None):
     """
     Generate most likely questions based on provided questions data.
     
     Args:
         questions_data (list/dict): The JSON data containing questions
         output_file (str): Path where to save the markdown output
+        stream (bool): Return a generator of partial Markdown chunks; the
+            file is written once the generator is exhausted
+        top_n (int): Number of locally ranked candidates sent to the model
+            when questions_data is a question list
+        bank_file (str): Optimized question bank used when questions_data
+            is not a question list
+        bank_markdown (str): Optimized question bank already in memory; used
+            instead of reading ``bank_file``
     
     Returns:
         str: The generated most likely questions in markdown format
+            (a generator of chunks if ``stream``)
     """
-    # Initialize the model
-    model = genai.GenerativeModel('gemini-2.0-flash')
+    model_name = model_for("predict")
     
-    # Get markdown content from optimized questions if available
-    # Otherwise, convert questions_data to a readable format
+    # Rank a question list locally and only send the top candidates;
+    # otherwise fall back to the optimized questions markdown
     try:
-        if os.path.exists("md/optimized_questions.md"):
-            with open("md/optimized_questions.md", "r") as file:
+        if isinstance(questions_data, list) and questions_data and all(isinstance(q, dict) for q in questions_data):
+            markdown_content = build_candidate_summary(questions_data, top_n)
+        elif bank_markdown:
+            markdown_content = bank_markdown
+        elif os.path.exists(bank_file):
+            with open(bank_file, "r") as file:
                 markdown_content = file.read()
         else:
             # If optimized questions markdown doesn't exist, format the JSON data
@@ -38,23 +96,21 @@ def generate_most_likely_questions(questions_data, output_file="md/predicted_que
     # Construct prompt for Gemini
     prompt = (
         "You are a university professor predicting exam questions.\n"
-        "Given the following content of past exam questions along with the information of [marks-year], "
+        "Given the following content of past exam questions along with the information of [marks-year] "
+        "and, where present, their locally computed scores and unit weightage, "
         "analyze and return a Markdown list of the most likely or expected future questions.\n\n"
         "The questions should be in the same format as the given data.\n"
         f"{markdown_content}"
     )
 
+    if stream:
+        return _stream_predictions(model_name, prompt, output_file)
+
     # Get response from Gemini
-    response = model.generate_content(prompt)
-    predicted_questions = response.text
+    predicted_questions = generate_text(model_name, prompt)
 
     # Write to markdown file
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, "w") as file:
-        file.write("# Most Likely Upcoming Questions\n\n")
-        file.write(predicted_questions)
-
-    print(f"Predicted questions written to: {output_file}")
+    _write_predictions(output_file, predicted_questions)
     return predicted_questions
 
 # If the script is run directly, use the sample file
@@ -65,4 +121,4 @@ if __name__ == "__main__":
         markdown_content = file.read()
         
     # Use the function with the markdown content
-    generate_most_likely_questions(markdown_content)
+    generate_most_likely_questions(markdown_content, bank_markdown=markdown_content)
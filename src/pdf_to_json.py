@@ -2,89 +2,214 @@ import os
 import re
 import json
 import fitz  # PyMuPDF
-import google.generativeai as genai
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from src import metrics
+from src.disk_cache import DiskCache, hash_key
+from src.json_stream import JSONArrayParser
+from src.llm import configure_gemini, forget_response, model_for, stream_text
+from src.rate_limit import estimate_tokens
+from src.rule_extractor import extract_layout_questions
+from src.boilerplate import BoilerplateTable
+from src.question_store import MAX_INT_VALUE
+
 # Load environment variables
 load_dotenv()
 
+# Bump whenever the extraction prompt or post-processing changes so that
+# cached results produced by the old pipeline are no longer served.
+EXTRACTION_PROMPT_VERSION = "5"
+
+EXTRACTION_CACHE_DIR = os.getenv("QPAT_EXTRACTION_CACHE_DIR", os.path.join("cache", "extraction"))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("QPAT_EXTRACTION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Number of papers converted at once; each conversion mostly waits on Gemini
+DEFAULT_MAX_WORKERS = int(os.getenv("QPAT_MAX_WORKERS", 4))
+
+# Papers shorter than this are always extracted in-process
+PARALLEL_MIN_PAGES = int(os.getenv("QPAT_PARALLEL_MIN_PAGES", 32))
+# Worker processes used for large PDFs (0 disables the process pool)
+EXTRACTION_PROCESSES = int(os.getenv("QPAT_EXTRACTION_PROCESSES", 0))
+
+# Token budget for the paper text sent in one extraction request
+CHUNK_TOKEN_BUDGET = int(os.getenv("QPAT_CHUNK_TOKEN_BUDGET", 8000))
+# Chunks of one paper extracted at once, and attempts per chunk
+CHUNK_MAX_WORKERS = int(os.getenv("QPAT_CHUNK_MAX_WORKERS", 4))
+CHUNK_ATTEMPTS = int(os.getenv("QPAT_CHUNK_ATTEMPTS", 3))
+
+# "auto" extracts questions with layout rules and sends only low-confidence
+# pages to the model, "rules" never calls the model, "llm" always does
+EXTRACTOR_MODE = os.getenv("QPAT_EXTRACTOR", "auto")
+# Pages whose rule-based questions score below this go to the model
+RULE_CONFIDENCE = float(os.getenv("QPAT_RULE_CONFIDENCE", 0.7))
+# Strip lines repeated across pages and papers before prompting the model
+STRIP_BOILERPLATE = os.getenv("QPAT_STRIP_BOILERPLATE", "1") == "1"
+
+PAGE_MARKER_PATTERN = re.compile(r'^(?==== Page \d+ ===)', re.MULTILINE)
+PAGE_NUMBER_PATTERN = re.compile(r'^=== Page (\d+) ===', re.MULTILINE)
+PAGE_MARKER_LINE_PATTERN = re.compile(r'^=== Page \d+ ===$', re.MULTILINE)
+
+# Extraction responses are constrained to a JSON array of these objects
+QUESTION_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING"},
+            "marks": {"type": "INTEGER", "nullable": True},
+            "year": {"type": "INTEGER", "nullable": True},
+            "unit": {"type": "STRING", "nullable": True},
+            "subject": {"type": "STRING", "nullable": True},
+            "page": {"type": "INTEGER", "nullable": True},
+        },
+        "required": ["question", "marks", "year", "unit", "subject", "page"],
+    },
+}
+EXTRACTION_CONFIG = {"response_mime_type": "application/json", "response_schema": QUESTION_SCHEMA}
+
+_extraction_cache = None
+
+def get_extraction_cache():
+    """Return the shared on-disk cache of extracted question lists."""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = DiskCache(EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_BYTES, suffix=".json")
+    return _extraction_cache
+
+def extraction_cache_key(pdf_bytes):
+    """Build the cache key for a PDF from its bytes, the prompt version, the model and the extractor settings."""
+    return hash_key(
+        pdf_bytes, EXTRACTION_PROMPT_VERSION, model_for("extract"), EXTRACTOR_MODE, str(RULE_CONFIDENCE),
+        str(STRIP_BOILERPLATE),
+    )
+
 def configure_gemini_api():
     """Configure the Gemini API using the API key from the .env file."""
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("Google API Key is not set. Please provide it in the .env file.")
-    genai.configure(api_key=api_key)
+    configure_gemini(api_key)
     print("Gemini API configured successfully.")
 
-def extract_text_from_pdf(pdf_path):
+def _looks_like_table(lines):
+    """Simple table detection heuristic - look for aligned text lines."""
+    if len(lines) < 2:
+        return False
+    for line in lines:
+        # Skip very short lines
+        if len(line) < 5:
+            continue
+        # Check for multiple spaces, tabs, or pipe characters
+        if '  ' not in line and '\t' not in line and '|' not in line:
+            return False
+    return True
+
+def extract_page_text(page, page_num):
+    """
+    Extract the text and table candidates of a single page in one pass.
+
+    Returns:
+        str: The page chunk, starting with its "=== Page N ===" marker
+    """
+    parts = [f"=== Page {page_num} ===\n"]
+    tables = []
+
+    # Get text with layout recognition
+    for block in page.get_text("dict")["blocks"]:
+        if block["type"] != 0:  # Not a text block
+            continue
+
+        # Join every line's spans once and reuse them for the table check
+        lines = [" ".join(span["text"] for span in line["spans"]) for line in block.get("lines", [])]
+        for line_text in lines:
+            if line_text.strip():
+                parts.append(line_text)
+                parts.append("\n")
+
+        # Add extra newline between text blocks for readability
+        parts.append("\n")
+
+        try:
+            if _looks_like_table(lines):
+                tables.append("\n".join(lines))
+        except Exception as e:
+            print(f"Warning: Table detection error on page {page_num}: {e}")
+
+    if tables:
+        parts.append(f"\n=== Tables on Page {page_num} ===\n")
+        for i, table in enumerate(tables, 1):
+            parts.append(f"Table {i}:\n{table}\n\n")
+
+    parts.append("\n")  # Add extra newline between pages
+    return "".join(parts)
+
+def iter_pdf_text(doc, start=0, stop=None):
+    """
+    Yield the text of an open PDF as chunks: metadata first, then one chunk per page.
+
+    Args:
+        doc (fitz.Document): Open PyMuPDF document
+        start (int): Index of the first page to extract
+        stop (int): Index after the last page to extract (defaults to the end)
+    """
+    if start == 0:
+        # Extract metadata to help with subject identification
+        metadata = doc.metadata or {}
+        if metadata.get("subject"):
+            yield f"Subject: {metadata.get('subject')}\n\n"
+        if metadata.get("title"):
+            yield f"Title: {metadata.get('title')}\n\n"
+
+    stop = doc.page_count if stop is None else min(stop, doc.page_count)
+    for page_index in range(start, stop):
+        yield extract_page_text(doc[page_index], page_index + 1)
+
+def open_pdf(source):
+    """
+    Open a PDF from a file path or straight from its bytes.
+
+    Bytes, bytearrays and memoryviews (such as an upload's getbuffer()) are
+    read through PyMuPDF's stream support without writing a temp file.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def _extract_page_range(args):
+    """Process-pool worker: extract the chunks of pages [start, stop) of a PDF."""
+    source, start, stop = args
+    with open_pdf(source) as doc:
+        return "".join(iter_pdf_text(doc, start, stop))
+
+def extract_text_from_pdf(pdf_path, processes=None, name=None):
     """
     Extracts all text and tables from a PDF file.
     Returns a structured string containing the extracted content.
+
+    Args:
+        pdf_path (str | bytes): Path to the PDF file, or the PDF bytes
+        processes (int): If set, PDFs with at least PARALLEL_MIN_PAGES pages
+            are split into page ranges extracted by this many processes
+        name (str): Name used in messages (defaults to the path)
     """
+    name = name or (pdf_path if isinstance(pdf_path, str) else "PDF")
     try:
-        with fitz.open(pdf_path) as doc:
-            full_text = ""
-            
-            # Extract metadata to help with subject identification
-            metadata = doc.metadata
-            if metadata.get("subject"):
-                full_text += f"Subject: {metadata.get('subject')}\n\n"
-            if metadata.get("title"):
-                full_text += f"Title: {metadata.get('title')}\n\n"
-            
-            # Process each page
-            for page_num, page in enumerate(doc, start=1):
-                full_text += f"=== Page {page_num} ===\n"
-                
-                # Get text with layout recognition
-                blocks = page.get_text("dict")["blocks"]
-                for block in blocks:
-                    if block["type"] == 0:  # Text block
-                        for line in block["lines"]:
-                            line_text = " ".join(span["text"] for span in line["spans"])
-                            if line_text.strip():
-                                full_text += line_text + "\n"
-                        
-                        # Add extra newline between text blocks for readability
-                        full_text += "\n"
-                
-                # Try to identify tables using structure recognition
-                tables = []
-                try:
-                    # Simple table detection heuristic - look for aligned text blocks
-                    for block in blocks:
-                        if block["type"] == 0 and "lines" in block:
-                            lines = [" ".join(span["text"] for span in line["spans"]) for line in block["lines"]]
-                            
-                            # Check if this might be tabular data
-                            if len(lines) >= 2:
-                                # Look for consistent spacing patterns or delimiter characters
-                                potential_table = True
-                                for line in lines:
-                                    # Skip very short lines
-                                    if len(line) < 5:
-                                        continue
-                                    # Check for multiple spaces, tabs, or pipe characters
-                                    if '  ' not in line and '\t' not in line and '|' not in line:
-                                        potential_table = False
-                                        break
-                                
-                                if potential_table:
-                                    tables.append("\n".join(lines))
-                    
-                    if tables:
-                        full_text += "\n=== Tables on Page " + str(page_num) + " ===\n"
-                        for i, table in enumerate(tables, 1):
-                            full_text += f"Table {i}:\n{table}\n\n"
-                except Exception as e:
-                    print(f"Warning: Table detection error on page {page_num}: {e}")
-                
-                full_text += "\n"  # Add extra newline between pages
-                
-            return full_text.strip()  # Return the complete text
+        with open_pdf(pdf_path) as doc:
+            page_count = doc.page_count
+            metrics.inc("qpat_pages_total", page_count)
+            if not processes or processes < 2 or page_count < PARALLEL_MIN_PAGES:
+                return "".join(iter_pdf_text(doc)).strip()  # Return the complete text
+
+        # Spread contiguous page ranges across worker processes (buffers are sent as bytes)
+        source = pdf_path if isinstance(pdf_path, (str, bytes)) else bytes(pdf_path)
+        step = -(-page_count // processes)
+        ranges = [(source, start, start + step) for start in range(0, page_count, step)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return "".join(executor.map(_extract_page_range, ranges)).strip()
             
     except Exception as e:
-        print(f"❌ Error processing {pdf_path}: {e}")
+        print(f"❌ Error processing {name}: {e}")
         return ""
 
 def refine_extracted_text(text):
@@ -100,34 +225,134 @@ def refine_extracted_text(text):
     
     return text.strip()
 
-def generate_json_with_gemini(text, pdf_filename):
-    """Generate JSON from extracted text using Gemini API."""
+def paper_text(doc):
+    """Refined full text of an open PDF, as used to build the boilerplate tables."""
+    return refine_extracted_text("".join(iter_pdf_text(doc)))
+
+def has_text(text):
+    """True if extracted text has anything besides its "=== Page N ===" markers (scanned PDFs have not)."""
+    return bool(PAGE_MARKER_LINE_PATTERN.sub("", text or "").strip())
+
+def validate_question(item):
+    """
+    Check one extracted object against the question schema.
+
+    Numbers given as numeric strings or whole floats are converted; missing
+    optional fields become null.
+
+    Returns:
+        dict: The question with exactly the schema fields, or None if it
+            has no question text or a field of the wrong type or out of range
+    """
+    if not isinstance(item, dict):
+        return None
+    text = item.get("question")
+    if not isinstance(text, str) or not text.strip():
+        return None
+    question = {"question": text.strip()}
+    for field in ("marks", "year", "page"):
+        value = item.get(field)
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        elif isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            return None
+        # Negative or huge numbers are not marks, years or pages, and would not fit the bank's columns
+        if value is not None and not 0 <= value <= MAX_INT_VALUE:
+            return None
+        question[field] = value
+    for field in ("unit", "subject"):
+        value = item.get(field)
+        if value is not None and not isinstance(value, str):
+            return None
+        question[field] = (value.strip() or None) if isinstance(value, str) else None
+    return question
+
+def page_numbers(text):
+    """Numbers of the "=== Page N ===" sections in a text, in order."""
+    return [int(number) for number in PAGE_NUMBER_PATTERN.findall(text)]
+
+def select_pages(text, pages):
+    """Keep only the given "=== Page N ===" sections of a text (and whatever precedes the first one)."""
+    pieces = PAGE_MARKER_PATTERN.split(text)
+    kept = []
+    for piece in pieces:
+        marker = PAGE_NUMBER_PATTERN.match(piece)
+        if marker is None or int(marker.group(1)) in pages:
+            kept.append(piece)
+    return "".join(kept)
+
+def _damaged_pages(items, truncated, pages):
+    """
+    Work out which pages of a response cannot be trusted.
+
+    A rejected object spoils the pages between the valid questions around
+    it; a truncated response spoils everything from the last valid
+    question's page on.
+    """
+    damaged = set()
+    known = [item["page"] for item in items if item is not None]
+    last_page = pages[0]
+    for index, item in enumerate(items):
+        if item is not None:
+            last_page = item["page"]
+            continue
+        following = next((other["page"] for other in items[index + 1:] if other is not None), pages[-1])
+        damaged.update(page for page in pages if last_page <= page <= following)
+    if truncated:
+        damaged.update(page for page in pages if page >= (known[-1] if known else pages[0]))
+    return sorted(damaged)
+
+def request_questions_from_gemini(text, use_cache=True):
+    """
+    Ask Gemini to extract the question list from refined paper text.
+
+    The response is requested as JSON constrained to QUESTION_SCHEMA and
+    parsed while it streams in, so a truncated or partly malformed answer
+    still yields every valid question. Each question records the page it
+    starts on, which tells the caller exactly which pages to ask for again.
+
+    Args:
+        text (str): Refined paper text (or one chunk of it)
+        use_cache (bool): Serve an identical earlier request from the response cache
+
+    Returns:
+        tuple: (list of question dictionaries including their "page",
+            sorted page numbers whose questions are missing or unreliable)
+
+    Raises:
+        ValueError: If the response holds no usable question at all
+    """
     prompt = f"""You are an expert in extracting structured data from exam question papers. Given the raw text extracted from a PDF exam paper, extract the following information for each question:
 "question": The full question text. Include all parts of the question and any related content.
 "marks": The number of marks allocated to the question as an integer. Use null if not mentioned.
 "year": The year the exam was conducted as an integer. Use null if not mentioned.
 "unit": The unit the question belongs to (e.g., "Unit 1"). Use null if it cannot be determined.
 "subject": The name of the subject of the exam. Use null if not available.
+"page": The number N of the "=== Page N ===" section the question starts in, as an integer.
 
 If the question includes a table, extract the table contents as part of the question field. Ensure the table is represented clearly with proper formatting—either markdown-style or CSV-style—with all columns and rows preserved.
 For extracting questions,do not extract question numbes or subquestion numbers only the question text.
 If you identify any tacle data awhich is given in text make sure you add the proper table syntax to it.
 
-Return the output as a JSON array. Each question must be a single JSON object formatted like this:
+Return the output as a JSON array in the order the questions appear. Each question must be a single JSON object formatted like this:
 [
   {{
     "question": "What is data mining?",
     "marks": 6,
     "year": 2021,
     "unit": "Unit 1",
-    "subject": "Data Mining"
+    "subject": "Data Mining",
+    "page": 1
   }},
   {{
     "question": "Describe the process of data cleaning.",
     "marks": 4,
     "year": 2022,
     "unit": "Unit 2",
-    "subject": "Data Mining"
+    "subject": "Data Mining",
+    "page": 2
   }}
 ]
 Here is an example of a question object:
@@ -136,47 +361,263 @@ Here is an example of a question object:
   "marks": 15,
   "year": 2023,
   "unit": "Unit 1",
-  "subject": "Data Mining"
+  "subject": "Data Mining",
+  "page": 1
 }}
 Use the following extracted text:
 {text}
 
 Important:
 All fields must appear in every object.
-marks and year must be integers or null.
+marks, year and page must be integers or null.
 Only return valid JSON. Do not include any additional text, comments, or explanation outside the JSON.
     """
+    parser = JSONArrayParser()
+    items = []
+    truncated = False
     try:
-        # Initialize the model inside the function
-        model = genai.GenerativeModel("gemini-1.5-flash")  # Updated to use correct model name
-        response = model.generate_content(prompt)
+        for piece in stream_text(model_for("extract"), prompt, EXTRACTION_CONFIG, use_cache=use_cache):
+            items.extend(parser.feed(piece))
+    except Exception as e:
+        if not items:
+            raise
+        print(f"⚠️ Response broke off after {len(items)} objects: {e}")
+        truncated = True
+    truncated = truncated or not parser.complete
 
-        # Ensure the response is valid
-        if not response or not response.text.strip():
-            raise ValueError("Empty or invalid response from Gemini API.")
+    # Text without page markers is handled as a single page
+    pages = page_numbers(text) or [1]
+    questions = []
+    page = pages[0]
+    for item in items:
+        question = validate_question(item)
+        if question is not None:
+            # Pages outside this text cannot be re-requested; keep the previous one
+            if question["page"] in pages:
+                page = question["page"]
+            question["page"] = page
+        questions.append(question)
 
-        # Attempt to parse the response as JSON
+    valid = [question for question in questions if question is not None]
+    rejected = len(questions) - len(valid)
+    if not questions:
+        # An empty answer is no result either; ask the model again on the next try
+        forget_response(model_for("extract"), prompt, EXTRACTION_CONFIG)
+    if rejected or truncated:
+        # An incomplete answer must not be served from the cache next time
+        forget_response(model_for("extract"), prompt, EXTRACTION_CONFIG)
+        metrics.inc("qpat_extraction_salvaged_total", len(valid))
+        metrics.inc("qpat_extraction_rejected_total", rejected)
+        print(f"⚠️ Kept {len(valid)} valid question(s) from an incomplete response "
+              f"({rejected} rejected{', truncated' if truncated else ''})")
+        if not valid:
+            raise ValueError("The response from Gemini API does not contain any valid question.")
+    return valid, _damaged_pages(questions, truncated, pages)
+
+def split_text_into_chunks(text, max_tokens=CHUNK_TOKEN_BUDGET):
+    """
+    Split refined paper text into chunks that fit a token budget.
+
+    The text is split on the "=== Page N ===" markers and whole pages are
+    packed into chunks. Any metadata before the first page is repeated at the
+    top of every chunk so each request still knows the subject. A single page
+    larger than the budget is split further on blank lines.
+
+    Args:
+        text (str): Refined text produced by refine_extracted_text
+        max_tokens (int): Token budget per chunk
+
+    Returns:
+        list: Chunk strings, in page order
+    """
+    pieces = PAGE_MARKER_PATTERN.split(text)
+    preamble = ""
+    if pieces and not pieces[0].startswith("=== Page"):
+        preamble = pieces.pop(0)
+    pages = [page for page in pieces if page.strip()]
+    if not pages:
+        return [text] if text.strip() else []
+
+    budget = max(1, max_tokens - estimate_tokens(preamble))
+
+    # Break oversized pages into paragraph groups that fit on their own
+    units = []
+    for page in pages:
+        if estimate_tokens(page) <= budget:
+            units.append(page)
+            continue
+        part = ""
+        for paragraph in page.split("\n\n"):
+            if part and estimate_tokens(part) + estimate_tokens(paragraph) > budget:
+                units.append(part)
+                part = ""
+            part += paragraph + "\n\n"
+        if part.strip():
+            units.append(part)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > budget:
+            chunks.append(preamble + "".join(current))
+            current = []
+            current_tokens = 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append(preamble + "".join(current))
+    return chunks
+
+def _normalize_question(question):
+    """Lower-case a question and drop everything but letters and digits, for comparisons."""
+    return re.sub(r'[^a-z0-9]+', '', str(question.get("question") or "").lower())
+
+def merge_chunk_questions(chunk_results, window=3):
+    """
+    Merge per-chunk question lists, dropping duplicates at chunk boundaries.
+
+    A question split across a page break is often returned by both chunks,
+    sometimes truncated in one of them. The first ``window`` questions of a
+    chunk are compared against the last ``window`` questions already kept;
+    exact matches are dropped and a truncated copy is replaced by the
+    longer one.
+
+    Args:
+        chunk_results (list): One question list per chunk, in page order
+        window (int): How many questions on each side of a boundary to compare
+
+    Returns:
+        list: Merged question list
+    """
+    merged = []
+    for questions in chunk_results:
+        boundary_start = len(merged)
+        for index, question in enumerate(questions):
+            if index < window and boundary_start:
+                key = _normalize_question(question)
+                duplicate = False
+                for kept_index in range(max(0, boundary_start - window), boundary_start):
+                    kept_key = _normalize_question(merged[kept_index])
+                    if not key or not kept_key:
+                        continue
+                    if key == kept_key or kept_key.startswith(key):
+                        duplicate = True
+                        break
+                    if key.startswith(kept_key):
+                        merged[kept_index] = question
+                        duplicate = True
+                        break
+                if duplicate:
+                    continue
+            merged.append(question)
+    return merged
+
+def _request_chunk_with_retries(chunk, chunk_number, attempts=CHUNK_ATTEMPTS):
+    """
+    Extract one chunk, asking again only for the pages whose questions were lost.
+
+    Returns:
+        tuple: (questions in page order, True if every page was extracted)
+
+    Raises:
+        ValueError: If no attempt produced a single question
+    """
+    kept = []
+    text = chunk
+    last_error = None
+    for attempt in range(1, attempts + 1):
         try:
-            json_data = json.loads(response.text.strip())
-        except json.JSONDecodeError as e:
-            print(f"Gemini returned invalid JSON, attempting to fix. Error: {e}")
-            # Attempt to fix the JSON by extracting the valid JSON part
-            start_index = response.text.find('[')
-            end_index = response.text.rfind(']')
-            if start_index != -1 and end_index != -1:
-                try:
-                    json_data = json.loads(response.text[start_index:end_index+1])
-                except json.JSONDecodeError:
-                    raise ValueError("The response from Gemini API is not valid JSON even after attempting to fix.")
-            else:
-                raise ValueError("The response from Gemini API does not contain valid JSON array.")
-
-        # Save the JSON data to a file
-        output_path = os.path.join("json_data", f"{os.path.splitext(os.path.basename(pdf_filename))[0]}_questions.json")
-        os.makedirs("json_data", exist_ok=True)  # Ensure the output directory exists
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
-        print(f"✅ JSON saved to {output_path}")
+            # Retries bypass the response cache so a bad cached answer is replaced
+            questions, missing = request_questions_from_gemini(text, use_cache=attempt == 1)
+        except Exception as e:
+            last_error = e
+            print(f"⚠️ Chunk {chunk_number} failed (attempt {attempt}/{attempts}): {e}")
+        else:
+            kept.extend(question for question in questions if question["page"] not in missing)
+            if not missing:
+                break
+            last_error = ValueError(f"page(s) {', '.join(map(str, missing))} incomplete")
+            print(f"⚠️ Chunk {chunk_number}: re-requesting page(s) {', '.join(map(str, missing))} "
+                  f"(attempt {attempt}/{attempts})")
+            text = select_pages(chunk, missing) if PAGE_NUMBER_PATTERN.search(chunk) else chunk
+        if attempt < attempts:
+            metrics.inc("qpat_retries_total", stage="extract")
+    else:
+        if not kept:
+            metrics.record_event("error", stage="extract_chunk", chunk=chunk_number, error=str(last_error))
+            raise ValueError(f"Chunk {chunk_number} failed after {attempts} attempts: {last_error}")
+        metrics.record_event("error", stage="extract_chunk", chunk=chunk_number, error=str(last_error), partial=True)
+        return _without_pages(kept), False
+    return _without_pages(kept), True
+
+def _without_pages(questions):
+    """Order questions by page (stable) and drop the page field."""
+    return [
+        {field: value for field, value in question.items() if field != "page"}
+        for question in sorted(questions, key=lambda question: question["page"])
+    ]
+
+def extract_questions_from_text(text, max_tokens=CHUNK_TOKEN_BUDGET, max_workers=CHUNK_MAX_WORKERS):
+    """
+    Extract a paper's questions, splitting long text into token-budgeted chunks.
+
+    Chunks are sent to Gemini in parallel; when a response comes back cut
+    off or partly malformed, only the pages it lost are asked for again.
+    If some pages or chunks still fail, the other questions are returned
+    and the result is flagged as incomplete.
+
+    Returns:
+        tuple: (list of question dictionaries, True if every chunk succeeded)
+
+    Raises:
+        ValueError: If no chunk could be extracted
+    """
+    chunks = split_text_into_chunks(text, max_tokens)
+    if not chunks:
+        raise ValueError("No text to extract questions from.")
+    if len(chunks) == 1:
+        return _request_chunk_with_retries(chunks[0], 1)
+
+    print(f"✂️ Split text into {len(chunks)} chunks")
+    results = [None] * len(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        futures = {
+            executor.submit(_request_chunk_with_retries, chunk, number): number
+            for number, chunk in enumerate(chunks, start=1)
+        }
+        for future in as_completed(futures):
+            number = futures[future]
+            try:
+                results[number - 1] = future.result()
+            except ValueError as e:
+                print(f"❌ {e}")
+
+    succeeded = [result for result in results if result is not None]
+    if not succeeded:
+        raise ValueError("Every chunk failed to extract.")
+    complete = len(succeeded) == len(chunks) and all(chunk_complete for _, chunk_complete in succeeded)
+    return merge_chunk_questions([questions for questions, _ in succeeded]), complete
+
+def questions_json_path(pdf_filename, json_dir="json_data"):
+    """Return the <json_dir>/<name>_questions.json path for a PDF."""
+    return os.path.join(json_dir, f"{os.path.splitext(os.path.basename(pdf_filename))[0]}_questions.json")
+
+def save_questions_json(questions, pdf_filename, json_dir="json_data"):
+    """Save a paper's question list to <json_dir>/<name>_questions.json."""
+    output_path = questions_json_path(pdf_filename, json_dir)
+    os.makedirs(json_dir, exist_ok=True)  # Ensure the output directory exists
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(questions, f, indent=2, ensure_ascii=False)
+    print(f"✅ JSON saved to {output_path}")
+    return output_path
+
+def generate_json_with_gemini(text, pdf_filename, json_dir="json_data"):
+    """Generate JSON from extracted text using Gemini API."""
+    try:
+        json_data, _ = extract_questions_from_text(text)
+        save_questions_json(json_data, pdf_filename, json_dir)
         return True
     except ValueError as e:
         print(f"❌ Error generating JSON for {pdf_filename}: {e}")
@@ -184,26 +625,328 @@ Only return valid JSON. Do not include any additional text, comments, or explana
         print(f"❌ Unexpected error generating JSON for {pdf_filename}: {e}")
     return False
 
-def convert_pdf_to_json(pdf_path):
-    """Convert a PDF to JSON by extracting and processing text."""
-    print(f"📄 Processing {pdf_path}...")
-    
-    # Extract text from PDF
-    extracted_text = extract_text_from_pdf(pdf_path)
-    
-    if not extracted_text:
-        print(f"❌ No text extracted from {pdf_path}")
+def _page_groups(pages):
+    """Split sorted page indexes into runs of consecutive pages."""
+    groups = []
+    for page_index in pages:
+        if groups and groups[-1][-1] == page_index - 1:
+            groups[-1].append(page_index)
+        else:
+            groups.append([page_index])
+    return groups
+
+def extract_questions_by_layout(pdf_bytes, name="PDF", mode=EXTRACTOR_MODE, threshold=RULE_CONFIDENCE, boilerplate=None):
+    """
+    Extract a paper's questions with the layout rules, asking the model only where they are unsure.
+
+    Pages whose questions score below ``threshold`` (and every page a
+    question on them spills onto) are re-extracted by the model, one
+    request per run of consecutive pages; the model's questions replace the
+    rule-based ones for those pages and the result stays in page order. If
+    the model fails on a run, the rule-based questions are kept for it.
+
+    Args:
+        pdf_bytes (bytes | memoryview): The PDF file contents
+        name (str): Name used in messages
+        mode (str): "auto" to route unsure pages to the model, "rules" to never do so
+        threshold (float): Page confidence below which the model is used
+        boilerplate (BoilerplateTable): Batch-wide tables used to strip repeated
+            lines from the pages sent to the model (this paper's own if None)
+
+    Returns:
+        tuple: (list of question dictionaries, True if every model request succeeded)
+
+    Raises:
+        ValueError: If the PDF has no text
+    """
+    with open_pdf(pdf_bytes) as doc:
+        metrics.inc("qpat_pages_total", doc.page_count)
+        if not any(page.get_text().strip() for page in doc):
+            # Scanned or image-only: nothing for the rules or the model to read
+            raise ValueError("No text extracted from the PDF.")
+        layout = extract_layout_questions(doc)
+        low = set()
+        if mode == "auto":
+            low = {index for index, score in enumerate(layout["page_confidence"]) if score < threshold}
+            # A question crossing into a low-confidence page is re-extracted whole
+            changed = True
+            while changed:
+                changed = False
+                for pages in layout["question_pages"]:
+                    if pages & low and not pages <= low:
+                        low |= pages
+                        changed = True
+
+        # Text of the pages the model will see, with the paper details the
+        # rules found so each request knows the subject, year and unit
+        preamble = "".join(
+            f"{label}: {value}\n\n" for label, value in (("Subject", layout["subject"]), ("Year", layout["year"]))
+            if value is not None
+        )
+        groups = []
+        for pages in _page_groups(sorted(low)):
+            chunks = []
+            for page_index in pages:
+                chunk = extract_page_text(doc[page_index], page_index + 1)
+                unit = layout["page_units"][page_index]
+                if unit:
+                    chunk = chunk.replace("\n", f"\nCurrent unit: {unit}\n", 1)
+                chunks.append(chunk)
+            groups.append((pages, refine_extracted_text(preamble + "".join(chunks))))
+
+        if groups and STRIP_BOILERPLATE:
+            boilerplate = boilerplate or BoilerplateTable()
+            if name not in boilerplate:
+                boilerplate.add_paper(name, paper_text(doc))
+            texts = boilerplate.strip_paper(name, [text for _, text in groups])
+            groups = [(pages, text) for (pages, _), text in zip(groups, texts)]
+
+    if not layout["questions"] and not groups:
+        raise ValueError("No questions found in the PDF text.")
+
+    rule_pages = len(layout["page_confidence"]) - len(low)
+    metrics.inc("qpat_pages_routed_total", rule_pages, route="rules")
+    metrics.inc("qpat_pages_routed_total", len(low), route="llm")
+    if low:
+        print(f"🧭 {name}: {rule_pages} page(s) by layout rules, {len(low)} sent to the model")
+
+    # Each question is placed at the first page it appears on
+    placed = [
+        (min(pages), position, question)
+        for position, (question, pages) in enumerate(zip(layout["questions"], layout["question_pages"]))
+        if not pages & low
+    ]
+    complete = True
+    for pages, text in groups:
+        try:
+            questions, group_complete = extract_questions_from_text(text)
+        except ValueError as e:
+            print(f"⚠️ Model extraction failed for pages {pages[0] + 1}-{pages[-1] + 1} of {name}, "
+                  f"keeping the layout rules' questions: {e}")
+            questions = [
+                question for question, question_pages in zip(layout["questions"], layout["question_pages"])
+                if min(question_pages) in pages
+            ]
+            group_complete = False
+        complete = complete and group_complete
+        placed.extend((pages[0], position, question) for position, question in enumerate(questions))
+
+    placed.sort(key=lambda item: item[:2])
+    return [question for _, _, question in placed], complete
+
+def _record_paper_failure(name, error):
+    metrics.inc("qpat_papers_total", result="failed")
+    metrics.record_event("error", stage="extract", paper=name, error=str(error))
+
+def extract_paper(pdf_bytes, name="PDF", use_cache=True, boilerplate=None):
+    """
+    Extract the question list of a paper held in memory.
+
+    Results are cached on disk keyed by the PDF bytes, so a paper that was
+    already processed is served without touching PyMuPDF or Gemini. A
+    partial result (some pages could not be extracted) is returned but not
+    cached, and callers keeping it should expect to extract the paper again.
+
+    Args:
+        pdf_bytes (bytes | memoryview): The PDF file contents
+        name (str): Name used in messages
+        use_cache (bool): Read and update the extraction cache
+        boilerplate (BoilerplateTable): Batch-wide tables of repeated lines,
+            shared by the papers of a batch (this paper's own if None)
+
+    Returns:
+        tuple: (question dictionaries or None if extraction failed,
+            True if every page was extracted)
+    """
+    print(f"📄 Processing {name}...")
+
+    cache = get_extraction_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = extraction_cache_key(pdf_bytes)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            try:
+                questions = json.loads(cached)
+                print(f"⚡ Cache hit for {name}")
+                metrics.inc("qpat_papers_total", result="cached")
+                metrics.inc("qpat_questions_total", len(questions), stage="extract")
+                return questions, True
+            except ValueError as e:
+                print(f"⚠️ Ignoring unreadable cache entry for {name}: {e}")
+
+    try:
+        if EXTRACTOR_MODE != "llm":
+            with metrics.timed("question_extraction", extractor=EXTRACTOR_MODE):
+                questions, complete = extract_questions_by_layout(pdf_bytes, name, boilerplate=boilerplate)
+        else:
+            # Extract text from PDF
+            with metrics.timed("pdf_text"):
+                extracted_text = extract_text_from_pdf(pdf_bytes, processes=EXTRACTION_PROCESSES, name=name)
+
+            if not has_text(extracted_text):
+                print(f"❌ No text extracted from {name}")
+                _record_paper_failure(name, "No text extracted")
+                return None, False
+
+            text = refine_extracted_text(extracted_text)
+            if STRIP_BOILERPLATE:
+                boilerplate = boilerplate or BoilerplateTable()
+                boilerplate.add_paper(name, text)
+                [text] = boilerplate.strip_paper(name, [text])
+
+            # Generate JSON using Gemini API on the refined text
+            with metrics.timed("question_extraction", extractor=EXTRACTOR_MODE):
+                questions, complete = extract_questions_from_text(text)
+    except ValueError as e:
+        print(f"❌ Error generating JSON for {name}: {e}")
+        _record_paper_failure(name, e)
+        return None, False
+    except Exception as e:
+        print(f"❌ Unexpected error generating JSON for {name}: {e}")
+        _record_paper_failure(name, e)
+        return None, False
+
+    if not questions:
+        # A paper without questions is a failed conversion, never a complete (cached) result
+        print(f"❌ No questions extracted from {name}")
+        _record_paper_failure(name, "No questions extracted")
+        return None, False
+
+    metrics.inc("qpat_papers_total", result="extracted" if complete else "partial")
+    metrics.inc("qpat_questions_total", len(questions), stage="extract")
+
+    # Partial results are kept but not cached, so the next run retries them
+    if cache is not None and complete:
+        cache.set(cache_key, json.dumps(questions, ensure_ascii=False).encode("utf-8"))
+
+    return questions, complete
+
+def extract_questions_from_pdf(pdf_bytes, name="PDF", use_cache=True, boilerplate=None):
+    """
+    Extract the question list of a paper held in memory (see extract_paper).
+
+    Returns:
+        list: Question dictionaries, or None if extraction failed
+    """
+    questions, _ = extract_paper(pdf_bytes, name, use_cache=use_cache, boilerplate=boilerplate)
+    return questions
+
+def convert_pdf_to_json(pdf_path, use_cache=True, json_dir="json_data"):
+    """Convert a PDF file to <json_dir>/<name>_questions.json."""
+    try:
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+    except OSError as e:
+        print(f"❌ Error reading {pdf_path}: {e}")
         return False
-    
-    # Refine the extracted text
-    refined_text = refine_extracted_text(extracted_text)
-    
-    # Generate JSON using Gemini API
-    success = generate_json_with_gemini(refined_text, pdf_path)
-    
-    return success
 
-def process_pdfs_in_folder():
+    questions = extract_questions_from_pdf(pdf_bytes, pdf_path, use_cache=use_cache)
+    if questions is None:
+        return False
+    try:
+        save_questions_json(questions, pdf_path, json_dir)
+    except OSError as e:
+        print(f"❌ Error saving JSON for {pdf_path}: {e}")
+        return False
+    return True
+
+def _run_concurrently(func, items, names, max_workers, on_complete, on_result=None):
+    """
+    Call ``func`` on every item with a bounded thread pool; results come back in input order.
+
+    ``on_result(index, result)`` is called in the calling thread as each item
+    finishes, before ``on_complete``.
+    """
+    results = [None] * len(items)
+    total = len(items)
+    if not total:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total))) as executor:
+        futures = {executor.submit(func, item): index for index, item in enumerate(items)}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"❌ Unexpected error processing {names[index]}: {e}")
+            if on_result is not None:
+                on_result(index, results[index])
+            if on_complete is not None:
+                # An empty question list is still a successful extraction
+                on_complete(names[index], results[index] is not None and results[index] is not False, completed, total)
+
+    return results
+
+def convert_pdfs_concurrently(pdf_paths, max_workers=DEFAULT_MAX_WORKERS, on_complete=None, json_dir="json_data"):
+    """
+    Convert several PDFs to JSON using a bounded thread pool.
+
+    Args:
+        pdf_paths (list): Paths of the PDFs to convert
+        max_workers (int): Maximum number of papers converted at once
+        on_complete (callable): Optional callback invoked in the calling thread
+            as ``on_complete(pdf_path, success, completed, total)`` each time a
+            paper finishes
+        json_dir (str): Folder receiving the per-paper JSON files
+
+    Returns:
+        dict: Mapping of PDF path to a success flag, in input order
+    """
+    results = _run_concurrently(
+        lambda path: convert_pdf_to_json(path, json_dir=json_dir), pdf_paths, pdf_paths, max_workers, on_complete
+    )
+    return {path: bool(success) for path, success in zip(pdf_paths, results)}
+
+def extract_papers_concurrently(papers, max_workers=DEFAULT_MAX_WORKERS, on_complete=None, on_result=None):
+    """
+    Extract the questions of several in-memory PDFs using a bounded thread pool.
+
+    Nothing is written to disk apart from the extraction cache. Unless the
+    model is never used, the text of every paper is scanned first, so lines
+    repeated across the batch are stripped from all of them.
+
+    Args:
+        papers (list): ``(name, pdf_bytes)`` pairs
+        max_workers (int): Maximum number of papers converted at once
+        on_complete (callable): Optional callback invoked in the calling thread
+            as ``on_complete(name, success, completed, total)`` each time a
+            paper finishes
+        on_result (callable): Optional callback invoked in the calling thread
+            as ``on_result(index, questions, complete)`` as soon as a paper's
+            questions are ready, so they can be used while other papers are
+            extracted; ``complete`` is False for a partial extraction
+
+    Returns:
+        list: Question list (or None on failure) for each paper, in input order
+    """
+    names = [name for name, _ in papers]
+    boilerplate = None
+    if STRIP_BOILERPLATE and EXTRACTOR_MODE != "rules" and len(papers) > 1:
+        boilerplate = BoilerplateTable()
+        for name, pdf_bytes in papers:
+            try:
+                with open_pdf(pdf_bytes) as doc:
+                    boilerplate.add_paper(name, paper_text(doc))
+            except Exception as e:
+                # The paper's own extraction reports the problem
+                print(f"⚠️ Could not scan {name} for boilerplate: {e}")
+    complete = [False] * len(papers)
+
+    def extract(index):
+        name, pdf_bytes = papers[index]
+        questions, complete[index] = extract_paper(pdf_bytes, name, boilerplate=boilerplate)
+        return questions
+
+    def report(index, questions):
+        on_result(index, questions, complete[index])
+
+    return _run_concurrently(
+        extract, list(range(len(papers))), names, max_workers, on_complete, report if on_result else None,
+    )
+
+def process_pdfs_in_folder(max_workers=DEFAULT_MAX_WORKERS):
     """Process all PDFs in the 'pdf' folder."""
     pdf_folder = "pdf"
     if not os.path.exists(pdf_folder):
@@ -219,16 +962,19 @@ def process_pdfs_in_folder():
         print(f"❌ No PDF files found in '{pdf_folder}' folder.")
         return
     
-    print(f"🔍 Found {len(pdf_files)} PDF files to process.")
+    print(f"🔍 Found {len(pdf_files)} PDF files to process with {max_workers} workers.")
     
-    # Process each PDF file
-    successful = 0
-    for filename in pdf_files:
-        pdf_path = os.path.join(pdf_folder, filename)
-        if convert_pdf_to_json(pdf_path):
-            successful += 1
+    # Process the PDF files concurrently
+    pdf_paths = [os.path.join(pdf_folder, filename) for filename in pdf_files]
+    results = convert_pdfs_concurrently(pdf_paths, max_workers=max_workers)
+    successful = sum(results.values())
+    for path, success in results.items():
+        if not success:
+            print(f"❌ Failed: {path}")
     
     print(f"✅ Processing complete. Successfully processed {successful} out of {len(pdf_files)} PDF files.")
+    stats = get_extraction_cache().stats()
+    print(f"📦 Extraction cache: {stats['hits']} hits, {stats['misses']} misses")
 
 def main():
     """Main function to configure API and process PDFs."""
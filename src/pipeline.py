@@ -0,0 +1,199 @@
+import os
+import threading
+
+from src.pdf_to_json import extract_papers_concurrently, get_extraction_cache, save_questions_json, DEFAULT_MAX_WORKERS
+from src.json_to_markdown import ask_gemini_to_format, format_questions_locally, save_markdown
+from src.question_store import QuestionStore
+from src.markdown_to_pdf import markdown_to_pdf
+from src import metrics
+from src.llm import llm_cache_stats
+from src.most_likely_questions import generate_most_likely_questions
+from src.stage_graph import StageGraph
+
+# Also keep uploaded PDFs in pdf/ and their questions in json_data/
+PERSIST_UPLOADS = os.getenv("QPAT_PERSIST_UPLOADS", "0") == "1"
+
+
+def _no_progress(stage, fraction, message, **partial):
+    pass
+
+
+def _collect_stream(chunks, on_partial):
+    """
+    Join streamed chunks, reporting the text so far after each one.
+
+    A generator that returns a text (see ask_gemini_to_format) has the final
+    say over the joined chunks.
+    """
+    chunks = iter(chunks)
+    parts = []
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as stop:
+            return stop.value if stop.value is not None else "".join(parts)
+        parts.append(chunk)
+        on_partial("".join(parts))
+
+
+def _persist_paper(workspace, filename, pdf_bytes, questions):
+    """Write an uploaded paper and its questions to the workspace's pdf/ and json_data/."""
+    with open(os.path.join(workspace.pdf_dir, os.path.basename(filename)), "wb") as f:
+        f.write(pdf_bytes)
+    save_questions_json(questions, filename, workspace.json_dir)
+
+
+def _serialized(progress):
+    """Wrap a progress callback so stages running in parallel report one at a time."""
+    lock = threading.Lock()
+
+    def report(stage, fraction, message, **partial):
+        with lock:
+            progress(stage, fraction, message, **partial)
+    return report
+
+
+def run_pipeline(papers, workspace, options=None, progress=None):
+    """
+    Run the whole processing pipeline for a batch of uploaded papers.
+
+    Extracts the new PDFs in memory, appends them to the workspace's question bank,
+    formats the bank, predicts the most likely questions and renders the
+    question-bank PDF, reporting progress along the way. Questions and
+    markdown pass between stages in memory; only the final outputs are
+    written.
+
+    The stages run as a graph (see StageGraph): each paper is added to the
+    bank as soon as its extraction finishes, prediction starts as soon as
+    the bank is complete, alongside formatting, and rendering starts once
+    formatting is done. Stages running in parallel report their progress
+    interleaved.
+
+    Args:
+        papers (list): ``(filename, paper_key, pdf_bytes)`` of the papers not
+            yet in the bank; ``paper_key`` is the content hash used as bank key
+        workspace (Workspace): Session workspace receiving the markdown and PDF outputs
+        options (dict): ``max_workers``, ``formatter`` ("local" or "gemini"),
+            ``subject`` filter, ``skipped`` count of papers already in the bank
+            and ``persist`` to also keep the PDFs and per-paper JSON in the workspace
+        progress (callable): ``progress(stage, fraction, message, **partial)``;
+            ``partial`` may carry ``bank`` or ``predictions`` markdown so far
+
+    Returns:
+        dict: Counts of processed papers, the paths of the generated files
+            and a summary of the run's metrics
+
+    Raises:
+        ValueError: If no questions are available or formatting fails
+    """
+    options = options or {}
+    progress = _serialized(progress or _no_progress)
+    workspace.create()
+    bank_path = workspace.bank_path
+    predicted_path = workspace.predicted_path
+    pdf_path = workspace.pdf_path
+
+    persist = options.get("persist", PERSIST_UPLOADS)
+    formatter = options.get("formatter", "local")
+    metrics_before = metrics.snapshot()
+    store = QuestionStore(workspace.store_path)
+    failed_files = []
+    prediction_errors = []
+
+    def extract():
+        """Extract the new PDFs straight from memory, appending each to the bank as it completes."""
+        progress("extract", 0.0, "Converting PDFs to JSON...")
+
+        def on_pdf_complete(filename, success, completed, total):
+            progress("extract", completed / total, f"Converting PDFs to JSON... ({completed}/{total} done, last: {filename})")
+
+        def merge(index, questions, complete):
+            filename, paper_key, pdf_bytes = papers[index]
+            if questions is None:
+                failed_files.append(filename)
+                return
+            try:
+                # A partial paper is stored for now and extracted again when uploaded next time
+                store.add_paper(paper_key, filename, questions, complete=complete)
+                if persist:
+                    _persist_paper(workspace, filename, pdf_bytes, questions)
+            except Exception as e:
+                print(f"⚠️ Could not store questions from {filename}: {e}")
+                failed_files.append(filename)
+
+        extract_papers_concurrently(
+            [(filename, pdf_bytes) for filename, _, pdf_bytes in papers],
+            max_workers=options.get("max_workers", DEFAULT_MAX_WORKERS),
+            on_complete=on_pdf_complete,
+            on_result=merge,
+        )
+
+        bank = store.query_bank(subject=options.get("subject"))
+        if not bank:
+            raise ValueError("No questions could be extracted from the PDFs.")
+        if persist:
+            bank.save(os.path.join(workspace.json_dir, "all_questions.qbank"))
+        # The formatter and the predictor work on question dictionaries
+        return bank, bank.to_dicts()
+
+    def format_bank(extracted):
+        """Convert the bank to markdown."""
+        _, all_questions = extracted
+        progress("format", 0.0, "Creating markdown content...")
+        if formatter == "gemini":
+            optimized_markdown = _collect_stream(
+                ask_gemini_to_format(all_questions, stream=True),
+                lambda text: progress("format", 0.5, "Formatting with Gemini...", bank=text),
+            )
+        else:
+            optimized_markdown = format_questions_locally(all_questions)
+        if not optimized_markdown:
+            raise ValueError("Error generating markdown.")
+        save_markdown(optimized_markdown, bank_path)
+        progress("format", 1.0, "Question bank formatted.", bank=optimized_markdown)
+        return optimized_markdown
+
+    def predict(extracted):
+        """Generate the most likely questions; ranking works on the questions, not the markdown."""
+        _, all_questions = extracted
+        progress("predict", 0.0, "Generating most likely questions...")
+        try:
+            _collect_stream(
+                generate_most_likely_questions(all_questions, predicted_path, stream=True),
+                lambda text: progress("predict", 0.5, "Generating most likely questions...", predictions=text),
+            )
+        except Exception as e:
+            prediction_errors.append(str(e))
+            print(f"❌ Error generating most likely questions: {e}")
+        progress("predict", 1.0, "Most likely questions generated." if not prediction_errors
+                 else "Could not generate the most likely questions.")
+
+    def render(optimized_markdown):
+        """Create the question-bank PDF from the formatted markdown."""
+        progress("render", 0.0, "Converting markdown to PDF...")
+        markdown_to_pdf(INPUT_FILE=bank_path, OUTPUT_FILE=pdf_path, md_content=optimized_markdown)
+        progress("render", 1.0, "PDF ready.")
+
+    graph = StageGraph()
+    graph.add("extract", extract)
+    graph.add("format", format_bank, after=("extract",), formatter=formatter)
+    graph.add("predict", predict, after=("extract",))
+    graph.add("render", render, after=("format",))
+    with metrics.timed("total"):
+        results = graph.run()
+    bank, _ = results["extract"]
+
+    return {
+        "successful": len(papers) - len(failed_files) + options.get("skipped", 0),
+        "uploaded": options.get("uploaded", len(papers)),
+        "failed_files": failed_files,
+        "question_count": len(bank),
+        "subject": options.get("subject"),
+        "bank_path": bank_path,
+        "predicted_path": predicted_path if os.path.exists(predicted_path) else None,
+        "pdf_path": pdf_path if os.path.exists(pdf_path) else None,
+        "prediction_error": prediction_errors[0] if prediction_errors else None,
+        "extraction_cache": get_extraction_cache().stats(),
+        "llm_cache": llm_cache_stats(),
+        "metrics": metrics.summarize(metrics_before),
+    }
@@ -0,0 +1,283 @@
+"""
+Columnar in-memory question bank.
+
+Questions are kept as columns rather than one dict per question: the texts
+in a single UTF-8 buffer with an offsets array, marks and year in integer
+arrays, and subject and unit as small integer codes into tables of
+interned strings. Rows are grouped by subject and unit, so selecting a
+subject or a unit returns a view sharing the same buffers. Dictionaries are
+only built at the edges (to_dicts, iteration) for code that expects them.
+"""
+
+import os
+import sys
+import json
+import struct
+from array import array
+
+from src.question_store import QUESTION_FIELDS, _as_int
+
+# Stored for a missing mark or year
+MISSING = -1
+
+FILE_MAGIC = b"QPATQB1\n"
+HEADER_FORMAT = "<I"
+
+
+def _int_or_missing(value):
+    """Integer column value, MISSING for null or non-numeric values."""
+    value = _as_int(value)
+    return MISSING if value is None else value
+
+
+def _string_or_none(value):
+    if value is None:
+        return None
+    return sys.intern(str(value))
+
+
+class QuestionBank:
+    """
+    Read-only, columnar collection of questions.
+
+    Behaves like a sequence of question dictionaries (len, indexing,
+    iteration), so it can be handed to code written for lists. Build one
+    with from_dicts or from_rows, or load a saved one with load.
+    """
+
+    def __init__(self, text, offsets, marks, years, subject_codes, unit_codes, subjects, units, ranges,
+                 start=0, stop=None):
+        self._text = text
+        self._offsets = offsets
+        self._marks = marks
+        self._years = years
+        self._subject_codes = subject_codes
+        self._unit_codes = unit_codes
+        self._subjects = subjects
+        self._units = units
+        # (subject code, unit code) -> (start, stop) of its contiguous rows
+        self._ranges = ranges
+        self._start = start
+        self._stop = len(marks) if stop is None else stop
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a bank from ``(question, marks, year, unit, subject)`` tuples.
+
+        Rows are grouped by subject, then unit, each in order of first
+        appearance; the order of questions within a unit is kept.
+        """
+        subjects, units = [], []
+        subject_index, unit_index = {}, {}
+        keyed = []
+        for position, (question, marks, year, unit, subject) in enumerate(rows):
+            subject, unit = _string_or_none(subject), _string_or_none(unit)
+            if subject not in subject_index:
+                subject_index[subject] = len(subjects)
+                subjects.append(subject)
+            if unit not in unit_index:
+                unit_index[unit] = len(units)
+                units.append(unit)
+            keyed.append((subject_index[subject], unit_index[unit], position, question, marks, year))
+        keyed.sort(key=lambda row: row[:3])
+
+        encoded = bytearray()
+        offsets = array("q", [0])
+        marks_column, years_column = array("i"), array("i")
+        subject_codes, unit_codes = array("i"), array("i")
+        ranges = {}
+        for row_number, (subject_code, unit_code, _, question, marks, year) in enumerate(keyed):
+            encoded += str(question or "").encode("utf-8")
+            offsets.append(len(encoded))
+            marks_column.append(_int_or_missing(marks))
+            years_column.append(_int_or_missing(year))
+            subject_codes.append(subject_code)
+            unit_codes.append(unit_code)
+            start, _ = ranges.get((subject_code, unit_code), (row_number, None))
+            ranges[(subject_code, unit_code)] = (start, row_number + 1)
+        return cls(bytes(encoded), offsets, marks_column, years_column, subject_codes, unit_codes,
+                   tuple(subjects), tuple(units), ranges)
+
+    @classmethod
+    def from_dicts(cls, questions):
+        """Build a bank from question dictionaries (missing fields become null)."""
+        return cls.from_rows(
+            tuple(question.get(field) for field in QUESTION_FIELDS)
+            for question in questions if isinstance(question, dict)
+        )
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __bool__(self):
+        return self._stop > self._start
+
+    def __repr__(self):
+        return f"<QuestionBank {len(self)} questions, {len(self.subjects())} subjects>"
+
+    def _row(self, index):
+        subject_code = self._subject_codes[index]
+        unit_code = self._unit_codes[index]
+        marks = self._marks[index]
+        year = self._years[index]
+        return {
+            "question": self.text(index - self._start),
+            "marks": None if marks == MISSING else marks,
+            "year": None if year == MISSING else year,
+            "unit": self._units[unit_code],
+            "subject": self._subjects[subject_code],
+        }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("QuestionBank slices must be contiguous")
+            return self._view(self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("question index out of range")
+        return self._row(self._start + index)
+
+    def __iter__(self):
+        for index in range(self._start, self._stop):
+            yield self._row(index)
+
+    def _view(self, start, stop):
+        return QuestionBank(self._text, self._offsets, self._marks, self._years, self._subject_codes,
+                            self._unit_codes, self._subjects, self._units, self._ranges, start, stop)
+
+    def text(self, index):
+        """Text of the question at ``index`` (decoded on demand)."""
+        index += self._start
+        return self._text[self._offsets[index]:self._offsets[index + 1]].decode("utf-8")
+
+    @property
+    def marks(self):
+        """Marks column as a read-only memoryview (MISSING for null)."""
+        return memoryview(self._marks)[self._start:self._stop].toreadonly()
+
+    @property
+    def years(self):
+        """Year column as a read-only memoryview (MISSING for null)."""
+        return memoryview(self._years)[self._start:self._stop].toreadonly()
+
+    def _group_bounds(self, subject, unit=None, match_unit=False):
+        """Start and stop of the rows of a subject (or one of its units) within this view."""
+        bounds = [
+            (start, stop) for (subject_code, unit_code), (start, stop) in self._ranges.items()
+            if self._subjects[subject_code] == subject and (not match_unit or self._units[unit_code] == unit)
+        ]
+        if not bounds:
+            return self._start, self._start
+        # Groups of one subject are adjacent, so their union is a single range
+        start = max(self._start, min(start for start, _ in bounds))
+        stop = min(self._stop, max(stop for _, stop in bounds))
+        return start, max(start, stop)
+
+    def by_subject(self, subject):
+        """View of the questions of one subject, sharing this bank's buffers."""
+        return self._view(*self._group_bounds(subject))
+
+    def by_unit(self, subject, unit):
+        """View of the questions of one unit of a subject, sharing this bank's buffers."""
+        return self._view(*self._group_bounds(subject, unit, match_unit=True))
+
+    def subjects(self):
+        """Distinct subjects in this view, in bank order."""
+        codes = dict.fromkeys(self._subject_codes[self._start:self._stop])
+        return [self._subjects[code] for code in codes]
+
+    def units(self, subject):
+        """Distinct units of a subject in this view, in bank order."""
+        view = self.by_subject(subject)
+        codes = dict.fromkeys(view._unit_codes[view._start:view._stop])
+        return [self._units[code] for code in codes]
+
+    def to_dicts(self):
+        """Return the questions as a list of dictionaries."""
+        return list(self)
+
+    def compact(self):
+        """Copy this view into a bank of its own, releasing the parent's buffers."""
+        if self._start == 0 and self._stop == len(self._marks):
+            return self
+        return QuestionBank.from_rows(
+            tuple(question[field] for field in QUESTION_FIELDS) for question in self
+        )
+
+    def save(self, path):
+        """
+        Write the bank to a binary file.
+
+        The file holds a small JSON header (row count, subject and unit
+        tables) followed by the raw little-endian columns and the text buffer.
+        """
+        bank = self.compact()
+        header = json.dumps({
+            "count": len(bank),
+            "subjects": bank._subjects,
+            "units": bank._units,
+        }, ensure_ascii=False).encode("utf-8")
+        columns = [array(column.typecode, column) for column in (
+            bank._offsets, bank._marks, bank._years, bank._subject_codes, bank._unit_codes
+        )]
+        if sys.byteorder != "little":
+            for column in columns:
+                column.byteswap()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(FILE_MAGIC)
+            f.write(struct.pack(HEADER_FORMAT, len(header)))
+            f.write(header)
+            for column in columns:
+                f.write(column.tobytes())
+            f.write(bank._text)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a bank written by save.
+
+        Raises:
+            ValueError: If the file is not a saved question bank
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(FILE_MAGIC):
+            raise ValueError(f"{path} is not a saved question bank")
+        position = len(FILE_MAGIC)
+        (header_size,) = struct.unpack_from(HEADER_FORMAT, data, position)
+        position += struct.calcsize(HEADER_FORMAT)
+        header = json.loads(data[position:position + header_size])
+        position += header_size
+
+        count = header["count"]
+        columns = []
+        for typecode, length in (("q", count + 1), ("i", count), ("i", count), ("i", count), ("i", count)):
+            column = array(typecode)
+            size = column.itemsize * length
+            column.frombytes(data[position:position + size])
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns.append(column)
+            position += size
+        offsets, marks, years, subject_codes, unit_codes = columns
+        text = data[position:position + offsets[-1]]
+        if len(text) != offsets[-1]:
+            raise ValueError(f"{path} is truncated")
+
+        ranges = {}
+        for row_number, key in enumerate(zip(subject_codes, unit_codes)):
+            start, _ = ranges.get(key, (row_number, None))
+            ranges[key] = (start, row_number + 1)
+        subjects = tuple(_string_or_none(subject) for subject in header["subjects"])
+        units = tuple(_string_or_none(unit) for unit in header["units"])
+        return cls(text, offsets, marks, years, subject_codes, unit_codes, subjects, units, ranges)
@@ -0,0 +1,157 @@
+import numpy as np
+
+from src.json_to_markdown import (
+    DEFAULT_SIMILARITY_THRESHOLD, appearance_tags, cluster_questions, group_by_subject, unit_heading,
+)
+
+# Each year back from the most recent paper multiplies an appearance's weight by this
+DEFAULT_RECENCY_DECAY = 0.7
+
+# Relative weight of each normalized feature in the final score
+DEFAULT_WEIGHTS = {"frequency": 0.35, "recency": 0.35, "marks": 0.2, "unit": 0.1}
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _normalize(values):
+    peak = values.max() if values.size else 0
+    return values / peak if peak > 0 else np.zeros_like(values)
+
+
+def score_questions(questions, decay=DEFAULT_RECENCY_DECAY, weights=None, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+    """
+    Score every repeated-question cluster of the bank with vectorized NumPy.
+
+    For each cluster (a question and its near-duplicates within a subject):
+    - frequency: number of appearances
+    - recency: appearances weighted by ``decay ** (latest year - year)``
+    - marks: total marks across appearances
+    - unit: share of its subject's marks that its unit carries
+
+    Each feature is scaled to [0, 1] and the score is their weighted sum.
+
+    Args:
+        questions (list): List of question dictionaries
+        decay (float): Per-year decay of an appearance's recency weight
+        weights (dict): Feature weights, defaults to DEFAULT_WEIGHTS
+        threshold (float): Minimum Jaccard similarity for two questions to cluster
+
+    Returns:
+        tuple: (ranked list of cluster dictionaries, list of unit dictionaries)
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    if not questions:
+        return [], []
+
+    # Dense ids for clusters, subjects and (subject, unit) pairs
+    representatives = cluster_questions(questions, threshold)
+    cluster_ids = {}
+    cluster = np.fromiter(
+        (cluster_ids.setdefault(rep, len(cluster_ids)) for rep in representatives), dtype=np.int64, count=len(questions)
+    )
+    subject_of = np.empty(len(questions), dtype=np.int64)
+    subject_names = []
+    for subject_index, (name, indexes) in enumerate(group_by_subject(questions).values()):
+        subject_of[indexes] = subject_index
+        subject_names.append(name)
+    unit_ids = {}
+    unit_labels = []
+    unit = np.empty(len(questions), dtype=np.int64)
+    for index, question in enumerate(questions):
+        key, label = unit_heading(question.get("unit"))
+        unit_key = (subject_of[index], key)
+        if unit_key not in unit_ids:
+            unit_ids[unit_key] = len(unit_ids)
+            unit_labels.append((subject_names[subject_of[index]], label, unit_key))
+        unit[index] = unit_ids[unit_key]
+
+    years = np.array([_as_float(question.get("year")) for question in questions])
+    marks = np.nan_to_num(np.array([_as_float(question.get("marks")) for question in questions]))
+
+    # Appearances without a year count as one year older than the oldest paper
+    known = ~np.isnan(years)
+    latest = years[known].max() if known.any() else 0.0
+    oldest = years[known].min() if known.any() else 0.0
+    age = np.where(known, latest - years, latest - oldest + 1)
+    recency_weight = np.power(decay, age)
+
+    n_clusters = len(cluster_ids)
+    frequency = np.bincount(cluster, minlength=n_clusters).astype(float)
+    recency = np.bincount(cluster, weights=recency_weight, minlength=n_clusters)
+    total_marks = np.bincount(cluster, weights=marks, minlength=n_clusters)
+
+    # Per-unit aggregates and each unit's share of its subject's marks
+    n_units = len(unit_ids)
+    unit_questions = np.bincount(unit, minlength=n_units)
+    unit_marks = np.bincount(unit, weights=marks, minlength=n_units)
+    unit_subject = np.array([subject for subject, _ in unit_ids], dtype=np.int64)
+    subject_marks = np.bincount(unit_subject, weights=unit_marks, minlength=len(subject_names))
+    unit_share = np.divide(unit_marks, subject_marks[unit_subject], out=np.zeros(n_units), where=subject_marks[unit_subject] > 0)
+
+    # Every cluster belongs to the unit of its first question
+    first_index = np.array(list(cluster_ids), dtype=np.int64)
+    cluster_unit = unit[first_index]
+
+    score = (
+        weights["frequency"] * _normalize(frequency)
+        + weights["recency"] * _normalize(recency)
+        + weights["marks"] * _normalize(total_marks)
+        + weights["unit"] * _normalize(unit_share[cluster_unit])
+    )
+
+    appearances = [[] for _ in range(n_clusters)]
+    for index, cluster_index in enumerate(cluster):
+        appearances[cluster_index].append((questions[index].get("year"), questions[index].get("marks")))
+
+    ranked = []
+    for cluster_index in np.argsort(-score, kind="stable"):
+        question = questions[first_index[cluster_index]]
+        subject_name, unit_label, _ = unit_labels[cluster_unit[cluster_index]]
+        ranked.append({
+            "question": question.get("question"),
+            "subject": subject_name,
+            "unit": unit_label,
+            "frequency": int(frequency[cluster_index]),
+            "recency": round(float(recency[cluster_index]), 4),
+            "total_marks": float(total_marks[cluster_index]),
+            "score": round(float(score[cluster_index]), 4),
+            "appearances": appearance_tags(appearances[cluster_index]),
+        })
+
+    units = [
+        {
+            "subject": subject_name,
+            "unit": unit_label,
+            "questions": int(unit_questions[unit_index]),
+            "total_marks": float(unit_marks[unit_index]),
+            "share": round(float(unit_share[unit_index]), 4),
+            "_key": key,
+        }
+        for unit_index, (subject_name, unit_label, key) in enumerate(unit_labels)
+    ]
+    units.sort(key=lambda item: (item["_key"][0], item["_key"][1]))
+    for item in units:
+        del item["_key"]
+
+    return ranked, units
+
+
+def rank_questions(questions, top_n=None, **kwargs):
+    """
+    Return the highest-scoring question clusters.
+
+    Args:
+        questions (list): List of question dictionaries
+        top_n (int): Number of clusters to return (all if None)
+        **kwargs: Passed to score_questions
+
+    Returns:
+        list: Cluster dictionaries, best first
+    """
+    ranked, _ = score_questions(questions, **kwargs)
+    return ranked if top_n is None else ranked[:top_n]
@@ -0,0 +1,202 @@
+import os
+import time
+import sqlite3
+from contextlib import closing
+
+from src.disk_cache import hash_key
+
+DEFAULT_STORE_PATH = os.getenv("QPAT_STORE_PATH", os.path.join("data", "question_bank.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    id INTEGER PRIMARY KEY,
+    paper_key TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    ingested_at REAL NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    paper_id INTEGER NOT NULL REFERENCES papers(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    question TEXT,
+    marks INTEGER,
+    year INTEGER,
+    unit TEXT,
+    subject TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_questions_subject_unit ON questions(subject, unit);
+CREATE INDEX IF NOT EXISTS idx_questions_year ON questions(year);
+CREATE INDEX IF NOT EXISTS idx_questions_paper ON questions(paper_id);
+"""
+
+QUESTION_FIELDS = ("question", "marks", "year", "unit", "subject")
+
+# Largest mark or year kept; larger and negative values count as missing,
+# so every stored value fits the 32-bit columns of a QuestionBank
+MAX_INT_VALUE = 2 ** 31 - 1
+
+
+def paper_key_for_bytes(pdf_bytes):
+    """Identify a paper by the SHA-256 of its PDF bytes."""
+    return hash_key(pdf_bytes)
+
+
+def _as_int(value):
+    """Store marks and year as integers when the model returned numeric text; None if missing or out of range."""
+    if value is None:
+        return None
+    if not isinstance(value, int):
+        try:
+            value = int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            # OverflowError: "Infinity" and the like
+            return None
+    return value if 0 <= value <= MAX_INT_VALUE else None
+
+
+class QuestionStore:
+    """
+    Persistent question bank stored in SQLite, keyed by paper.
+
+    Papers are identified by the hash of their PDF bytes, so uploading a
+    paper that is already in the bank is detected and skipped. Questions are
+    indexed by subject, unit and year.
+    """
+
+    def __init__(self, db_path=DEFAULT_STORE_PATH):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+            # Banks created before partial papers were tracked
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(papers)")}
+            if "complete" not in columns:
+                conn.execute("ALTER TABLE papers ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def has_paper(self, paper_key):
+        """Return True if the paper has already been ingested completely; a partial paper should be extracted again."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT 1 FROM papers WHERE paper_key = ? AND complete = 1", (paper_key,)).fetchone()
+        return row is not None
+
+    def add_paper(self, paper_key, filename, questions, complete=True):
+        """
+        Append a paper and its questions to the bank.
+
+        A paper stored from a partial extraction is replaced by the next one.
+
+        Args:
+            paper_key (str): Content hash of the PDF
+            filename (str): Original file name, for display
+            questions (list): Question dictionaries extracted from the paper
+            complete (bool): False if some pages of the paper could not be extracted
+
+        Returns:
+            bool: True if the paper was added, False if it was already present
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM papers WHERE paper_key = ? AND complete = 0", (paper_key,))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO papers (paper_key, filename, ingested_at, complete) VALUES (?, ?, ?, ?)",
+                (paper_key, filename, time.time(), int(complete)),
+            )
+            if cursor.rowcount == 0:
+                return False
+            paper_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO questions (paper_id, position, question, marks, year, unit, subject)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        paper_id,
+                        position,
+                        question.get("question"),
+                        _as_int(question.get("marks")),
+                        _as_int(question.get("year")),
+                        question.get("unit"),
+                        question.get("subject"),
+                    )
+                    for position, question in enumerate(questions)
+                ],
+            )
+        print(f"🗄️ Stored {len(questions)} questions from {filename}" + ("" if complete else " (partial)"))
+        return True
+
+    def remove_paper(self, paper_key):
+        """Remove a paper and its questions from the bank."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM papers WHERE paper_key = ?", (paper_key,))
+
+    def clear(self):
+        """Remove every paper and question from the bank."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM papers")
+
+    @staticmethod
+    def _select(subject, unit, year):
+        """Build the SELECT shared by query and query_bank."""
+        clauses, params = [], []
+        for column, value in (("subject", subject), ("unit", unit), ("year", year)):
+            if value is not None:
+                clauses.append(f"q.{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            "SELECT q.question, q.marks, q.year, q.unit, q.subject FROM questions q"
+            f" {where} ORDER BY q.paper_id, q.position"
+        )
+        return sql, params
+
+    def query(self, subject=None, unit=None, year=None):
+        """
+        Return stored questions, optionally filtered, in ingestion order.
+
+        Args:
+            subject (str): Only questions of this subject
+            unit (str): Only questions of this unit
+            year (int): Only questions from this year
+
+        Returns:
+            list: Question dictionaries
+        """
+        sql, params = self._select(subject, unit, year)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+
+    def query_bank(self, subject=None, unit=None, year=None):
+        """
+        Return stored questions as a columnar QuestionBank.
+
+        Takes the same filters as query, but the rows go straight into the
+        bank's columns without building a dictionary per question.
+        """
+        # Imported here: question_bank itself depends on this module
+        from src.question_bank import QuestionBank
+
+        sql, params = self._select(subject, unit, year)
+        with closing(self._connect()) as conn:
+            return QuestionBank.from_rows(conn.execute(sql, params))
+
+    def subjects(self):
+        """Return the distinct subjects in the bank, sorted."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT subject FROM questions WHERE subject IS NOT NULL ORDER BY subject"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def papers(self):
+        """Return (paper_key, filename, question count) for every stored paper."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT p.paper_key, p.filename, COUNT(q.id) FROM papers p"
+                " LEFT JOIN questions q ON q.paper_id = p.id GROUP BY p.id ORDER BY p.id"
+            ).fetchall()
@@ -0,0 +1,246 @@
+"""
+Quota-aware scheduling of model calls.
+
+Every request to the model backend passes through one RequestScheduler,
+which:
+
+- waits for room in two token buckets, requests per minute and tokens per
+  minute, so a batch stays inside the API project's quota;
+- retries throttled (429) and server (5xx) answers with exponential
+  backoff and full jitter; a throttled answer also pauses every caller,
+  for at least the server's Retry-After delay and longer while the
+  throttling lasts;
+- limits the requests in flight, halving the limit when the backend
+  throttles or fails and raising it by one after a run of successes.
+"""
+
+import os
+import time
+import random
+import threading
+import http.client
+
+from src import metrics
+
+# Quota of the API project (0 disables the bucket)
+LLM_RPM = float(os.getenv("QPAT_LLM_RPM", 0))
+LLM_TPM = float(os.getenv("QPAT_LLM_TPM", 0))
+# Upper bound of the adaptive number of requests in flight
+LLM_MAX_CONCURRENCY = int(os.getenv("QPAT_LLM_MAX_CONCURRENCY", 16))
+# Retries of a throttled or failed request; the wait before retry n is
+# uniform in [0, min(cap, base * 2 ** n)] seconds
+LLM_MAX_RETRIES = int(os.getenv("QPAT_LLM_MAX_RETRIES", 8))
+LLM_BACKOFF_BASE = float(os.getenv("QPAT_LLM_BACKOFF_BASE", 1.0))
+LLM_BACKOFF_CAP = float(os.getenv("QPAT_LLM_BACKOFF_CAP", 60.0))
+
+THROTTLED = 429
+RETRY_STATUSES = frozenset({408, THROTTLED, 500, 502, 503, 504})
+
+
+def estimate_tokens(text):
+    """Rough token count of a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def error_status(error):
+    """
+    Return the HTTP status carried by a failed model call, if any.
+
+    LLMHTTPError has ``status``; the google.api_core exceptions raised by
+    the Gemini SDK have ``code``.
+    """
+    for attribute in ("status", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(error):
+    """True for throttling, server errors and dropped connections."""
+    status = error_status(error)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError, http.client.HTTPException))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``limit`` tokens per ``period`` seconds, holding at most one period's worth.
+
+    Callers reserve tokens up front and sleep for the returned delay, so the
+    level may go negative; waiting callers are then served in reservation
+    order. A request larger than the bucket simply waits longer.
+    """
+
+    def __init__(self, limit, period=60.0, clock=time.monotonic):
+        self.capacity = float(limit)
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """
+        Take ``amount`` tokens.
+
+        Returns:
+            float: Seconds to wait before the tokens may be used
+        """
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def charge(self, amount):
+        """Take ``amount`` more tokens for a request already sent (negative to give some back)."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class RequestScheduler:
+    """
+    Admit model requests within the quota and adapt concurrency to failures.
+
+    Use ``call`` for a request returning its whole result, or
+    ``acquire``/``release`` around a streamed one.
+    """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_cap=LLM_BACKOFF_CAP):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        # Consecutive bursts of throttled answers, and when every caller may resume
+        self._throttled_bursts = 0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _wait_for_pause(self):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause <= 0:
+                return
+            time.sleep(pause)
+
+    def acquire(self, tokens=0):
+        """
+        Wait until a request costing ``tokens`` may be sent and take a slot for it.
+
+        Returns:
+            float: Start time to pass to release
+        """
+        waited = time.monotonic()
+        self._wait_for_pause()
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.reserve(1)
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        if delay > 0:
+            time.sleep(delay)
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        started = time.monotonic()
+        if started - waited > 0.001:
+            metrics.observe("qpat_llm_queue_seconds", started - waited)
+        return started
+
+    def release(self, started, error=None, output_tokens=0):
+        """
+        Free the slot taken by acquire and adapt the concurrency limit.
+
+        Args:
+            started (float): Value returned by acquire
+            error (Exception): Error the request failed with, if any
+            output_tokens (int): Tokens generated, charged to the token bucket
+        """
+        if self.tokens is not None and output_tokens:
+            self.tokens.charge(output_tokens)
+        with self._cond:
+            self.in_flight -= 1
+            if error is not None and is_retryable(error):
+                # Requests sent before the last decrease saw the old limit; one decrease covers them all
+                if started >= self._last_decrease:
+                    now = time.monotonic()
+                    self.limit = max(1, self.limit // 2)
+                    self._last_decrease = now
+                    if error_status(error) == THROTTLED:
+                        self._throttled_bursts += 1
+                        pause = random.uniform(0.5, 1.0) * min(
+                            self.backoff_cap, self.backoff_base * 2 ** (self._throttled_bursts - 1)
+                        )
+                        # The server's Retry-After is a lower bound; throttling that persists still backs off further
+                        pause = max(pause, getattr(error, "retry_after", None) or 0)
+                        self._paused_until = max(self._paused_until, now + pause)
+                    metrics.record_event("llm_concurrency", limit=self.limit, error=str(error))
+                self._successes = 0
+            elif error is None:
+                self._throttled_bursts = 0
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def should_retry(self, error, attempt):
+        """True if a request that failed with ``error`` on ``attempt`` (from 0) is worth sending again."""
+        return attempt < self.max_retries and is_retryable(error)
+
+    def backoff(self, error, attempt, model_name=None):
+        """Sleep before retrying: a jittered exponential delay, or longer while every caller is paused."""
+        if error_status(error) == THROTTLED:
+            metrics.inc("qpat_llm_throttled_total", model=model_name)
+        metrics.inc("qpat_retries_total", stage="llm")
+
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        delay = max(delay, self._paused_until - time.monotonic())
+        print(f"⏳ Model call failed ({error}); retrying in {delay:.1f}s "
+              f"(attempt {attempt + 1}/{self.max_retries}, {self.limit} in flight allowed)")
+        time.sleep(delay)
+
+    def call(self, request, tokens=0, model_name=None):
+        """
+        Run ``request()`` within the quota, retrying throttling and server errors.
+
+        Args:
+            request (callable): Sends the request and returns its response text
+            tokens (int): Estimated prompt tokens
+            model_name (str): Model, for the metrics
+
+        Returns:
+            The value returned by ``request``
+
+        Raises:
+            Exception: The last error, once it is not retryable or retries run out
+        """
+        attempt = 0
+        while True:
+            started = self.acquire(tokens)
+            try:
+                result = request()
+            except Exception as e:
+                self.release(started, e)
+                if not self.should_retry(e, attempt):
+                    raise
+                self.backoff(e, attempt, model_name)
+                attempt += 1
+                continue
+            self.release(started, output_tokens=estimate_tokens(result) if isinstance(result, str) else 0)
+            return result
@@ -0,0 +1,373 @@
+"""
+Layout-aware, rule-based question extraction
+
+Reads the text spans of a paper with their positions and segments them into
+questions without a model call: spans are grouped into rows, rows are
+classified (question number, sub-part, unit heading, marks column, table,
+continuation) and every question gets the same fields Gemini returns plus a
+``confidence`` between 0 and 1. Pages where the rules are unsure are meant
+to be sent to the model instead (see extract_questions_from_pdf).
+"""
+
+import re
+import statistics
+
+# Spans starting right of this fraction of the page width can be marks
+MARKS_MIN_X = 0.75
+# Spans smaller than this fraction of the body text size are annotations (BL/CO/PO values)
+SMALL_FONT = 0.85
+# Confidence given to a page holding text the rules could not place
+ORPHAN_CONFIDENCE = 0.4
+
+NUMBER_SPAN_PATTERN = re.compile(r'^(?:Q\.?\s*)?\d{1,2}[.)]?$', re.IGNORECASE)
+NUMBERED_TEXT_PATTERN = re.compile(r'^(?:Q\.?\s*)?(\d{1,2})[.)]\s+(.*)$', re.IGNORECASE)
+SUB_PART_PATTERN = re.compile(r'^\(?([a-h])[).]\s*(.*)$')
+UNIT_PATTERN = re.compile(r'^(unit|module|part|section)\s*[-–—:.]?\s*([ivx]+|\d+|[a-e])\s*\.?$', re.IGNORECASE)
+OR_PATTERN = re.compile(r'^\(?OR\)?$')
+LABEL_PATTERN = re.compile(r'^(BL|CO|PO|PSO|RBT|M|Marks)\s*:?$', re.IGNORECASE)
+MARKS_LABEL_PATTERN = re.compile(r'^(M|Marks)$', re.IGNORECASE)
+INLINE_MARKS_PATTERN = re.compile(r'\s*[(\[]\s*(\d{1,3})\s*(?:marks?|m)?\s*[)\]]\s*$', re.IGNORECASE)
+PAGE_FURNITURE_PATTERN = re.compile(
+    r'^([_=*.–—-]{3,}|-\s*\d+\s*-|page\s+\d+(\s+of\s+\d+)?|please\s+turn\s+over|p\.?\s*t\.?\s*o\.?|contd\.*…?|continued\.*)$',
+    re.IGNORECASE,
+)
+YEAR_PATTERN = re.compile(r'\b(19[5-9]\d|20\d{2})\b')
+TIME_PATTERN = re.compile(r'^(time|duration)\b', re.IGNORECASE)
+
+
+def _page_spans(page):
+    """Non-empty text spans of a page with their geometry."""
+    spans = []
+    for block in page.get_text("dict")["blocks"]:
+        if block["type"] != 0:  # Not a text block
+            continue
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                text = " ".join(span["text"].split())
+                if text:
+                    x0, y0, x1, y1 = span["bbox"]
+                    spans.append({"x0": x0, "x1": x1, "y": (y0 + y1) / 2, "size": span["size"], "text": text})
+    return spans
+
+
+def _group_rows(spans):
+    """Group spans whose vertical centres are within half a line (of the larger font) of each other."""
+    rows = []
+    for span in sorted(spans, key=lambda s: s["y"]):
+        row = rows[-1] if rows else None
+        if row and abs(span["y"] - row["y"]) <= 0.5 * max(span["size"], row["size"]):
+            row["spans"].append(span)
+        else:
+            rows.append({"y": span["y"], "size": span["size"], "spans": [span]})
+    for row in rows:
+        row["spans"].sort(key=lambda s: s["x0"])
+    return rows
+
+
+def _furniture_key(text):
+    return re.sub(r'[^a-z]+', '', text.lower())
+
+
+def _repeated_margin_text(pages):
+    """Texts found in the top or bottom margin of more than one page (running headers and footers)."""
+    seen = {}
+    for page_index, (height, spans) in enumerate(pages):
+        for span in spans:
+            if span["y"] < 0.1 * height or span["y"] > 0.9 * height:
+                key = _furniture_key(span["text"])
+                if key:
+                    seen.setdefault(key, set()).add(page_index)
+    return {key for key, found_on in seen.items() if len(found_on) > 1}
+
+
+def _is_number(text):
+    return text.isdigit()
+
+
+def _render_table(rows, body_size):
+    """
+    Render table rows as a markdown table.
+
+    Cells are placed in the column whose anchor (taken from the widest row)
+    is nearest to their centre.
+
+    Returns:
+        tuple: (markdown text, True if every cell found its own column)
+    """
+    widest = max(rows, key=len)
+    anchors = [(cell["x0"] + cell["x1"]) / 2 for cell in widest]
+    clean = True
+    table = []
+    for row in rows:
+        cells = [""] * len(anchors)
+        for cell in row:
+            centre = (cell["x0"] + cell["x1"]) / 2
+            column = min(range(len(anchors)), key=lambda i: abs(anchors[i] - centre))
+            if cells[column]:
+                clean = False
+                cells[column] += " " + cell["text"]
+            else:
+                cells[column] = cell["text"]
+        table.append(cells)
+    lines = ["| " + " | ".join(table[0]) + " |", "| " + " | ".join("---" for _ in anchors) + " |"]
+    lines.extend("| " + " | ".join(cells) + " |" for cells in table[1:])
+    return "\n".join(lines), clean
+
+
+def _new_question(unit, page_index, sub_part=None):
+    return {"parts": [], "marks": None, "unit": unit, "pages": {page_index}, "sub_part": sub_part, "penalty": 0.0}
+
+
+def _finish_question(draft, subject, year, body_size):
+    """Turn a draft into a question dictionary with its confidence."""
+    penalty = draft["penalty"]
+    blocks = []
+    text_lines = []
+    for kind, value in draft["parts"]:
+        if kind == "text":
+            text_lines.append(value)
+            continue
+        if text_lines:
+            blocks.append(" ".join(text_lines))
+            text_lines = []
+        table, clean = _render_table(value, body_size)
+        blocks.append(table)
+        penalty += 0.1 if clean else 0.3
+    if text_lines:
+        blocks.append(" ".join(text_lines))
+
+    text = "\n\n".join(blocks).strip()
+    marks = draft["marks"]
+    inline = INLINE_MARKS_PATTERN.search(text)
+    if inline:
+        text = text[:inline.start()].rstrip()
+        if marks is None:
+            marks = int(inline.group(1))
+
+    if marks is None:
+        penalty += 0.3
+    elif not 0 < marks <= 100:
+        penalty += 0.3
+    if len(re.findall(r'[A-Za-z]', text)) < 15:
+        penalty += 0.4
+    if draft["unit"] is None:
+        penalty += 0.1
+    if subject is None:
+        penalty += 0.2
+    if year is None:
+        penalty += 0.1
+
+    return {
+        "question": text,
+        "marks": marks,
+        "year": year,
+        "unit": draft["unit"],
+        "subject": subject,
+        "confidence": round(max(0.0, 1.0 - penalty), 2),
+    }
+
+
+def _normalize_unit(match):
+    return f"{match.group(1).capitalize()} - {match.group(2).upper()}"
+
+
+def _split_row(cells, marks_column, page_width, body_size):
+    """
+    Separate a row's annotations and marks from its text.
+
+    Returns:
+        tuple: (text spans, marks spans, marks column (x0, x1) once its header was seen)
+    """
+    # "M" alone may be table data; the column headers come together as "M BL CO ..."
+    labels = [span for span in cells if LABEL_PATTERN.match(span["text"])]
+    names = [span["text"].rstrip(":").upper() for span in labels]
+    if len(set(names)) < 2 or all(MARKS_LABEL_PATTERN.match(name) for name in names):
+        labels = []
+    for span in labels:
+        if MARKS_LABEL_PATTERN.match(span["text"]):
+            marks_column = (span["x0"] - 5, span["x1"] + 10)
+    # BL/CO/PO/PSO values are printed small, right of the question text
+    cells = [
+        span for span in cells
+        if span not in labels
+        and not (_is_number(span["text"]) and span["size"] < SMALL_FONT * body_size
+                 and span["x0"] > 0.45 * page_width)
+    ]
+
+    marks = []
+    for span in cells:
+        if not _is_number(span["text"]):
+            continue
+        if marks_column is not None:
+            in_column = span["x0"] < marks_column[1] and span["x1"] > marks_column[0]
+        else:
+            in_column = span["x0"] >= MARKS_MIN_X * page_width
+        if in_column:
+            marks.append(span)
+    return [span for span in cells if span not in marks], marks, marks_column
+
+
+def _question_start(cells, page_width):
+    """
+    Recognise a question number at the left margin.
+
+    Handles numbers split over several spans ("0", "1") and numbers printed
+    in front of the text ("1. Define ...").
+
+    Returns:
+        tuple: (question number or None, remaining spans)
+    """
+    if cells[0]["x0"] >= 0.12 * page_width:
+        return None, cells
+    digits = []
+    for span in cells:
+        if not NUMBER_SPAN_PATTERN.match(span["text"]):
+            break
+        digits.append(span)
+    if digits:
+        return "".join(re.sub(r'\D', '', span["text"]) for span in digits), cells[len(digits):]
+    numbered = NUMBERED_TEXT_PATTERN.match(cells[0]["text"])
+    if numbered:
+        return numbered.group(1), [dict(cells[0], text=numbered.group(2))] + cells[1:]
+    return None, cells
+
+
+def extract_layout_questions(doc):
+    """
+    Segment the questions of an open PDF using layout cues alone.
+
+    Args:
+        doc (fitz.Document): Open PyMuPDF document
+
+    Returns:
+        dict: ``questions`` (question dictionaries with a ``confidence``),
+            ``question_pages`` (set of page indexes each question touches),
+            ``page_confidence`` (one score per page, the lowest of the
+            questions on it), ``page_units`` (unit in force at the top of
+            each page), ``subject`` and ``year``
+    """
+    pages = [(page.rect.height, _page_spans(page)) for page in doc]
+    page_width = doc[0].rect.width if doc.page_count else 0
+
+    sizes = [span["size"] for _, spans in pages for span in spans for _ in span["text"]]
+    body_size = statistics.median(sizes) if sizes else 0
+    repeated = _repeated_margin_text(pages)
+
+    header = []
+    header_done = False
+    drafts = []
+    draft = None
+    unit = None
+    marks_column = None
+    page_units = []
+    orphan_pages = set()
+
+    for page_index, (height, spans) in enumerate(pages):
+        page_units.append(unit)
+        spans = [
+            span for span in spans
+            if not PAGE_FURNITURE_PATTERN.match(span["text"])
+            and not ((span["y"] < 0.1 * height or span["y"] > 0.9 * height)
+                     and _furniture_key(span["text"]) in repeated)
+        ]
+        for row in _group_rows(spans):
+            cells, marks, marks_column = _split_row(row["spans"], marks_column, page_width, body_size)
+            text = " ".join(span["text"] for span in cells)
+
+            if not cells:
+                pass
+            elif OR_PATTERN.match(text):
+                draft = None
+            elif UNIT_PATTERN.match(text):
+                unit = _normalize_unit(UNIT_PATTERN.match(text))
+                header_done = True
+                draft = None
+            else:
+                number, rest = _question_start(cells, page_width)
+                rest_text = " ".join(span["text"] for span in rest)
+                sub_match = SUB_PART_PATTERN.match(rest_text) if header_done or number is not None else None
+
+                if number is not None or sub_match:
+                    header_done = True
+                    sub_part = sub_match.group(1) if sub_match else None
+                    if draft is not None and not draft["parts"]:
+                        # The number stood on its own row; this row carries the text
+                        draft["sub_part"] = sub_part
+                    else:
+                        previous = draft["sub_part"] if draft is not None else None
+                        draft = _new_question(unit, page_index, sub_part)
+                        if number is None and sub_part != (chr(ord(previous) + 1) if previous else "a"):
+                            draft["penalty"] += 0.2
+                        drafts.append(draft)
+                    body = sub_match.group(2) if sub_match else rest_text
+                    if body:
+                        draft["parts"].append(("text", body))
+                elif not header_done:
+                    if page_index == 0:
+                        header.append(text)
+                    else:
+                        orphan_pages.add(page_index)
+                elif draft is None:
+                    orphan_pages.add(page_index)
+                else:
+                    draft["pages"].add(page_index)
+                    gaps = [b["x0"] - a["x1"] for a, b in zip(cells, cells[1:])]
+                    table = draft["parts"][-1][1] if draft["parts"] and draft["parts"][-1][0] == "table" else None
+                    # Rows of an open table only need to lie within its columns
+                    in_table = table is not None and (
+                        min(cell["x0"] for cell in table[0]) - body_size <= cells[0]["x0"]
+                        and cells[-1]["x1"] <= max(cell["x1"] for cell in table[0]) + 2 * body_size
+                    )
+                    if len(cells) > 1 and (in_table or all(gap > body_size for gap in gaps)):
+                        if table is not None:
+                            table.append(cells)
+                        else:
+                            draft["parts"].append(("table", [cells]))
+                    else:
+                        draft["parts"].append(("text", text))
+
+            if marks and draft is not None:
+                if draft["marks"] is None:
+                    draft["marks"] = int(marks[0]["text"])
+                else:
+                    draft["penalty"] += 0.3
+                draft["pages"].add(page_index)
+
+    # Paper details come from the header: the year of the exam session and
+    # the subject line printed just above "Time: ... Max. Marks: ..."
+    year = None
+    for line in header:
+        found = YEAR_PATTERN.search(line)
+        if found:
+            year = int(found.group(1))
+            break
+    subject = None
+    for index, line in enumerate(header):
+        if TIME_PATTERN.match(line) and index > 0:
+            subject = header[index - 1].strip() or None
+            break
+    metadata_subject = (doc.metadata or {}).get("subject")
+    if subject is None and metadata_subject:
+        subject = metadata_subject.strip() or None
+
+    questions = [_finish_question(draft, subject, year, body_size) for draft in drafts]
+    question_pages = [draft["pages"] for draft in drafts]
+
+    page_confidence = [1.0] * len(pages)
+    if not questions:
+        # Nothing recognisable: the layout is not one the rules understand
+        page_confidence = [0.0] * len(pages)
+    for page_index in orphan_pages:
+        page_confidence[page_index] = min(page_confidence[page_index], ORPHAN_CONFIDENCE)
+    for question, touched in zip(questions, question_pages):
+        for page_index in touched:
+            page_confidence[page_index] = min(page_confidence[page_index], question["confidence"])
+
+    return {
+        "questions": questions,
+        "question_pages": question_pages,
+        "page_confidence": page_confidence,
+        "page_units": page_units,
+        "subject": subject,
+        "year": year,
+    }
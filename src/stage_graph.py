@@ -0,0 +1,94 @@
+"""
+Concurrent execution of dependent pipeline stages.
+
+A StageGraph holds named stages and the stages each one needs. ``run``
+starts every stage as soon as the stages it depends on have finished,
+passing their results in memory, so independent stages overlap and the
+total time approaches the longest chain of dependent stages instead of
+the sum of all of them.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src import metrics
+
+
+class StageGraph:
+    """
+    Named stages with dependencies, run on a thread pool.
+
+    Add the stages in an order where every stage follows the stages it
+    needs, then ``run`` the graph once.
+    """
+
+    def __init__(self):
+        # name -> (func, dependencies, metric labels), in the order added
+        self._stages = {}
+
+    def add(self, name, func, after=(), **labels):
+        """
+        Add a stage.
+
+        Args:
+            name (str): Stage name, also used for the ``qpat_stage_seconds`` metric
+            func (callable): Called with the results of the ``after`` stages, in order
+            after (tuple): Names of stages that must finish first; they must already be added
+            **labels: Extra labels for the stage metrics
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage {name!r} is already in the graph")
+        missing = [dependency for dependency in after if dependency not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name!r} depends on unknown stage(s): {', '.join(missing)}")
+        self._stages[name] = (func, tuple(after), labels)
+
+    def _run_stage(self, name, inputs):
+        func, _, labels = self._stages[name]
+        with metrics.timed(name, **labels):
+            return func(*inputs)
+
+    def run(self, max_workers=None):
+        """
+        Run every stage once its dependencies are done.
+
+        A failed stage skips the stages depending on it; the others still run
+        to completion before its error is raised.
+
+        Args:
+            max_workers (int): Stages run at once (all ready stages if None)
+
+        Returns:
+            dict: Result of every stage, by name
+
+        Raises:
+            Exception: The error of the first failed stage, in the order stages were added
+        """
+        results = {}
+        errors = {}
+        waiting = dict(self._stages)
+        with ThreadPoolExecutor(max_workers=max_workers or max(1, len(self._stages))) as executor:
+            running = {}
+            while waiting or running:
+                for name, (_, after, _) in list(waiting.items()):
+                    if any(dependency in errors for dependency in after):
+                        # Stages are added after their dependencies, so one pass covers whole chains
+                        errors[name] = next(errors[dependency] for dependency in after if dependency in errors)
+                        del waiting[name]
+                    elif all(dependency in results for dependency in after):
+                        inputs = [results[dependency] for dependency in after]
+                        running[executor.submit(self._run_stage, name, inputs)] = name
+                        del waiting[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        errors[name] = e
+
+        for name in self._stages:
+            if name in errors:
+                raise errors[name]
+        return results
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Background worker for queued processing jobs
+
+Claims jobs from the SQLite queue in src/job_queue.py and runs the pipeline
+for each, reporting stage progress and partial output back to the queue so
+the Streamlit app can poll it. The app starts workers itself; run more by
+hand to process several batches at once:
+
+    python -m src.worker
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from dotenv import load_dotenv
+
+from src import metrics
+from src.job_queue import JobQueue, STALE_AFTER
+from src.llm import configure_gemini, get_backend
+from src.pipeline import run_pipeline
+from src.workspace import Workspace, cleanup_workspaces
+
+# Seconds between checks of an empty queue
+POLL_INTERVAL = float(os.getenv("QPAT_WORKER_POLL_INTERVAL", 1.0))
+# Minimum seconds between two stored snapshots of streamed partial output
+PARTIAL_INTERVAL = float(os.getenv("QPAT_WORKER_PARTIAL_INTERVAL", 0.5))
+# Seconds between two sweeps for abandoned workspaces
+WORKSPACE_GC_INTERVAL = float(os.getenv("QPAT_WORKSPACE_GC_INTERVAL", 600))
+
+
+def _heartbeat(queue, job_id, stop):
+    """Keep a job's timestamp fresh while a long stage reports nothing."""
+    while not stop.wait(STALE_AFTER / 4):
+        queue.heartbeat(job_id)
+
+
+def run_job(queue, job):
+    """
+    Run one claimed job to completion and record its outcome.
+
+    Args:
+        queue (JobQueue): Queue the job was claimed from
+        job (dict): The claimed job
+
+    Returns:
+        bool: True if the job finished successfully
+    """
+    job_id = job["id"]
+    options = job["options"]
+    # Time each kind of partial output was last stored; format and predict stream at once
+    last_partial = {}
+
+    def progress(stage, fraction, message, **partial):
+        # Streamed partial text arrives chunk by chunk; store it at a bounded rate
+        now = time.monotonic()
+        kind = tuple(sorted(partial))
+        if partial and fraction < 1.0 and now - last_partial.get(kind, 0.0) < PARTIAL_INTERVAL:
+            return
+        last_partial[kind] = now
+        queue.update_progress(job_id, stage, fraction, message, **partial)
+
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(queue, job_id, stop), daemon=True).start()
+    try:
+        # Each job runs with the API key of the session that submitted it;
+        # a key in the operator's .env is the fallback
+        load_dotenv()
+        api_key = job.get("api_key") or os.getenv("GOOGLE_API_KEY")
+        # Always (re)configure: a worker runs jobs of many sessions, and one
+        # without a key must never use the key of the job before it
+        configure_gemini(api_key)
+        if not api_key and get_backend().name == "gemini":
+            raise ValueError("API key not configured.")
+        result = run_pipeline(queue.uploads(job_id), Workspace(job["workspace"]), options=options, progress=progress)
+        queue.complete(job_id, result)
+        print(f"✅ Job {job_id} complete.")
+        metrics.record_event("job", job=job_id, status="done", summary=result["metrics"])
+        return True
+    except Exception as e:
+        queue.fail(job_id, str(e))
+        print(f"❌ Job {job_id} failed: {e}")
+        metrics.record_event("job", job=job_id, status="failed", error=str(e))
+        return False
+    finally:
+        stop.set()
+        metrics.write_prometheus()
+
+
+def collect_workspaces(queue):
+    """Remove abandoned workspaces, keeping those with pending jobs."""
+    for root in cleanup_workspaces(keep=queue.active_workspaces()):
+        queue.forget_workspace(root)
+
+
+def work(queue=None, parent_pid=None, once=False):
+    """
+    Process queued jobs until interrupted.
+
+    Args:
+        queue (JobQueue): Queue to read from (default queue file if None)
+        parent_pid (int): Exit once this process is gone (used by the app)
+        once (bool): Return when the queue is empty instead of waiting
+    """
+    queue = queue or JobQueue()
+    print(f"👷 Worker {os.getpid()} waiting for jobs in {queue.db_path}")
+    if os.getenv("QPAT_METRICS_PORT"):
+        # Only one worker can bind the port; the others are still exported through their .prom files
+        try:
+            metrics.serve_metrics(int(os.getenv("QPAT_METRICS_PORT")))
+        except OSError as e:
+            print(f"⚠️ Not serving metrics over HTTP from worker {os.getpid()}: {e}")
+    last_gc = 0.0
+    try:
+        while parent_pid is None or os.getppid() == parent_pid:
+            queue.requeue_stale()
+            if time.monotonic() - last_gc >= WORKSPACE_GC_INTERVAL:
+                collect_workspaces(queue)
+                metrics.remove_stale_prometheus()
+                last_gc = time.monotonic()
+            job = queue.claim_next(os.getpid())
+            if job is None:
+                if once:
+                    return
+                time.sleep(POLL_INTERVAL)
+                continue
+            print(f"🔍 Running job {job['id']}...")
+            run_job(queue, job)
+    finally:
+        # Workers killed outright leave their file behind; the next worker's remove_stale_prometheus gets it
+        metrics.remove_prometheus()
+
+
+def ensure_workers(processes, count):
+    """
+    Keep ``count`` worker processes running for this app process.
+
+    Dead workers in ``processes`` are replaced in place, so the list can be
+    kept across Streamlit reruns.
+
+    Args:
+        processes (list): subprocess.Popen handles of workers started earlier
+        count (int): Number of workers to keep alive
+    """
+    processes[:] = [process for process in processes if process.poll() is None]
+    while len(processes) < count:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "src.worker", "--parent", str(os.getpid())], cwd=os.getcwd()
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued QPAT processing jobs.")
+    parser.add_argument("--parent", type=int, help="Exit when this process id is no longer the parent")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args()
+    try:
+        work(parent_pid=args.parent, once=args.once)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import re
+import time
+import uuid
+import shutil
+
+WORKSPACES_DIR = os.getenv("QPAT_WORKSPACES_DIR", "workspaces")
+# Seconds without activity after which a workspace is garbage-collected (default: one day)
+WORKSPACE_TTL = float(os.getenv("QPAT_WORKSPACE_TTL", 24 * 3600))
+# Question banks of the workspaces; kept outside them so they outlive the cleanup
+BANKS_DIR = os.getenv("QPAT_BANKS_DIR", os.path.join("data", "banks"))
+
+SUBFOLDERS = ("pdf", "json_data", "md", "output")
+LAST_USED_MARKER = ".last_used"
+WORKSPACE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class Workspace:
+    """
+    Private folder tree for one app session.
+
+    Mirrors the pdf/, json_data/, md/ and output/ layout the pipeline has
+    always used, so concurrent sessions never read or overwrite each
+    other's inputs and outputs.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.pdf_dir = os.path.join(root, "pdf")
+        self.json_dir = os.path.join(root, "json_data")
+        self.md_dir = os.path.join(root, "md")
+        self.output_dir = os.path.join(root, "output")
+
+    @property
+    def bank_path(self):
+        return os.path.join(self.md_dir, "optimized_questions.md")
+
+    @property
+    def predicted_path(self):
+        return os.path.join(self.md_dir, "predicted_questions.md")
+
+    @property
+    def pdf_path(self):
+        return os.path.join(self.output_dir, "output.pdf")
+
+    @property
+    def workspace_id(self):
+        return os.path.basename(os.path.normpath(self.root))
+
+    @property
+    def store_path(self):
+        """
+        Question bank of this session; other sessions never see or clear its papers.
+
+        It lives in BANKS_DIR, not in the workspace folder, so it survives the
+        workspace being garbage-collected: coming back with the same id (kept
+        in the page URL) finds the bank again, however long later.
+        """
+        return os.path.join(BANKS_DIR, f"{self.workspace_id}.db")
+
+    def create(self):
+        """Create the folder tree and mark the workspace as in use."""
+        for folder in SUBFOLDERS:
+            os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+        self.touch()
+        return self
+
+    def touch(self):
+        """Record activity so the workspace is not garbage-collected."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LAST_USED_MARKER), "a"):
+            pass
+        os.utime(os.path.join(self.root, LAST_USED_MARKER))
+
+
+def new_workspace_id():
+    return uuid.uuid4().hex
+
+
+def workspace_for_session(workspace_id, base_dir=WORKSPACES_DIR):
+    """
+    Return the workspace of a session, creating it if needed.
+
+    Args:
+        workspace_id (str): Id kept by the session (see new_workspace_id)
+        base_dir (str): Folder holding all workspaces
+
+    Raises:
+        ValueError: If the id is not one produced by new_workspace_id
+    """
+    if not WORKSPACE_ID_PATTERN.match(workspace_id or ""):
+        raise ValueError(f"Invalid workspace id: {workspace_id!r}")
+    return Workspace(os.path.join(base_dir, workspace_id)).create()
+
+
+def cleanup_workspaces(ttl=WORKSPACE_TTL, keep=(), base_dir=WORKSPACES_DIR):
+    """
+    Delete workspaces that have not been used for ``ttl`` seconds.
+
+    Args:
+        ttl (float): Idle seconds after which a workspace is removed
+        keep (iterable): Workspace roots to keep regardless of age (e.g. ones with pending jobs)
+        base_dir (str): Folder holding all workspaces
+
+    Returns:
+        list: Roots of the removed workspaces
+    """
+    if not os.path.isdir(base_dir):
+        return []
+    keep = {os.path.abspath(root) for root in keep}
+    cutoff = time.time() - ttl
+    removed = []
+    for name in os.listdir(base_dir):
+        root = os.path.join(base_dir, name)
+        if not WORKSPACE_ID_PATTERN.match(name) or os.path.abspath(root) in keep:
+            continue
+        marker = os.path.join(root, LAST_USED_MARKER)
+        try:
+            last_used = os.path.getmtime(marker if os.path.exists(marker) else root)
+        except OSError:
+            continue
+        if last_used < cutoff:
+            shutil.rmtree(root, ignore_errors=True)
+            removed.append(root)
+    if removed:
+        print(f"🧹 Removed {len(removed)} abandoned workspace(s)")
+    return removed